@@ -0,0 +1,302 @@
+"""
+ASGI config for the event stream of delivery project.
+
+Streams the events of delivery_api.events as server-sent events, so the apps
+and the admin no longer poll for ride changes. Python 3 only, served next to
+the WSGI application (e.g. ``uvicorn delivery.asgi:application``) with the
+proxy routing /events/ here:
+
+    GET /events/rides/<id>/   changes of one ride, for its customer and driver
+    GET /events/fleet/        all ride changes and driver positions, for staff
+
+and answers the long polls of the apps, with the proxy routing them here too:
+
+    GET /api/rides/<id>/wait/?since=<version>
+                              the ride as soon as its version is past `since`,
+                              or 304 Not Modified after RIDE_WAIT_TIMEOUT
+
+Clients authenticate as on the REST API, with the session cookie or
+``Authorization: Basic ...``; and here also with a JWT token from
+/api/token-auth/, as ``Authorization: JWT <token>`` or ``?token=<token>``
+(EventSource cannot set headers).
+"""
+import asyncio
+import base64
+import binascii
+import json
+import os
+import re
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import parse_qs
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "delivery.settings")
+django.setup()
+
+import jwt  # noqa: E402
+import psycopg2  # noqa: E402
+import psycopg2.extensions  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib import auth  # noqa: E402
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework_jwt.settings import api_settings  # noqa: E402
+
+from delivery_api.events import ride_event  # noqa: E402
+from delivery_api.models import Ride, User  # noqa: E402
+from delivery_api.serializers import RideSerializer  # noqa: E402
+
+RIDE_PATH = re.compile(r'^/events/rides/(?P<pk>\d+)/$')
+FLEET_PATH = '/events/fleet/'
+WAIT_PATH = re.compile(r'^/api/rides/(?P<pk>\d+)/wait/$')
+
+
+class EventHub(object):
+    """
+    One LISTEN connection per process, fanning events out to subscriber queues.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.subscribers = set()
+
+    def start(self, loop):
+        if self.connection is not None:
+            return
+        database = settings.DATABASES['default']
+        connection = psycopg2.connect(
+            dbname=database['NAME'], user=database.get('USER'), password=database.get('PASSWORD'),
+            host=database.get('HOST') or None, port=database.get('PORT') or None)
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN {0}'.format(settings.EVENTS_CHANNEL))
+        loop.add_reader(connection.fileno(), self.receive, loop)
+        self.connection = connection
+
+    def receive(self, loop):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            # Lost the database: end all streams, clients reconnect and restart the hub
+            loop.remove_reader(self.connection.fileno())
+            self.connection = None
+            for accepts, queue in list(self.subscribers):
+                queue.put_nowait(None)
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            for accepts, queue in list(self.subscribers):
+                if accepts(event):
+                    queue.put_nowait(event)
+
+    def subscribe(self, accepts):
+        subscription = (accepts, asyncio.Queue())
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+
+hub = EventHub()
+
+
+def authenticate(scope):
+    """
+    User of the request, or None. Runs in a thread: it queries the database.
+    """
+    close_old_connections()
+    try:
+        headers = dict((name.decode('latin1').lower(), value.decode('latin1')) for name, value in scope['headers'])
+        token = parse_qs(scope.get('query_string', b'').decode('latin1')).get('token', [None])[0]
+        authorization = headers.get('authorization', '')
+        if authorization.startswith('JWT '):
+            token = authorization[4:]
+        elif authorization.startswith('Basic '):
+            try:
+                username, password = base64.b64decode(authorization[6:]).decode('utf-8').split(':', 1)
+            except (binascii.Error, UnicodeDecodeError, ValueError):
+                return None
+            return auth.authenticate(**{User.USERNAME_FIELD: username, 'password': password})
+        if token:
+            try:
+                payload = api_settings.JWT_DECODE_HANDLER(token)
+            except jwt.InvalidTokenError:
+                return None
+            return User.objects.filter(pk=api_settings.JWT_PAYLOAD_GET_USER_ID_HANDLER(payload),
+                                       is_active=True).first()
+
+        cookie = SimpleCookie(headers.get('cookie', ''))
+        if settings.SESSION_COOKIE_NAME not in cookie:
+            return None
+        session = import_module(settings.SESSION_ENGINE).SessionStore(cookie[settings.SESSION_COOKIE_NAME].value)
+        user = User.objects.filter(pk=session.get(SESSION_KEY), is_active=True).first()
+        if user is None or session.get(HASH_SESSION_KEY) != user.get_session_auth_hash():
+            return None
+        return user
+    finally:
+        close_old_connections()
+
+
+def ride_for(user, pk):
+    close_old_connections()
+    try:
+        ride = Ride.objects.filter(pk=pk).first()
+        if ride and (user.is_staff or user.pk in (ride.customer_id, ride.driver_id)):
+            return ride
+        return None
+    finally:
+        close_old_connections()
+
+
+def render_ride(ride):
+    close_old_connections()
+    try:
+        return JSONRenderer().render(RideSerializer(ride).data)
+    finally:
+        close_old_connections()
+
+
+async def respond(send, status, text, content_type=b'text/plain; charset=utf-8'):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type)]})
+    await send({'type': 'http.response.body', 'body': text if isinstance(text, bytes) else text.encode('utf-8')})
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream(receive, send, queue, initial):
+    async def write(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    async def write_event(event):
+        await write('event: {0}\ndata: {1}\n\n'.format(event['type'], json.dumps(event)))
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    await write('retry: 3000\n\n')
+    for event in initial:
+        await write_event(event)
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait([getter, disconnected], timeout=settings.EVENTS_KEEPALIVE,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                getter.cancel()
+                return
+            if getter not in done:
+                getter.cancel()
+                await write(': keep-alive\n\n')
+                continue
+            event = getter.result()
+            if event is None:
+                break
+            await write_event(event)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+
+async def wait(receive, send, queue, user, ride, since, loop):
+    """
+    Answer with `ride` once its version is past `since`, refetched after
+    each of its events, or with 304 when nothing changed before the timeout.
+    """
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    deadline = loop.time() + settings.RIDE_WAIT_TIMEOUT
+    try:
+        while ride.version <= since:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                return await respond(send, 304, '')
+            getter = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait([getter, disconnected], timeout=timeout,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                getter.cancel()
+                return
+            if getter not in done:
+                getter.cancel()
+            # Changes without an event (e.g. waypoints) are picked up on the timeout
+            ride = await loop.run_in_executor(None, ride_for, user, ride.pk) or ride
+        body = await loop.run_in_executor(None, render_ride, ride)
+        await respond(send, 200, body, b'application/json')
+    finally:
+        disconnected.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    loop = asyncio.get_event_loop()
+    match = RIDE_PATH.match(scope['path']) or WAIT_PATH.match(scope['path'])
+    if not match and scope['path'] != FLEET_PATH:
+        return await respond(send, 404, 'Not found')
+    waiting = match is not None and match.re is WAIT_PATH
+    if waiting:
+        try:
+            since = int(parse_qs(scope.get('query_string', b'').decode('latin1')).get('since', ['0'])[0])
+        except ValueError:
+            return await respond(send, 400, 'Invalid since')
+
+    user = await loop.run_in_executor(None, authenticate, scope)
+    if user is None:
+        return await respond(send, 401, 'Authentication required')
+
+    if match:
+        pk = int(match.group('pk'))
+        accepts = lambda event: event['type'] == 'ride' and event['id'] == pk
+    elif user.is_staff:
+        accepts = lambda event: True
+    else:
+        return await respond(send, 403, 'Staff only')
+
+    try:
+        hub.start(loop)
+    except psycopg2.Error:
+        return await respond(send, 503, 'Event stream unavailable')
+    subscription = hub.subscribe(accepts)
+    try:
+        initial = []
+        if match:
+            # Current state after subscribing, so no change is missed in between
+            ride = await loop.run_in_executor(None, ride_for, user, pk)
+            if ride is None:
+                return await respond(send, 404, 'Not found')
+            if waiting:
+                return await wait(receive, send, subscription[1], user, ride, since, loop)
+            initial.append(ride_event(ride))
+        await stream(receive, send, subscription[1], initial)
+    finally:
+        hub.unsubscribe(subscription)
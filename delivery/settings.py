@@ -191,6 +191,140 @@ LOCATION_FIELD = {
 }
 
 
+# Shared by all the workers, see the SharedCache* backends below
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+    }
+}
+
+GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
+
+# Directions lookups (see delivery_api/distance.py). Use
+# 'delivery_api.routing.RoadGraphProvider' for the local road graph or
+# 'delivery_api.distance.FakeDistanceProvider' to run offline.
+DISTANCE_PROVIDER = 'delivery_api.distance.GoogleDistanceProvider'
+
+# Used by 'delivery_api.routing.RoadGraphProvider'
+ROAD_GRAPH_FILE = os.path.join(BASE_DIR, 'road_graph.bin')
+ROAD_GRAPH_MAX_SNAP = 500  # meters
+
+DISTANCE_CACHE = {
+    # or 'delivery_api.distance.SharedCacheBackend' to share through CACHES
+    'BACKEND': 'delivery_api.distance.LocMemBackend',
+    'PRECISION': 7,
+    'TTL': 60 * 60,
+    'MAX_ENTRIES': 10000,
+}
+
+# Fares when no Tariff is active yet, see delivery_api/fares.py
+DEFAULT_TARIFF = {
+    'base_fee': 50,
+    'minimum_fare': 100,
+    'bands': [[None, 40]],
+    'multipliers': [],
+}
+FARE_TIME_ZONE = 'Africa/Nairobi'
+
+# Days of the DailyKPI rollup, and the seconds refresh_kpis looks back before
+# its previous run for late commits
+KPI_TIME_ZONE = FARE_TIME_ZONE
+KPI_REFRESH_OVERLAP = 10 * 60
+
+GCM_API_KEY = os.environ.get('GCM_API_KEY', '')
+
+# RideMessage push delivery, see delivery_api/push.py. Use
+# 'delivery_api.push.StubTransport' to run offline.
+PUSH_TRANSPORT = 'delivery_api.push.GCMTransport'
+PUSH_MAX_RETRIES = 3
+PUSH_RETRY_BACKOFF = 1.0  # seconds, doubled on every retry
+# Dispatches of an undelivered message before it is marked failed, and the
+# seconds until the next one, doubled after every attempt
+PUSH_MAX_ATTEMPTS = 5
+PUSH_ATTEMPT_DELAY = 60
+
+# Location pings that are not stored, see delivery_api.pings
+PING_FILTER = {
+    # Shared by the workers through the Redis cache; or
+    # 'delivery_api.pings.LocMemState' for a single process
+    'STATE': 'delivery_api.pings.SharedCacheState',
+    'MIN_DISTANCE': 10,  # meters
+    'MAX_SPEED': 60,  # meters per second
+    'HEARTBEAT': 60,  # seconds
+    'REANCHOR_AFTER': 3,  # plausible rejected pings in a row that replace the reference point
+    'REPORT_EVERY': 10000,
+}
+
+# Maximum number of points per /api/location/batch/ upload
+LOCATION_BATCH_SIZE = 500
+# Uploaded points older than this or later than now (give or take the
+# clock skew) are rejected, in seconds
+LOCATION_MAX_AGE = 24 * 60 * 60
+LOCATION_CLOCK_SKEW = 60
+
+# LocationLog partitions, see manage_location_partitions
+LOCATION_PARTITION_INTERVAL = 'week'
+LOCATION_PARTITION_AHEAD = 4
+LOCATION_RETENTION_DAYS = 180
+
+# Drivers offered to a customer, see DriverListView
+MAXIMUM_DRIVER_DISTANCE = 5  # km
+NEAREST_DRIVERS = 20
+# Radii searched in turn until NEAREST_DRIVERS are found
+DRIVER_SEARCH_RADII = (1, 2.5, MAXIMUM_DRIVER_DISTANCE)  # km
+# Search the database (within DRIVER_SEARCH_RADII) only when the live store
+# has no driver near or is down
+LIVE_DRIVERS_DB_FALLBACK = True
+
+# Live driver positions, see delivery_api.live
+LIVE_DRIVERS = {
+    # Shared by the workers through the Redis cache; or
+    # 'delivery_api.live.LocMemDriverStore' for a single process
+    'BACKEND': 'delivery_api.live.SharedCacheDriverStore',
+    'CELL_SIZE': 0.01,  # degrees, about 1.1 km
+    'TTL': 120,
+}
+
+# Pack the points of finalized rides into a RideTrajectory
+COMPACT_TRAJECTORIES = True
+
+# NOTIFY channel of ride and driver events, streamed by delivery/asgi.py
+EVENTS_CHANNEL = 'delivery_events'
+EVENTS_KEEPALIVE = 15  # seconds between two keep-alive comments
+RIDE_WAIT_TIMEOUT = 30  # seconds a long poll of a ride is held
+DRIVER_EVENT_INTERVAL = 10  # seconds between two position events of a driver
+
+# Seconds between two last_login updates of a user polling AccountMeView
+LAST_LOGIN_INTERVAL = 5 * 60
+
+# Zoom levels stored in the route cache of finalized rides
+ROUTE_CACHE_ZOOMS = (10, 13, 16)
+ROUTE_DEFAULT_ZOOM = 13
+ROUTE_MAX_ZOOM = 21
+
+# Finalized rides on the dashboard map by default, and at most (?limit=)
+MAP_RIDES = 10
+MAP_MAX_RIDES = 500
+
+# Location history tiles, see delivery_api/tiles.py
+LOCATION_TILES = {
+    'CACHE': 'default',
+    'TIMEOUT': 60 * 60,  # seconds a rendered tile is reused
+    'PIXELS': 4,  # points closer than this many tile pixels are merged
+    'MAX_ZOOM': 20,
+}
+
+# Error reports of the apps, see delivery_api/errorlog.py
+ERROR_LOG = {
+    'BATCH_SIZE': 100,  # reports per request
+    'CACHE': 'default',
+    'TOKEN_TTL': 5 * 60,  # seconds a token's user is cached
+    'SAMPLE_ABOVE': 60,  # reports of one error per minute written in full
+    'SAMPLE_RATE': 0.1,  # share of the reports written above that
+}
+
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -32,6 +32,9 @@ urlpatterns = [
     url(r'^map$', MapView.as_view(), name='map'),
     url(r'^map/(?P<pk>[0-9]+)$', RideMapView.as_view(), name='ride-map'),
     url(r'^user/(?P<pk>[0-9]+)$', UserMapView.as_view(), name='user-map'),
+    url(r'^fleet$', views.FleetMapView.as_view(), name='fleet-map'),
+    url(r'^tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)(?:\.(?P<format>pbf|geojson))?$',
+        views.LocationTileView.as_view(), name='location-tile'),
     url(r'^drivers/$', DriverListView.as_view(), name='driver-list'),
     url(r'^drivers/(?P<pk>[0-9]+)$', DriverDetailView.as_view(), name='driver-detail'),
     url(r'^kpi$', KpiView.as_view(), name='KpiView'),
@@ -42,6 +45,10 @@ urlpatterns = [
 
     url(r'^api/rides/$', views.RideListView.as_view(), name='ride-list'),
     url(r'^api/rides/(?P<pk>[0-9]+)/$', views.RideDetailView.as_view(), name='ride-detail'),
+    url(r'^api/rides/(?P<pk>[0-9]+)/route/$', views.RideRouteView.as_view(), name='ride-route'),
+    url(r'^api/rides/(?P<pk>[0-9]+)/wait/$', views.RideWaitView.as_view(), name='ride-wait'),
+    url(r'^api/rides/(?P<pk>[0-9]+)/(?P<transition>request|accept|decline|cancel|dropoff|payment|rate|finalize)/$',
+        views.RideTransitionView.as_view(), name='ride-transition'),
     url(r'^api/recent-rides/$', views.RecentRideListView.as_view(), name='recent-ride-list'),
 
     url(r'^api/drivers/$', DriverListView.as_view(), name='driver-list'),
@@ -52,6 +59,7 @@ urlpatterns = [
     url(r'^api/token-auth/', obtain_jwt_token,name='token-auth'),
 
     url(r'^api/location/$', views.LocationLogView.as_view(), name='location-log'),
+    url(r'^api/location/batch/$', views.LocationBatchView.as_view(), name='location-batch'),
     url(r'^api/auth/', include('rest_framework_social_oauth2.urls')),
 
     url(r'^api/errors/$', views.ErrorLogView.as_view(), name='error-log'),
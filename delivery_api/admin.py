@@ -6,11 +6,10 @@ from django.conf.urls import url
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.gis import admin
+from django.contrib.admin.views.main import ChangeList
 
 from django.core.urlresolvers import reverse
-from django.db import connection
 from django.db.models import Case, When
-from django.db.models import Count
 from django.db.models import Sum
 from django.db.models.fields.files import FieldFile
 from django.db.models.functions import Coalesce
@@ -23,11 +22,12 @@ from django.utils.translation import ugettext_lazy as _
 
 from rangefilter.filter import DateRangeFilter
 
+from delivery_api import kpis
 from delivery_api.exceptions import PaymentException
 from delivery_api.models import (
     KPI, RiderRevenu, BulkMessage, PaymentResponseLog, Ride,
     User, RideLog, RideMessage, LocationLog, SystemMessage,
-    Payment, PaymentResponse, ErrorLog
+    Payment, PaymentCallback, PaymentResponse, ErrorLog, Tariff
 )
 
 
@@ -58,8 +58,10 @@ def prep_field(request, obj, field, manyToManySep=';'):
 
 
 def export_as_csv_action(description="Export as CSV", fields=None, exclude=None, header=True,
-                         manyToManySep=';'):
-    """ This function returns an export csv action. """
+                         manyToManySep=';', prepare=None):
+    """ This function returns an export csv action. `prepare` is an optional
+    callable applied to the queryset first, e.g. to add annotations.
+    """
 
     def export_as_csv(modeladmin, request, queryset):
         """ 
@@ -91,6 +93,9 @@ def export_as_csv_action(description="Export as CSV", fields=None, exclude=None,
         if header:
             writer.writerow(labels if labels else field_names)
 
+        if prepare:
+            queryset = prepare(queryset)
+
         for obj in queryset:
             writer.writerow([prep_field(request, obj, field, manyToManySep) for field in field_names])
         return response
@@ -239,6 +244,17 @@ class PaymentInline(admin.StackedInline):
     can_delete = False
 
 
+class RideChangeList(ChangeList):
+
+    def get_results(self, request):
+        super(RideChangeList, self).get_results(request)
+        # Route lengths for the whole page in one query
+        self.result_list = list(self.result_list)
+        meters = Ride.objects.filter(pk__in=[obj.pk for obj in self.result_list]).route_meters()
+        for obj in self.result_list:
+            obj.route_meters = meters.get(obj.pk)
+
+
 class RideAdmin(admin.OSMGeoAdmin):
 
     openlayers_url = 'https://cdnjs.cloudflare.com/ajax/libs/openlayers/2.13.1/OpenLayers.js'
@@ -255,7 +271,7 @@ class RideAdmin(admin.OSMGeoAdmin):
         'id', 'customer', 'driver',
         'ride_date', 'ride_time',
         'ride_week', 'state',
-        'waypoints_distance', 'fare',
+        'waypoints_km', 'route_km', 'fare',
         'payment_method', 'customer_rating',
         'driver_rating',)
 
@@ -278,13 +294,18 @@ class RideAdmin(admin.OSMGeoAdmin):
         ('driver__username', 'driver'),
         ('state', 'state'),
         ('meters', 'distance'),
+        ('route_meters', 'route meters'),
         ('orig', 'origin'),
         ('dest', 'destination'),
         ('fare__amount', 'fare'),
         ('payment_method', 'payment method'),
     ]
 
-    actions = (export_as_csv_action(fields=export_fields),)
+    actions = (export_as_csv_action(fields=export_fields,
+                                    prepare=lambda queryset: queryset.with_route_meters()),)
+
+    def get_changelist(self, request, **kwargs):
+        return RideChangeList
 
     def map(self, obj):
         return "<iframe style='width:600px; height: 400px; border: 0'" \
@@ -337,10 +358,24 @@ class RideAdmin(admin.OSMGeoAdmin):
         return obj.waypoints_distance
     waypoints_distance.short_description = 'dist.' 
 
+    def waypoints_km(self, obj):
+        # The running total only, waypoints_distance reads the points of older rides
+        if not obj.waypoints_count:
+            return '-'
+        return "%.1f" % (obj.waypoints_length * 100)
+    waypoints_km.admin_order_field = 'waypoints_length'
+    waypoints_km.short_description = 'dist.'
+
+    def route_km(self, obj):
+        if getattr(obj, 'route_meters', None) is None:
+            return '-'
+        return "%.1f" % (obj.route_meters / 1000.0)
+    route_km.short_description = 'route km'
+
     inlines = (RideLogInline, RideMessageInline, PaymentInline)
 
     class Media:
-        js = ('assets/js/auto-refresh.js',)
+        js = ('assets/js/ride-live.js',)
 
 admin.site.register(Ride, RideAdmin)
 
@@ -458,6 +493,20 @@ class PaymentResponseLogAdmin(admin.ModelAdmin):
 admin.site.register(PaymentResponseLog, PaymentResponseLogAdmin)
 
 
+class PaymentCallbackAdmin(admin.ModelAdmin):
+
+    readonly_fields = ('created', 'processed', 'result', 'payment', 'payload', 'body')
+    list_display = ('created', 'processed', 'result', 'payment')
+    list_filter = ('result', )
+    raw_id_fields = ('payment', )
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(PaymentCallback, PaymentCallbackAdmin)
+
+
 class RideLogAdmin(admin.OSMGeoAdmin):
 
     openlayers_url = 'https://cdnjs.cloudflare.com/ajax/libs/openlayers/2.13.1/OpenLayers.js'
@@ -475,10 +524,20 @@ class RideLogAdmin(admin.OSMGeoAdmin):
 admin.site.register(RideLog, RideLogAdmin)
 
 
+class TariffAdmin(admin.ModelAdmin):
+
+    list_display = ('name', 'version', 'active_from', 'base_fee', 'minimum_fare')
+    readonly_fields = ('version', 'created')
+    fields = ('name', 'version', 'active_from', 'base_fee', 'minimum_fare', 'bands', 'multipliers', 'created')
+
+admin.site.register(Tariff, TariffAdmin)
+
+
 class ErrorLogAdmin(admin.ModelAdmin):
 
-    readonly_fields = ('created', 'ride', 'user', 'message', 'data')
-    list_display = ('created', 'level', 'message', 'user')
+    readonly_fields = ('created', 'last_seen', 'count', 'fingerprint', 'ride', 'user', 'message', 'data')
+    list_display = ('last_seen', 'level', 'message', 'count', 'created', 'user')
+    ordering = ('-last_seen', '-created')
 
     list_filter = ('level', )
 
@@ -531,23 +590,23 @@ class RiderRevenuAdmin(admin.ModelAdmin):
 @admin.register(KPI)
 class KPIAdmin(admin.ModelAdmin):
 
-    date_hierarchy = 'date_joined'
-
     change_list_template = 'admin_dashboard/kpi.html'
 
+    def get_queryset(self, request):
+        # The page only shows the DailyKPI rollup
+        return super(KPIAdmin, self).get_queryset(request).none()
+
     def changelist_view(self, request, extra_context=None):
+        # Not list filters of the changelist
+        request.GET = request.GET.copy()
+        params = dict((name, request.GET.pop(name)[-1]) for name in ('from', 'to', 'period') if name in request.GET)
+        start, end, period = kpis.report_options(params)
 
         response = super(KPIAdmin, self).changelist_view(request, extra_context=None)
+        if not hasattr(response, 'context_data'):
+            return response
 
-        truncate_date = connection.ops.date_trunc_sql('month', 'date_joined')
-        qs = User.objects.extra({'month': truncate_date})
-
-        metrics = {
-            'total_customer': Count(Case(When(is_driver=False, then='pk'))),
-            'total_rider': Count(Case(When(is_driver=True, then='pk'))),
-            }
-
-        response.context_data['signups'] = qs.values('month').annotate(**metrics).order_by('month')
-        response.context_data['signups_total'] = dict(qs.aggregate(**metrics))
-
-        return response
\ No newline at end of file
+        rows = kpis.report(start, end, period)
+        response.context_data.update(rows=rows[:-1], total=rows[-1], start=start, end=end,
+                                     period=period, periods=kpis.PERIODS)
+        return response
@@ -0,0 +1,126 @@
+"""
+Ingestion of M-Pesa payment callbacks.
+
+MpesaStatusUpdate only stores the raw payload as a PaymentCallback and acks,
+so answering the provider takes one INSERT whatever the traffic. apply()
+picks up the queued callbacks in batches and applies them to the Payment
+with the callback's CheckoutRequestID as remote_id:
+
+- a receipt number that is already on a payment is a duplicate delivery and
+  changes nothing;
+- a successful payment gets its receipt number, and its ride moves from
+  'payment' to 'rating' (or 'finalized' once both sides rated);
+- a failed payment is marked Failed, the customer can try again.
+
+Each callback is applied in its own savepoint inside the batch transaction
+and gets a `result`. The payment_callback_worker command runs apply() in a
+loop.
+"""
+import logging
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from delivery_api.models import Payment, PaymentCallback, Ride
+from delivery_api.transitions import transition_ride
+
+logger = logging.getLogger(__name__)
+
+APPLIED = 'applied'
+FAILED = 'failed'
+DUPLICATE = 'duplicate'
+UNMATCHED = 'unmatched'
+INVALID = 'invalid'
+ERROR = 'error'
+
+
+def parse(payload):
+    """
+    (checkout request id, result code, receipt number) of an STK push callback
+    ``{"Body": {"stkCallback": {...}}}`` or of the same fields posted flat, or
+    None when the payload is not a callback.
+    """
+    if not isinstance(payload, dict):
+        return None
+    body = payload.get('Body')
+    callback = body.get('stkCallback') if isinstance(body, dict) else None
+    if not isinstance(callback, dict):
+        callback = payload
+    checkout_id = callback.get('CheckoutRequestID')
+    if not checkout_id:
+        return None
+    try:
+        result_code = int(callback.get('ResultCode'))
+    except (TypeError, ValueError):
+        return None
+    metadata = callback.get('CallbackMetadata')
+    items = metadata.get('Item') if isinstance(metadata, dict) else None
+    metadata = dict((item.get('Name'), item.get('Value')) for item in items or [] if isinstance(item, dict))
+    receipt = metadata.get('MpesaReceiptNumber') or callback.get('MpesaReceiptNumber') or ''
+    return checkout_id, result_code, str(receipt)
+
+
+def apply(limit=500):
+    """
+    Apply up to `limit` queued callbacks, oldest first. Returns {result: count}.
+    """
+    results = {}
+    with transaction.atomic():
+        # Several workers can run side by side, each takes its own rows
+        callbacks = list(PaymentCallback.objects.select_for_update(skip_locked=True)
+                         .filter(processed__isnull=True).order_by('created')[:limit])
+        if not callbacks:
+            return results
+        parsed = dict((callback.pk, parse(callback.payload)) for callback in callbacks)
+
+        checkout_ids = set(data[0] for data in parsed.values() if data)
+        payments = dict((payment.remote_id, payment) for payment in
+                        Payment.objects.select_for_update().filter(remote_id__in=checkout_ids).order_by('pk'))
+        # Locked in primary key order, as other workers and the transition views do
+        rides = Ride.objects.select_for_update().order_by('pk').in_bulk(
+            set(payment.ride_id for payment in payments.values()))
+        receipts = set(data[2] for data in parsed.values() if data and data[2])
+        seen = set(Payment.objects.filter(mpesa_code__in=receipts).values_list('mpesa_code', flat=True))
+
+        stamp = now()
+        groups = {}
+        for callback in callbacks:
+            data = parsed[callback.pk]
+            payment = payments.get(data[0]) if data else None
+            try:
+                with transaction.atomic():
+                    result = apply_one(data, payment, rides.get(payment.ride_id) if payment else None, seen)
+            except Exception:
+                logger.exception('Payment callback %s could not be applied', callback.pk)
+                result = ERROR
+            groups.setdefault((result, payment.pk if payment else None), []).append(callback.pk)
+            results[result] = results.get(result, 0) + 1
+
+        for (result, payment_id), pks in groups.items():
+            PaymentCallback.objects.filter(pk__in=pks).update(result=result, payment=payment_id, processed=stamp)
+    return results
+
+
+def apply_one(data, payment, ride, seen):
+    if data is None:
+        return INVALID
+    if payment is None:
+        return UNMATCHED
+    checkout_id, result_code, receipt = data
+    if (receipt and receipt in seen) or payment.status == 'Completed':
+        return DUPLICATE
+
+    if result_code != 0:
+        payment.status = 'Failed'
+        payment.save()
+        return FAILED
+
+    payment.status = 'Completed'
+    payment.mpesa_code = receipt
+    payment.save()
+    if receipt:
+        seen.add(receipt)
+    if ride is not None and ride.state == 'payment':
+        rated = ride.customer_rating and ride.driver_rating
+        transition_ride(ride, 'finalize' if rated else 'rate')
+    return APPLIED
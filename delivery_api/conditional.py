@@ -0,0 +1,49 @@
+"""
+Conditional GET for the endpoints the apps poll.
+
+A view returns a cheap version of its response from get_version(), looked up
+before anything is serialized. Unchanged responses are answered with 304 Not
+Modified and an empty body, others carry the ETag and Last-Modified headers
+to revalidate with.
+"""
+import hashlib
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin(object):
+
+    def get_version(self):
+        """
+        (token, last_modified) of the response, or None to skip the check.
+        """
+        return None
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_version()
+        if version is None:
+            return super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+
+        token, last_modified = version
+        etag = quote_etag(hashlib.md5(token.encode('utf-8')).hexdigest())
+        last_modified = timegm(last_modified.utctimetuple())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            # Clients may keep the response, but have to revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def version_of(pk, *stamps):
+    """
+    Version of object `pk` from its and its related objects' modification
+    stamps; None stamps (e.g. no driver yet) are part of the token.
+    """
+    token = '{0}:{1}'.format(pk, ':'.join(stamp.isoformat() if stamp else '' for stamp in stamps))
+    return token, max(stamp for stamp in stamps if stamp)
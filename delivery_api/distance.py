@@ -0,0 +1,241 @@
+"""
+Distance and duration lookups between two points, as stored in the
+Ride.driver_distance, Ride.live_distance and Ride.distance JSON fields:
+
+    {'distance': '3.2 km', 'duration': '9 mins', 'meters': 3200}
+
+Lookups go through a cache keyed on the geohash cells of origin and
+destination, so repeat lookups between the same neighbourhoods are answered
+locally. The provider and cache backend are configured in settings:
+
+    DISTANCE_PROVIDER = 'delivery_api.distance.GoogleDistanceProvider'
+    DISTANCE_CACHE = {
+        'BACKEND': 'delivery_api.distance.LocMemBackend',
+        'PRECISION': 7,
+        'TTL': 3600,
+        'MAX_ENTRIES': 10000,
+    }
+"""
+import threading
+import time
+from collections import OrderedDict
+from math import asin, cos, radians, sin, sqrt
+
+import googlemaps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+EARTH_RADIUS = 6371000.0
+
+
+def geohash(point, precision=7):
+    """
+    Geohash of a Point; 7 characters is a cell of roughly 150 x 150 m.
+    """
+    lng, lat = point.coords[0], point.coords[1]
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord > mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def haversine(origin, destination):
+    """
+    Great circle distance between two Points, or (lng, lat) pairs, in meters.
+    """
+    origin, destination = getattr(origin, 'coords', origin), getattr(destination, 'coords', destination)
+    lng1, lat1, lng2, lat2 = map(radians, (origin[0], origin[1], destination[0], destination[1]))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(sqrt(a))
+
+
+def format_distance(meters):
+    if meters < 1000:
+        return '{0} m'.format(int(meters))
+    return '{0:.1f} km'.format(meters / 1000.0)
+
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60.0))
+    if minutes < 60:
+        return '{0} min{1}'.format(minutes, '' if minutes == 1 else 's')
+    return '{0} hour{1} {2} mins'.format(minutes // 60, '' if minutes // 60 == 1 else 's', minutes % 60)
+
+
+class GoogleDistanceProvider(object):
+    """
+    Driving distance from the Google Distance Matrix API.
+    """
+
+    def __init__(self):
+        self.client = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+
+    def __call__(self, origin, destination):
+        result = self.client.distance_matrix(
+            origins=[(origin.coords[1], origin.coords[0])],
+            destinations=[(destination.coords[1], destination.coords[0])],
+            mode='driving')
+        element = result['rows'][0]['elements'][0]
+        if element.get('status') != 'OK':
+            return None
+        return {
+            'distance': element['distance']['text'],
+            'duration': element['duration']['text'],
+            'meters': element['distance']['value'],
+        }
+
+
+class FakeDistanceProvider(object):
+    """
+    Offline provider for tests and benchmarks: straight line distance times a
+    detour factor, driven at a constant speed.
+    """
+    detour = 1.3
+    speed = 25 / 3.6  # m/s
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, origin, destination):
+        self.calls += 1
+        meters = int(haversine(origin, destination) * self.detour)
+        return {
+            'distance': format_distance(meters),
+            'duration': format_duration(meters / self.speed),
+            'meters': meters,
+        }
+
+
+class LocMemBackend(object):
+    """
+    In-process LRU cache with per entry expiry.
+    """
+
+    def __init__(self, max_entries=10000, **kwargs):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, value = self.entries.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            # Re-insert as most recently used
+            self.entries[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedCacheBackend(object):
+    """
+    Django cache shared between processes; eviction is left to the cache server.
+    """
+
+    def __init__(self, cache_alias='default', **kwargs):
+        self.cache = caches[cache_alias]
+
+    def get(self, key):
+        return self.cache.get('distance:{0}'.format(key))
+
+    def set(self, key, value, ttl):
+        self.cache.set('distance:{0}'.format(key), value, ttl)
+
+    def clear(self):
+        pass
+
+
+class DistanceCache(object):
+
+    def __init__(self, provider, backend, precision=7, ttl=3600):
+        self.provider = provider
+        self.backend = backend
+        self.precision = precision
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, origin, destination):
+        return '{0}:{1}'.format(geohash(origin, self.precision), geohash(destination, self.precision))
+
+    def lookup(self, origin, destination):
+        key = self.key(origin, destination)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self.provider(origin, destination)
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+        }
+
+
+_distance_cache = None
+
+
+def get_distance_cache():
+    global _distance_cache
+    if _distance_cache is None:
+        options = dict((key.lower(), value) for key, value in settings.DISTANCE_CACHE.items())
+        backend = import_string(options.pop('backend'))(**options)
+        _distance_cache = DistanceCache(
+            provider=import_string(settings.DISTANCE_PROVIDER)(),
+            backend=backend,
+            precision=options.get('precision', 7),
+            ttl=options.get('ttl', 3600))
+    return _distance_cache
+
+
+@receiver(setting_changed)
+def reset_distance_cache(**kwargs):
+    global _distance_cache
+    if kwargs['setting'] in ('DISTANCE_PROVIDER', 'DISTANCE_CACHE', 'CACHES'):
+        _distance_cache = None
+
+
+def calculate_distance(origin, destination):
+    if not origin or not destination:
+        return None
+    return get_distance_cache().lookup(origin, destination)
@@ -0,0 +1,153 @@
+"""
+Ingestion of the error reports of the apps.
+
+Reports are grouped by fingerprint: their level, and message and data with
+the numbers blanked out. Each group is one upsert of the ErrorLog row of its
+fingerprint, which counts the reports, keeps when the error was first and
+last seen and the latest example (message, data, user and ride).
+
+Above SAMPLE_ABOVE reports of one fingerprint per minute (in this process)
+only a SAMPLE_RATE share of the groups is written, counting for the skipped
+ones, so an error spike costs a fraction of the writes. Tokens are resolved
+to users through the cache. Configured in settings:
+
+    ERROR_LOG = {
+        'BATCH_SIZE': 100,  # reports per request
+        'CACHE': 'default',
+        'TOKEN_TTL': 5 * 60,
+        'SAMPLE_ABOVE': 60,
+        'SAMPLE_RATE': 0.1,
+    }
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.timezone import now
+from oauth2_provider.models import AccessToken
+
+from delivery_api.models import Ride
+
+NUMBERS = re.compile(r'\d+')
+
+UPSERT_SQL = """
+    INSERT INTO delivery_api_errorlog
+        (fingerprint, count, created, last_seen, level, message, data, token, user_id, ride_id)
+    VALUES {values}
+    ON CONFLICT (fingerprint) DO UPDATE SET
+        count = delivery_api_errorlog.count + EXCLUDED.count,
+        last_seen = EXCLUDED.last_seen,
+        message = EXCLUDED.message,
+        data = EXCLUDED.data,
+        token = EXCLUDED.token,
+        user_id = COALESCE(EXCLUDED.user_id, delivery_api_errorlog.user_id),
+        ride_id = COALESCE(EXCLUDED.ride_id, delivery_api_errorlog.ride_id)
+"""
+
+
+def fingerprint(level, message, data):
+    text = '\n'.join([level, NUMBERS.sub('0', message), NUMBERS.sub('0', data)])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def user_for_token(token):
+    """
+    Id of the user of an OAuth access token, or None.
+    """
+    cache = caches[settings.ERROR_LOG['CACHE']]
+    key = 'errortoken:{0}'.format(hashlib.sha1(token.encode('utf-8')).hexdigest())
+    user_id = cache.get(key)
+    if user_id is None:
+        # 0 caches unknown tokens as well
+        user_id = AccessToken.objects.filter(token=token).values_list('user_id', flat=True).first() or 0
+        cache.set(key, user_id, settings.ERROR_LOG['TOKEN_TTL'])
+    return user_id or None
+
+
+class ErrorSampler(object):
+    """
+    Reports per fingerprint in the current minute, and whether to write them.
+    """
+
+    def __init__(self, sample_above=60, sample_rate=0.1, window=60, max_entries=10000, **kwargs):
+        self.sample_above = sample_above
+        self.sample_rate = sample_rate
+        self.window = window
+        self.max_entries = max_entries
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def weight(self, key, reports, when=None):
+        """
+        Count to write `reports` reports of fingerprint `key` with, 0 to skip them.
+        """
+        when = time.time() if when is None else when
+        with self.lock:
+            start, seen = self.windows.get(key, (when, 0))
+            if when - start >= self.window:
+                start, seen = when, 0
+            self.windows[key] = (start, seen + reports)
+            if len(self.windows) > self.max_entries:
+                self.windows = dict((k, v) for k, v in self.windows.items() if when - v[0] < self.window)
+        if seen + reports <= self.sample_above:
+            return reports
+        if random.random() < self.sample_rate:
+            return int(round(reports / self.sample_rate))
+        return 0
+
+
+_sampler = None
+
+
+def get_error_sampler():
+    global _sampler
+    if _sampler is None:
+        options = dict((key.lower(), value) for key, value in settings.ERROR_LOG.items())
+        _sampler = ErrorSampler(**options)
+    return _sampler
+
+
+@receiver(setting_changed)
+def reset_error_sampler(**kwargs):
+    global _sampler
+    if kwargs['setting'] == 'ERROR_LOG':
+        _sampler = None
+
+
+def record(reports):
+    """
+    Store validated reports (level, message, data and optional token and
+    ride) in one statement. Returns the number of ErrorLog rows written.
+    """
+    groups = OrderedDict()
+    for report in reports:
+        key = fingerprint(report['level'], report.get('message', ''), report.get('data', ''))
+        # The latest report of a group is its example
+        groups[key] = (groups.get(key, (0, None))[0] + 1, report)
+
+    ride_ids = set(report['ride'] for count, report in groups.values() if report.get('ride'))
+    rides = set(Ride.objects.filter(pk__in=ride_ids).values_list('pk', flat=True)) if ride_ids else set()
+    sampler = get_error_sampler()
+    stamp = now()
+    params = []
+    for key, (count, report) in groups.items():
+        weight = sampler.weight(key, count)
+        if not weight:
+            continue
+        token = report.get('token', '')
+        params += [key, weight, stamp, stamp, report['level'], report.get('message', ''), report.get('data', ''),
+                   token, user_for_token(token) if token else None,
+                   report['ride'] if report.get('ride') in rides else None]
+    rows = len(params) // 10
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT_SQL.format(values=', '.join(['(' + ', '.join(['%s'] * 10) + ')'] * rows)), params)
+    return rows
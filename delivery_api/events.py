@@ -0,0 +1,57 @@
+"""
+Ride and fleet events published through PostgreSQL NOTIFY.
+
+Events are small JSON objects sent on the EVENTS_CHANNEL channel; NOTIFY is
+transactional, so listeners only see changes that were committed. The ASGI
+app in delivery/asgi.py LISTENs on the channel and streams the events to the
+apps and the admin as server-sent events:
+
+    {"type": "ride", "id": 12, "state": "accepted", "state_display": "Accepted",
+     "driver": 3, "customer": 7, "updated": "...", "version": 1792263600000000}
+    {"type": "driver", "id": 3, "state": "driving", "lng": 36.82, "lat": -1.29}
+
+Driver positions come with every accepted ping, so they are published at
+most every DRIVER_EVENT_INTERVAL seconds per driver (throttled through the
+shared cache) to keep NOTIFY out of most of the ingest requests.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+
+def publish(event):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [settings.EVENTS_CHANNEL, json.dumps(event)])
+
+
+def ride_event(ride):
+    return {
+        'type': 'ride',
+        'id': ride.pk,
+        'state': ride.state,
+        'state_display': ride.get_state_display(),
+        'driver': ride.driver_id,
+        'customer': ride.customer_id,
+        'updated': ride.updated.isoformat() if ride.updated else None,
+        'version': ride.version,
+    }
+
+
+def ride_changed(ride):
+    publish(ride_event(ride))
+
+
+def driver_moved(driver, point):
+    # add() only succeeds once per interval, whichever process gets the ping
+    if not caches['default'].add('events:driver:{0}'.format(driver.pk), 1, settings.DRIVER_EVENT_INTERVAL):
+        return False
+    publish({
+        'type': 'driver',
+        'id': driver.pk,
+        'state': driver.state,
+        'lng': point.coords[0],
+        'lat': point.coords[1],
+    })
+    return True
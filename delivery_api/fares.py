@@ -0,0 +1,43 @@
+"""
+Vectorized fare calculation.
+
+A tariff is a base fee, per km bands, a minimum fare and time of day
+multipliers. TariffEngine.price() prices a whole array of distances in one
+call, which is what the re-pricing command relies on.
+"""
+import numpy as np
+
+
+class TariffEngine(object):
+
+    def __init__(self, base_fee=0, minimum_fare=0, bands=None, multipliers=None):
+        """
+        bands: [[up_to_km, price_per_km], ...], the last band may use None for no limit.
+        multipliers: [[from_hour, to_hour, multiplier], ...] in local time,
+        to_hour exclusive; ranges may wrap around midnight.
+        """
+        self.base_fee = float(base_fee)
+        self.minimum_fare = float(minimum_fare)
+
+        bands = bands or [[None, 0]]
+        uppers = np.array([np.inf if upper is None else float(upper) for upper, rate in bands])
+        self.lowers = np.concatenate(([0.0], uppers[:-1]))
+        self.widths = uppers - self.lowers
+        self.rates = np.array([float(rate) for upper, rate in bands])
+
+        self.hour_multipliers = np.ones(24)
+        for start, end, multiplier in multipliers or []:
+            hours = np.arange(start, end if end > start else end + 24) % 24
+            self.hour_multipliers[hours] = float(multiplier)
+
+    def price(self, meters, hours=None):
+        """
+        Fares for an array of distances in meters, and optionally the local
+        hour each ride started.
+        """
+        km = np.asarray(meters, dtype=float).reshape(-1, 1) / 1000
+        distance_charge = (np.clip(km - self.lowers, 0, self.widths) * self.rates).sum(axis=1)
+        fares = self.base_fee + distance_charge
+        if hours is not None:
+            fares = fares * self.hour_multipliers[np.asarray(hours, dtype=int)]
+        return np.round(np.maximum(fares, self.minimum_fare), 2)
@@ -0,0 +1,157 @@
+"""
+Daily KPI rollup, see DailyKPI.
+
+refresh() recomputes whole days (in KPI_TIME_ZONE) from User, Ride and
+LocationLog, one statement per batch of days; changed_days() finds the days
+touched since the previous refresh, so the refresh_kpis command only
+recomputes those. report() reads any range from the rollup in one query,
+grouped by day, week, month, quarter or year, with a total row.
+
+The rollup keeps the ids of the paying customers and of the active and
+available riders of each day, so these are counted distinct over a period
+instead of summed.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_date
+
+PERIODS = ('day', 'week', 'month', 'quarter', 'year')
+
+REFRESH_SQL = """
+    INSERT INTO delivery_api_dailykpi (
+        date, customer_signups, rider_signups, rides_finalized, revenue_cash, revenue_mpesa, revenue_total,
+        customers_paying, riders_active, riders_available, refreshed)
+    SELECT day.date, signups.customers, signups.riders, rides.finalized, rides.cash, rides.mpesa, rides.total,
+           rides.customers, rides.drivers, pings.drivers, now()
+    FROM (
+        SELECT date, date::timestamp AT TIME ZONE %(tz)s AS start, (date + 1)::timestamp AT TIME ZONE %(tz)s AS until
+        FROM unnest(%(days)s::date[]) AS date
+    ) day
+    CROSS JOIN LATERAL (
+        SELECT count(*) FILTER (WHERE NOT is_driver) AS customers, count(*) FILTER (WHERE is_driver) AS riders
+        FROM delivery_api_user
+        WHERE date_joined >= day.start AND date_joined < day.until
+    ) signups
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS finalized,
+               COALESCE(sum(fare) FILTER (WHERE payment_method = 'cash'), 0) AS cash,
+               COALESCE(sum(fare) FILTER (WHERE payment_method = 'mpesa'), 0) AS mpesa,
+               COALESCE(sum(fare), 0) AS total,
+               COALESCE(array_agg(DISTINCT customer_id) FILTER (WHERE customer_id IS NOT NULL), '{{}}') AS customers,
+               COALESCE(array_agg(DISTINCT driver_id) FILTER (WHERE driver_id IS NOT NULL), '{{}}') AS drivers
+        FROM delivery_api_ride
+        WHERE state = 'finalized' AND created >= day.start AND created < day.until
+    ) rides
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(array_agg(DISTINCT log.user_id), '{{}}') AS drivers
+        FROM delivery_api_locationlog log
+        JOIN delivery_api_user u ON u.id = log.user_id AND u.is_driver
+        WHERE log.created >= day.start AND log.created < day.until
+    ) pings
+    ON CONFLICT (date) DO UPDATE SET {updates}
+"""
+
+COLUMNS = ('customer_signups', 'rider_signups', 'rides_finalized', 'revenue_cash', 'revenue_mpesa',
+           'revenue_total', 'customers_paying', 'riders_active', 'riders_available', 'refreshed')
+
+# Days of the rides changed since the last refresh, of the users that joined
+# since, and all days since (for the pings)
+CHANGED_DAYS_SQL = """
+    SELECT DISTINCT (stamp AT TIME ZONE %(tz)s)::date FROM (
+        SELECT created AS stamp FROM delivery_api_ride WHERE updated >= %(since)s
+        UNION ALL
+        SELECT date_joined FROM delivery_api_user WHERE date_joined >= %(since)s
+        UNION ALL
+        SELECT generate_series(%(since)s::timestamptz, now(), interval '1 day')
+        UNION ALL
+        SELECT now()
+    ) changes
+    ORDER BY 1
+"""
+
+REPORT_SQL = """
+    WITH days AS (
+        SELECT *, date_trunc(%(period)s, date)::date AS period
+        FROM delivery_api_dailykpi
+        WHERE date >= %(start)s AND date <= %(end)s
+    )
+    SELECT p.period,
+           sum(p.customer_signups), sum(p.rider_signups), sum(p.rides_finalized),
+           sum(p.revenue_cash), sum(p.revenue_mpesa), sum(p.revenue_total),
+           (SELECT count(DISTINCT id) FROM days d, unnest(d.customers_paying) id
+            WHERE p.period IS NULL OR d.period = p.period),
+           (SELECT count(DISTINCT id) FROM days d, unnest(d.riders_active) id
+            WHERE p.period IS NULL OR d.period = p.period),
+           (SELECT count(DISTINCT id) FROM days d, unnest(d.riders_available) id
+            WHERE p.period IS NULL OR d.period = p.period)
+    FROM days p
+    GROUP BY ROLLUP (p.period)
+    ORDER BY p.period NULLS LAST
+"""
+
+REPORT_COLUMNS = ('period', 'customer_signups', 'rider_signups', 'rides_finalized', 'revenue_cash',
+                  'revenue_mpesa', 'revenue_total', 'customers_paying', 'riders_active', 'riders_available')
+
+
+def refresh(days, batch_size=31):
+    """
+    Recompute the rollup of `days` (dates).
+    """
+    days = sorted(set(days))
+    sql = REFRESH_SQL.format(updates=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in COLUMNS))
+    with connection.cursor() as cursor:
+        for offset in range(0, len(days), batch_size):
+            cursor.execute(sql, {'tz': settings.KPI_TIME_ZONE, 'days': days[offset:offset + batch_size]})
+    return days
+
+
+def changed_days(since):
+    with connection.cursor() as cursor:
+        cursor.execute(CHANGED_DAYS_SQL, {'tz': settings.KPI_TIME_ZONE, 'since': since})
+        return [row[0] for row in cursor.fetchall()]
+
+
+def all_days():
+    """
+    Every day since the first user joined.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT min(date_joined AT TIME ZONE %s)::date, (now() AT TIME ZONE %s)::date '
+                       'FROM delivery_api_user', [settings.KPI_TIME_ZONE, settings.KPI_TIME_ZONE])
+        first, today = cursor.fetchone()
+    if first is None:
+        return []
+    return [first + datetime.timedelta(days=n) for n in range((today - first).days + 1)]
+
+
+def report(start=None, end=None, period='month'):
+    """
+    KPIs per `period` between the dates `start` and `end` (both included),
+    followed by the total of the range (with period None).
+    """
+    if period not in PERIODS:
+        raise ValueError('Unknown period {0}'.format(period))
+    with connection.cursor() as cursor:
+        cursor.execute(REPORT_SQL, {
+            'period': period,
+            'start': start or datetime.date.min,
+            'end': end or datetime.date.max,
+        })
+        return [dict(zip(REPORT_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def report_options(params):
+    """
+    (start, end, period) from the ``from``, ``to`` and ``period`` request
+    parameters; missing or invalid ones are left open, period defaults to month.
+    """
+    dates = []
+    for name in ('from', 'to'):
+        try:
+            dates.append(parse_date(params.get(name) or ''))
+        except ValueError:
+            dates.append(None)
+    period = params.get('period')
+    return dates[0], dates[1], period if period in PERIODS else 'month'
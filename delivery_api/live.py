@@ -0,0 +1,231 @@
+"""
+Live positions of drivers, kept out of the database so that "drivers near me"
+is answered from a grid of available drivers instead of a PostGIS query.
+
+The store is fed by location ingest and driver state changes; entries expire
+when a driver stops pinging. Configured in settings:
+
+    LIVE_DRIVERS = {
+        # or 'delivery_api.live.LocMemDriverStore' for a single process
+        'BACKEND': 'delivery_api.live.SharedCacheDriverStore',
+        'CELL_SIZE': 0.01,  # degrees, about 1.1 km
+        'TTL': 120,         # seconds without a ping before a driver is dropped
+    }
+"""
+import heapq
+import threading
+import time
+from math import ceil, cos, floor, radians
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from delivery_api.distance import haversine
+
+
+def ring_cells(cx, cy, ring):
+    """
+    Grid cells at Chebyshev distance `ring` from (cx, cy).
+    """
+    if ring == 0:
+        return [(cx, cy)]
+    cells = []
+    for dx in range(-ring, ring + 1):
+        cells += [(cx + dx, cy - ring), (cx + dx, cy + ring)]
+    for dy in range(-ring + 1, ring):
+        cells += [(cx - ring, cy + dy), (cx + ring, cy + dy)]
+    return cells
+
+
+class DriverStore(object):
+    """
+    Grid search shared by the backends; subclasses provide the storage.
+    """
+
+    def __init__(self, cell_size=0.01, ttl=120, **kwargs):
+        self.cell_size = cell_size
+        self.ttl = ttl
+
+    def cell(self, lng, lat):
+        return int(floor(lng / self.cell_size)), int(floor(lat / self.cell_size))
+
+    def nearest(self, point, k, radius):
+        """
+        Up to `k` (driver_id, meters) pairs of available drivers within
+        `radius` meters of `point`, nearest first.
+        """
+        lng, lat = point.coords[0], point.coords[1]
+        # Smallest side of a cell in meters, so ring r is at least r * step away
+        step = self.cell_size * min(110574.0, 111320.0 * max(cos(radians(lat)), 0.01))
+        cx, cy = self.cell(lng, lat)
+        found = []
+        for ring in range(int(ceil(radius / step)) + 1):
+            for driver_id, (driver_lng, driver_lat) in self.drivers_in(ring_cells(cx, cy, ring)):
+                meters = haversine((lng, lat), (driver_lng, driver_lat))
+                if meters <= radius:
+                    found.append((meters, driver_id))
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= ring * step:
+                break
+        return [(driver_id, meters) for meters, driver_id in heapq.nsmallest(k, found)]
+
+
+class LocMemDriverStore(DriverStore):
+    """
+    In-process store: only sees the pings received by this process, so only
+    suits a single worker (and the bench_nearest_drivers command).
+    """
+
+    def __init__(self, **kwargs):
+        super(LocMemDriverStore, self).__init__(**kwargs)
+        # driver_id -> [lng, lat, expires, available]
+        self.drivers = {}
+        # cell -> set of available driver ids
+        self.grid = {}
+        self.lock = threading.Lock()
+
+    def _unindex(self, driver_id, entry):
+        cell = self.grid.get(self.cell(entry[0], entry[1]))
+        if cell is not None:
+            cell.discard(driver_id)
+
+    def update(self, driver_id, point, available):
+        lng, lat = point.coords[0], point.coords[1]
+        with self.lock:
+            entry = self.drivers.get(driver_id)
+            if entry:
+                self._unindex(driver_id, entry)
+            self.drivers[driver_id] = [lng, lat, time.time() + self.ttl, available]
+            if available:
+                self.grid.setdefault(self.cell(lng, lat), set()).add(driver_id)
+
+    def set_available(self, driver_id, available):
+        with self.lock:
+            entry = self.drivers.get(driver_id)
+            if not entry:
+                return
+            entry[3] = available
+            if available:
+                self.grid.setdefault(self.cell(entry[0], entry[1]), set()).add(driver_id)
+            else:
+                self._unindex(driver_id, entry)
+
+    def drivers_in(self, cells):
+        stamp = time.time()
+        result = []
+        with self.lock:
+            for cell in cells:
+                for driver_id in list(self.grid.get(cell, ())):
+                    entry = self.drivers[driver_id]
+                    if entry[2] < stamp:
+                        # Stopped pinging
+                        self._unindex(driver_id, entry)
+                        del self.drivers[driver_id]
+                        continue
+                    result.append((driver_id, (entry[0], entry[1])))
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.drivers.clear()
+            self.grid.clear()
+
+
+class SharedCacheDriverStore(DriverStore):
+    """
+    Store shared between processes, in a django-redis cache. Each driver's
+    entry (position and availability) is a cache key; the available drivers
+    of a cell are a Redis set, changed with SADD/SREM so that concurrent
+    pings never drop each other. Set members are only a hint, the driver's
+    entry decides: members that moved, expired or became unavailable are
+    removed when they are read.
+    """
+
+    def __init__(self, cache_alias='default', **kwargs):
+        from django_redis import get_redis_connection
+
+        super(SharedCacheDriverStore, self).__init__(**kwargs)
+        self.cache = caches[cache_alias]
+        self.redis = get_redis_connection(cache_alias)
+
+    def driver_key(self, driver_id):
+        return 'live:driver:{0}'.format(driver_id)
+
+    def cell_key(self, cell):
+        return self.cache.make_key('live:cell:{0}:{1}'.format(*cell))
+
+    def update(self, driver_id, point, available):
+        self.put(driver_id, point.coords[0], point.coords[1], available)
+
+    def put(self, driver_id, lng, lat, available, expires=None):
+        # A state change keeps the expiry of the last ping
+        expires = expires or time.time() + self.ttl
+        self.cache.set(self.driver_key(driver_id), (lng, lat, available, expires),
+                       max(1, int(ceil(expires - time.time()))))
+        key = self.cell_key(self.cell(lng, lat))
+        pipe = self.redis.pipeline()
+        if available:
+            pipe.sadd(key, driver_id)
+            pipe.expire(key, self.ttl)
+        else:
+            pipe.srem(key, driver_id)
+        pipe.execute()
+
+    def set_available(self, driver_id, available):
+        entry = self.cache.get(self.driver_key(driver_id))
+        if entry:
+            self.put(driver_id, entry[0], entry[1], available, entry[3])
+
+    def drivers_in(self, cells):
+        pipe = self.redis.pipeline()
+        for cell in cells:
+            pipe.smembers(self.cell_key(cell))
+        members = [(cell, int(driver_id)) for cell, ids in zip(cells, pipe.execute()) for driver_id in ids]
+        entries = self.cache.get_many([self.driver_key(driver_id) for cell, driver_id in members])
+        result = []
+        stale = self.redis.pipeline()
+        for cell, driver_id in members:
+            entry = entries.get(self.driver_key(driver_id))
+            if entry and entry[2] and entry[3] > time.time() and self.cell(entry[0], entry[1]) == cell:
+                result.append((driver_id, (entry[0], entry[1])))
+            else:
+                stale.srem(self.cell_key(cell), driver_id)
+        if len(result) < len(members):
+            stale.execute()
+        return result
+
+    def clear(self):
+        self.cache.delete_pattern('live:*')
+
+
+_driver_store = None
+
+
+def get_driver_store():
+    global _driver_store
+    if _driver_store is None:
+        options = dict((key.lower(), value) for key, value in settings.LIVE_DRIVERS.items())
+        _driver_store = import_string(options.pop('backend'))(**options)
+    return _driver_store
+
+
+@receiver(setting_changed)
+def reset_driver_store(**kwargs):
+    global _driver_store
+    if kwargs['setting'] in ('LIVE_DRIVERS', 'CACHES'):
+        _driver_store = None
+
+
+def track_driver(driver, point):
+    """
+    Record a ping of `driver` (a User) at `point`.
+    """
+    if driver.is_driver and point:
+        get_driver_store().update(driver.pk, point, driver.state == 'available')
+
+
+def driver_state_changed(driver_id, state):
+    if driver_id:
+        get_driver_store().set_available(driver_id, state == 'available')
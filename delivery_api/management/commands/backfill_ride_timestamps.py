@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+
+from delivery_api.models import Ride, RideLog
+
+
+class Command(BaseCommand):
+    help = 'Fill the Ride <state>_at columns from existing RideLog rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rides to backfill per transaction')
+        parser.add_argument('--overwrite', action='store_true', default=False,
+                            help='Replace timestamps that are already set')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        overwrite = options['overwrite']
+        fields = ['{0}_at'.format(state) for state in Ride.timestamped_states]
+
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(Ride.objects.filter(pk__gt=last_id).order_by('pk')
+                       .values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            # First time each ride entered each state, one query per chunk
+            stamps = {}
+            logs = (RideLog.objects
+                    .filter(ride_id__in=ids, state__in=Ride.timestamped_states)
+                    .values('ride_id', 'state')
+                    .annotate(first=Min('created')))
+            for log in logs:
+                stamps.setdefault(log['ride_id'], {})['{0}_at'.format(log['state'])] = log['first']
+
+            with transaction.atomic():
+                current = Ride.objects.filter(pk__in=stamps.keys()).values('pk', *fields)
+                for ride in current:
+                    values = dict((field, stamp) for field, stamp in stamps[ride['pk']].items()
+                                  if overwrite or not ride[field])
+                    if values:
+                        # update() skips Ride.save() and its route/fare recalculation
+                        Ride.objects.filter(pk=ride['pk']).update(**values)
+                        updated += 1
+
+            self.stdout.write('Backfilled up to ride {0}'.format(last_id))
+
+        self.stdout.write(self.style.SUCCESS('Updated {0} rides'.format(updated)))
@@ -0,0 +1,64 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from delivery_api.live import LocMemDriverStore
+from delivery_api.models import User
+
+# Nairobi and surroundings
+BOUNDS = (36.65, -1.45, 37.05, -1.15)
+
+
+def random_point():
+    return Point(random.uniform(BOUNDS[0], BOUNDS[2]), random.uniform(BOUNDS[1], BOUNDS[3]), srid=4326)
+
+
+class Command(BaseCommand):
+    help = 'Compare nearest driver lookups of the live store and the database (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', default='1000,10000,100000',
+                            help='Comma separated fleet sizes')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--skip-db', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        radius = settings.MAXIMUM_DRIVER_DISTANCE * 1000
+        k = settings.NEAREST_DRIVERS
+        queries = [random_point() for i in range(options['queries'])]
+        for size in [int(size) for size in options['drivers'].split(',')]:
+            positions = [random_point() for i in range(size)]
+
+            store = LocMemDriverStore(**dict((key.lower(), value) for key, value in settings.LIVE_DRIVERS.items()
+                                             if key != 'BACKEND'))
+            for driver_id, point in enumerate(positions):
+                store.update(driver_id, point, True)
+            start = time.time()
+            for point in queries:
+                store.nearest(point, k, radius)
+            live = (time.time() - start) / len(queries)
+
+            database = None
+            if not options['skip_db']:
+                database = self.bench_database(positions, queries, k)
+
+            self.stdout.write('{0:>7} drivers: store {1:8.1f} us{2}'.format(
+                size, live * 1e6,
+                '  database {0:8.1f} us'.format(database * 1e6) if database is not None else ''))
+
+    def bench_database(self, positions, queries, k):
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username='bench-driver-{0}'.format(i), is_driver=True, state='available', position=point)
+                for i, point in enumerate(positions)], batch_size=5000)
+            radii = [km * 1000 for km in settings.DRIVER_SEARCH_RADII]
+            start = time.time()
+            for point in queries:
+                User.nearest_drivers(point, k, radii)
+            elapsed = (time.time() - start) / len(queries)
+            transaction.set_rollback(True)
+        return elapsed
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from delivery_api.models import Ride, RideMessage, User
+from delivery_api.push import PushDispatcher, StubTransport
+
+
+class Command(BaseCommand):
+    help = 'Measure push dispatch throughput against the stub transport (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--receivers', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Simulated seconds per provider request')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            receivers = User.objects.bulk_create([
+                User(username='bench-push-{0}'.format(i), gcm_token='token-{0}'.format(i))
+                for i in range(options['receivers'])])
+            receivers = list(User.objects.filter(username__startswith='bench-push-'))
+            ride = Ride.objects.create(customer=receivers[0])
+            RideMessage.objects.bulk_create([
+                RideMessage(ride=ride, ride_state='accepted', title='Ride accepted',
+                            receiver=receivers[i % len(receivers)])
+                for i in range(options['messages'])], batch_size=5000)
+
+            transport = StubTransport(latency=options['latency'])
+            dispatcher = PushDispatcher(transport=transport)
+            start = time.time()
+            sent = 0
+            while True:
+                picked, delivered = dispatcher.dispatch(limit=5000)
+                sent += delivered
+                if not picked:
+                    break
+            elapsed = time.time() - start
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} messages in {1} provider requests, {2:.2f}s ({3:.0f} messages/s)'.format(
+                sent, transport.requests, elapsed, sent / elapsed if elapsed else 0)))
@@ -0,0 +1,62 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from delivery_api.models import LocationLog, Ride, User, route_length
+
+
+class Command(BaseCommand):
+    help = 'Compare the Python and PostGIS route length paths on synthetic rides (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, nargs='+', default=[1000, 5000, 10000, 50000],
+                            help='Number of LocationLog points per synthetic ride')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for size in options['points']:
+                self.bench(size, options['repeat'])
+            transaction.set_rollback(True)
+
+    def bench(self, size, repeat):
+        driver = User.objects.create(username='bench-route-{0}'.format(size), is_driver=True)
+        started = now() - timedelta(seconds=size + 60)
+
+        # Random walk around Nairobi, one ping per second
+        lng, lat = 36.8219, -1.2921
+        logs = []
+        for i in range(size):
+            lng += random.uniform(-0.0002, 0.0002)
+            lat += random.uniform(-0.0002, 0.0002)
+            logs.append(LocationLog(user=driver, location=Point(lng, lat)))
+        LocationLog.objects.bulk_create(logs, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE delivery_api_locationlog SET created = %s + (id - "
+                "(SELECT MIN(id) FROM delivery_api_locationlog WHERE user_id = %s)) * interval '1 second' "
+                "WHERE user_id = %s", [started + timedelta(seconds=30), driver.pk, driver.pk])
+
+        ride = Ride.objects.create(customer=driver, driver=driver)
+        Ride.objects.filter(pk=ride.pk).update(
+            state='finalized', driving_at=started, dropoff_at=started + timedelta(seconds=size + 60))
+        ride = Ride.objects.get(pk=ride.pk)
+
+        python_time = sql_time = None
+        for _ in range(repeat):
+            start = time.time()
+            python_km = route_length(ride.route_points) * 100
+            python_time = min(python_time or 1e9, time.time() - start)
+
+            start = time.time()
+            sql_km = Ride.objects.filter(pk=ride.pk).route_meters()[ride.pk] / 1000.0
+            sql_time = min(sql_time or 1e9, time.time() - start)
+
+        self.stdout.write('{0:>6} points: python {1:8.1f} ms ({2:.2f} km planar), '
+                          'postgis {3:8.1f} ms ({4:.2f} km geodesic)'.format(
+                              size, python_time * 1000, python_km, sql_time * 1000, sql_km))
@@ -0,0 +1,46 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from delivery_api.models import Ride
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and latency of raw ride routes against the cached encoded polylines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rides', nargs='*', type=int, help='Ride ids (default: latest finalized rides)')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--zoom', type=int, default=settings.ROUTE_DEFAULT_ZOOM)
+
+    def handle(self, *args, **options):
+        rides = Ride.objects.filter(state='finalized').order_by('-created')
+        if options['rides']:
+            rides = rides.filter(pk__in=options['rides'])
+
+        totals = [0, 0, 0.0, 0.0]
+        for ride in rides[:options['limit']]:
+            start = time.time()
+            raw = json.dumps(ride.route)
+            raw_time = time.time() - start
+
+            # Make sure the cache exists so the second timing is a pure read
+            ride.encoded_route(options['zoom'])
+            ride = Ride.objects.select_related('route_cache').get(pk=ride.pk)
+            start = time.time()
+            encoded = json.dumps(ride.encoded_route(options['zoom']))
+            encoded_time = time.time() - start
+
+            totals[0] += len(raw)
+            totals[1] += len(encoded)
+            totals[2] += raw_time
+            totals[3] += encoded_time
+            self.stdout.write('Ride {0}: raw {1} bytes in {2:.1f} ms, encoded {3} bytes in {4:.1f} ms'.format(
+                ride.pk, len(raw), raw_time * 1000, len(encoded), encoded_time * 1000))
+
+        if totals[0]:
+            self.stdout.write(self.style.SUCCESS(
+                'Total: raw {0} bytes / {1:.1f} ms, encoded {2} bytes / {3:.1f} ms ({4:.1f}% of raw size)'.format(
+                    totals[0], totals[2] * 1000, totals[1], totals[3] * 1000, 100.0 * totals[1] / totals[0])))
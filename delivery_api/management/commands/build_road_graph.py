@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from delivery_api.routing import RoadGraph
+
+
+class Command(BaseCommand):
+    help = 'Compile an OpenStreetMap XML extract into the road graph used by RoadGraphProvider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('osm_file')
+        parser.add_argument('output')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        graph = RoadGraph.from_osm(options['osm_file'])
+        graph.save(options['output'])
+        self.stdout.write(self.style.SUCCESS('{0} nodes, {1} edges in {2:.1f}s'.format(
+            len(graph.lngs), len(graph.targets), time.time() - start)))
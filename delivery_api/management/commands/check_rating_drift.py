@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery_api.ratings import rating_drift
+
+
+class Command(BaseCommand):
+    help = 'Report users whose rating running totals differ from their ride ratings'
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for user_id, (total, count), (expected_total, expected_count) in rating_drift():
+            drifted += 1
+            self.stdout.write('User {0}: {1}/{2}, expected {3}/{4}'.format(
+                user_id, total, count, expected_total, expected_count))
+        if drifted:
+            raise CommandError('{0} users drifted, run rebuild_ratings'.format(drifted))
+        self.stdout.write(self.style.SUCCESS('No drift'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from delivery_api.models import Ride
+
+
+class Command(BaseCommand):
+    help = 'Pack the LocationLog points of finalized rides into RideTrajectory rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of rides to load per query')
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help='Also repack rides that already have a trajectory')
+
+    def handle(self, *args, **options):
+        rides = Ride.objects.filter(state='finalized', driver__isnull=False)
+        if not options['rebuild']:
+            rides = rides.filter(trajectory__isnull=True)
+
+        last_id = 0
+        compacted = points = 0
+        while True:
+            chunk = list(rides.filter(pk__gt=last_id).order_by('pk')[:options['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1].pk
+            for ride in chunk:
+                stored = ride.compact_trajectory()
+                if stored is not None:
+                    compacted += 1
+                    points += stored.points
+            self.stdout.write('Compacted {0} rides ({1} points), up to ride {2}'.format(compacted, points, last_id))
+
+        self.stdout.write(self.style.SUCCESS('Compacted {0} rides ({1} points)'.format(compacted, points)))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from delivery_api import partitions
+from delivery_api.models import Ride
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming LocationLog partitions and detach (or drop) the expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', choices=sorted(partitions.INTERVALS),
+                            default=settings.LOCATION_PARTITION_INTERVAL)
+        parser.add_argument('--ahead', type=int, default=settings.LOCATION_PARTITION_AHEAD,
+                            help='Partitions to keep ready after the current one')
+        parser.add_argument('--retain', type=int, default=settings.LOCATION_RETENTION_DAYS,
+                            help='Days of raw location points to keep')
+        parser.add_argument('--drop', action='store_true', default=False,
+                            help='Drop expired partitions instead of only detaching them')
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError('{0} is not a partitioned table, see migration 0009'.format(partitions.PARENT))
+
+        if options['dry_run']:
+            for partition in partitions.partitions():
+                self.stdout.write('{0}: {1} - {2}'.format(*partition))
+        else:
+            for partition in partitions.create_partitions(options['interval'], options['ahead']):
+                self.stdout.write('Created {0}: {1} - {2}'.format(*partition))
+
+        for partition in partitions.expired_partitions(options['retain']):
+            rides = self.rides_in(partition)
+            if options['dry_run']:
+                self.stdout.write('Would roll up {0} rides and {1} {2}'.format(
+                    rides.count(), 'drop' if options['drop'] else 'detach', partition.name))
+                continue
+            count = 0
+            for ride in rides.iterator():
+                ride.store_route()
+                count += 1
+            partitions.detach_partition(partition, drop=options['drop'])
+            self.stdout.write(self.style.SUCCESS('Rolled up {0} rides, {1} {2}'.format(
+                count, 'dropped' if options['drop'] else 'detached', partition.name)))
+
+    def rides_in(self, partition):
+        """
+        Rides with a route in the partition that is not stored elsewhere yet.
+        Only finalized rides get a route cache, the others are only compacted.
+        """
+        missing = Q(state='finalized', route_cache__isnull=True)
+        if settings.COMPACT_TRAJECTORIES:
+            missing |= Q(trajectory__isnull=True)
+        rides = (Ride.objects
+                 .filter(missing, driver__isnull=False, created__lt=partition.upper)
+                 .exclude(state__in=['new', 'selecting', 'declined'])
+                 .select_related('driver'))
+        if partition.lower:
+            rides = rides.filter(Q(dropoff_at__gte=partition.lower) |
+                                 Q(dropoff_at__isnull=True, updated__gte=partition.lower))
+        return rides
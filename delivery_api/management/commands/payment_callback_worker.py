@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from delivery_api import callbacks
+
+
+class Command(BaseCommand):
+    help = 'Apply queued M-Pesa callbacks to their payments and rides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Empty the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--limit', type=int, default=500,
+                            help='Callbacks to apply per transaction')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.time()
+            results = callbacks.apply(limit=options['limit'])
+            picked = sum(results.values())
+            if picked:
+                self.stdout.write('Applied {0} callbacks in {1:.2f}s ({2})'.format(
+                    picked, time.time() - start,
+                    ', '.join('{0} {1}'.format(count, result) for result, count in sorted(results.items()))))
+            if picked < options['limit']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
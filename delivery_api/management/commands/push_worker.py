@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from delivery_api.push import PushDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send unsent RideMessages as batched push notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Empty the outbox once and exit')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--limit', type=int, default=1000,
+                            help='Messages to pick up per round')
+        parser.add_argument('--transport', help='Dotted path overriding PUSH_TRANSPORT')
+
+    def handle(self, *args, **options):
+        transport = import_string(options['transport'])() if options['transport'] else None
+        dispatcher = PushDispatcher(transport=transport)
+        while True:
+            start = time.time()
+            picked, sent = dispatcher.dispatch(limit=options['limit'])
+            if picked:
+                self.stdout.write('Sent {0}/{1} messages in {2:.2f}s'.format(sent, picked, time.time() - start))
+            if picked < options['limit']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+
+from delivery_api.models import User
+from delivery_api.ratings import rating_drift
+
+
+class Command(BaseCommand):
+    help = 'Recompute User.rating_sum and rating_count from the ride ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of users to update per transaction')
+
+    def handle(self, *args, **options):
+        drift = list(rating_drift())
+        chunk_size = options['chunk_size']
+        for offset in range(0, len(drift), chunk_size):
+            with transaction.atomic():
+                for user_id, current, (total, count) in drift[offset:offset + chunk_size]:
+                    User.objects.filter(pk=user_id).update(rating_sum=total, rating_count=count, updated=now())
+        self.stdout.write(self.style.SUCCESS('Updated {0} users'.format(len(drift))))
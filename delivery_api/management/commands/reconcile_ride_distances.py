@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from delivery_api.models import Ride, route_length
+
+
+class Command(BaseCommand):
+    help = 'Compare the incremental ride distances with a recomputation from raw LocationLog rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rides', nargs='*', type=int,
+                            help='Ride ids to check (default: every ride that went through driving)')
+        parser.add_argument('--since', help='Only rides created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Allowed difference in km before a ride is reported')
+        parser.add_argument('--fix', action='store_true', default=False,
+                            help='Overwrite the running totals with the recomputed values')
+
+    def handle(self, *args, **options):
+        rides = Ride.objects.filter(driving_at__isnull=False).select_related('driver').order_by('pk')
+        if options['rides']:
+            rides = rides.filter(pk__in=options['rides'])
+        if options['since']:
+            rides = rides.filter(created__date__gte=parse_date(options['since']))
+
+        checked = drifted = 0
+        for ride in rides.iterator():
+            points = [point for point in ride.route_points if point]
+            batch = route_length(points)
+            diff = abs(batch - ride.waypoints_length) * 100
+            checked += 1
+            if diff <= options['tolerance'] and len(points) == ride.waypoints_count:
+                continue
+
+            drifted += 1
+            self.stdout.write('Ride {0}: incremental {1:.1f} km / {2} points, batch {3:.1f} km / {4} points'.format(
+                ride.pk, ride.waypoints_length * 100, ride.waypoints_count, batch * 100, len(points)))
+            if options['fix']:
+                Ride.objects.filter(pk=ride.pk).update(
+                    waypoints_length=batch,
+                    waypoints_count=len(points),
+                    last_waypoint=points[-1] if points else None)
+
+        self.stdout.write(self.style.SUCCESS('Checked {0} rides, {1} out of tolerance'.format(checked, drifted)))
@@ -0,0 +1,36 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils.dateparse import parse_date
+
+from delivery_api import kpis
+from delivery_api.models import DailyKPI
+
+
+class Command(BaseCommand):
+    help = 'Recompute the DailyKPI rows of the days changed since the last refresh'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Recompute every day from this date (YYYY-MM-DD) on')
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Recompute every day since the first signup')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = kpis.all_days()
+        elif options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('Invalid date {0}'.format(options['since']))
+            days = [day for day in kpis.all_days() if day >= since]
+        else:
+            last = DailyKPI.objects.aggregate(last=Max('refreshed'))['last']
+            if last is None:
+                days = kpis.all_days()
+            else:
+                # Changes committed while the last refresh ran
+                days = kpis.changed_days(last - datetime.timedelta(seconds=settings.KPI_REFRESH_OVERLAP))
+        kpis.refresh(days)
+        self.stdout.write(self.style.SUCCESS('Refreshed {0} days'.format(len(days))))
@@ -0,0 +1,61 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import FloatField
+from django.db.models.functions import Cast, ExtractHour
+from django.utils.dateparse import parse_date
+from pytz import timezone
+
+from delivery_api.models import Ride, Tariff
+
+
+class Command(BaseCommand):
+    help = 'Re-price the rides of a date range under a candidate tariff and compare the revenue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tariff', type=int, help='Id of the candidate Tariff')
+        parser.add_argument('--from', dest='date_from', required=True, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', required=True, help='Last day, inclusive (YYYY-MM-DD)')
+        parser.add_argument('--state', default='finalized')
+
+    def handle(self, *args, **options):
+        try:
+            engine = Tariff.objects.get(pk=options['tariff']).engine()
+        except Tariff.DoesNotExist:
+            raise CommandError('Tariff {0} does not exist'.format(options['tariff']))
+
+        start = time.time()
+        # Plain rows, no Ride instances: meters and local hour come out of the database
+        rows = (Ride.objects
+                .filter(created__date__gte=parse_date(options['date_from']),
+                        created__date__lte=parse_date(options['date_to']),
+                        state=options['state'],
+                        distance__isnull=False)
+                .annotate(meters=Cast(KeyTextTransform('distance_meters', 'distance'), FloatField()),
+                          hour=ExtractHour('created', tzinfo=timezone(settings.FARE_TIME_ZONE)))
+                .values_list('meters', 'hour', 'fare', 'payment_method'))
+        rows = [row for row in rows if row[0] is not None]
+        if not rows:
+            self.stdout.write('No rides to re-price')
+            return
+
+        meters, hours, fares, methods = zip(*rows)
+        current = np.array([float(fare or 0) for fare in fares])
+        candidate = engine.price(meters, hours)
+
+        by_method = defaultdict(lambda: [0.0, 0.0])
+        for method, old, new in zip(methods, current, candidate):
+            by_method[method or '-'][0] += old
+            by_method[method or '-'][1] += new
+
+        self.stdout.write('{0} rides re-priced in {1:.2f}s'.format(len(rows), time.time() - start))
+        for method, (old, new) in sorted(by_method.items()):
+            self.stdout.write('{0:>8}: current {1:12.2f}  candidate {2:12.2f}  ({3:+.1f}%)'.format(
+                method, old, new, 100 * (new - old) / old if old else 0))
+        self.stdout.write(self.style.SUCCESS('   total: current {0:12.2f}  candidate {1:12.2f}  ({2:+.1f}%)'.format(
+            current.sum(), candidate.sum(),
+            100 * (candidate.sum() - current.sum()) / current.sum() if current.sum() else 0)))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 10:03
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0003_ride_state_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='waypoints_length',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='waypoints_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='last_waypoint',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+    ]
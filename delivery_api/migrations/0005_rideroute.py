@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 11:26
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0004_ride_waypoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                ('points', models.IntegerField(default=0)),
+                ('polylines', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='route_cache', to='delivery_api.Ride')),
+            ],
+        ),
+    ]
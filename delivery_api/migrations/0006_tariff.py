@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 13:40
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0005_rideroute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tariff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('version', models.PositiveIntegerField(default=1, editable=False)),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                ('active_from', models.DateTimeField(blank=True, db_index=True, help_text=b'Rides from this moment are priced with this tariff. Leave empty for a candidate tariff.', null=True)),
+                ('base_fee', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('minimum_fare', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('bands', django.contrib.postgres.fields.jsonb.JSONField(default=list, help_text=b'Per km prices: [[up_to_km, price_per_km], ..., [null, price_per_km]]')),
+                ('multipliers', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list, help_text=b'Time of day multipliers: [[from_hour, to_hour, multiplier], ...]')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tariff',
+            unique_together=set([('name', 'version')]),
+        ),
+    ]
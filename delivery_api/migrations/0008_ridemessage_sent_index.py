@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0007_user_ratings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ridemessage',
+            name='sent',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
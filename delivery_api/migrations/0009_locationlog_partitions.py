@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 16:20
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+# Turn delivery_api_locationlog into a table partitioned by range of `created`.
+# The existing rows stay where they are: the old table becomes the first
+# partition, running up to tomorrow. New partitions are created (and old ones
+# detached) by the manage_location_partitions command.
+PARTITION_SQL = [
+    'ALTER TABLE delivery_api_locationlog RENAME TO delivery_api_locationlog_legacy',
+    '''
+    CREATE TABLE delivery_api_locationlog (
+        id integer NOT NULL DEFAULT nextval('delivery_api_locationlog_id_seq'::regclass),
+        created timestamp with time zone NOT NULL,
+        location geometry(Point, 4326) NULL,
+        user_id integer NOT NULL,
+        PRIMARY KEY (id, created)
+    ) PARTITION BY RANGE (created)
+    ''',
+    # Dropping the legacy partition one day must not drop the id sequence
+    'ALTER SEQUENCE delivery_api_locationlog_id_seq OWNED BY delivery_api_locationlog.id',
+    'ALTER TABLE delivery_api_locationlog_legacy ALTER COLUMN id DROP DEFAULT',
+    '''
+    ALTER TABLE delivery_api_locationlog ADD CONSTRAINT delivery_api_locationlog_user_id_fk
+        FOREIGN KEY (user_id) REFERENCES delivery_api_user (id) DEFERRABLE INITIALLY DEFERRED
+    ''',
+    'CREATE INDEX locationlog_user_created ON delivery_api_locationlog (user_id, created)',
+    'CREATE INDEX delivery_api_locationlog_location_gist ON delivery_api_locationlog USING GIST (location)',
+    '''
+    ALTER TABLE delivery_api_locationlog ATTACH PARTITION delivery_api_locationlog_legacy
+        FOR VALUES FROM (MINVALUE) TO ('{boundary}')
+    ''',
+    # Catches points outside of the created partitions, normally empty
+    'CREATE TABLE delivery_api_locationlog_default PARTITION OF delivery_api_locationlog DEFAULT',
+]
+
+UNPARTITION_SQL = [
+    'CREATE TABLE delivery_api_locationlog_flat (LIKE delivery_api_locationlog INCLUDING DEFAULTS)',
+    'INSERT INTO delivery_api_locationlog_flat SELECT * FROM delivery_api_locationlog',
+    'ALTER SEQUENCE delivery_api_locationlog_id_seq OWNED BY NONE',
+    'DROP TABLE delivery_api_locationlog',
+    'ALTER TABLE delivery_api_locationlog_flat RENAME TO delivery_api_locationlog',
+    'ALTER SEQUENCE delivery_api_locationlog_id_seq OWNED BY delivery_api_locationlog.id',
+    'ALTER TABLE delivery_api_locationlog ADD PRIMARY KEY (id)',
+    '''
+    ALTER TABLE delivery_api_locationlog ADD CONSTRAINT delivery_api_locationlog_user_id_fk
+        FOREIGN KEY (user_id) REFERENCES delivery_api_user (id) DEFERRABLE INITIALLY DEFERRED
+    ''',
+    'CREATE INDEX delivery_api_locationlog_user_id ON delivery_api_locationlog (user_id)',
+    'CREATE INDEX locationlog_user_created ON delivery_api_locationlog (user_id, created)',
+    'CREATE INDEX delivery_api_locationlog_location_gist ON delivery_api_locationlog USING GIST (location)',
+]
+
+
+def is_partitioned(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'delivery_api_locationlog'::regclass")
+        return cursor.fetchone() is not None
+
+
+def partition_locationlog(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or connection.pg_version < 110000:
+        # No declarative partitioning (PostgreSQL < 11): only add the index
+        schema_editor.execute('CREATE INDEX locationlog_user_created ON delivery_api_locationlog (user_id, created)')
+        return
+    boundary = (now() + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00+00')
+    for statement in PARTITION_SQL:
+        schema_editor.execute(statement.format(boundary=boundary))
+
+
+def unpartition_locationlog(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql' or not is_partitioned(schema_editor):
+        schema_editor.execute('DROP INDEX locationlog_user_created')
+        return
+    for statement in UNPARTITION_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0008_ridemessage_sent_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(partition_locationlog, unpartition_locationlog),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='locationlog',
+                    index=models.Index(fields=['user', 'created'], name='locationlog_user_created'),
+                ),
+            ],
+        ),
+    ]
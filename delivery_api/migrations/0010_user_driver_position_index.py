@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 16:55
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0009_locationlog_partitions'),
+    ]
+
+    operations = [
+        # KNN (<->) index for User.nearest_drivers, only over drivers that can be offered
+        migrations.RunSQL(
+            "CREATE INDEX user_available_driver_position ON delivery_api_user "
+            "USING GIST ((position::geography)) WHERE is_driver AND state = 'available'",
+            'DROP INDEX user_available_driver_position',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 17:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0010_user_driver_position_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrajectory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField()),
+                ('points', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trajectory', to='delivery_api.Ride')),
+            ],
+        ),
+    ]
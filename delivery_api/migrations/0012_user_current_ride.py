@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Point every user at their latest ride, if that ride is still active (as
+# RideListView used to find it)
+BACKFILL_SQL = """
+    UPDATE delivery_api_user u
+    SET current_ride_id = latest.ride_id
+    FROM (
+        SELECT DISTINCT ON (user_id) user_id, ride_id, state
+        FROM (
+            SELECT driver_id AS user_id, id AS ride_id, state, created FROM delivery_api_ride WHERE driver_id IS NOT NULL
+            UNION ALL
+            SELECT customer_id, id, state, created FROM delivery_api_ride WHERE customer_id IS NOT NULL
+        ) rides
+        ORDER BY user_id, created DESC
+    ) latest
+    WHERE u.id = latest.user_id
+      AND latest.state IN ('requested', 'accepted', 'driving', 'dropoff', 'payment', 'rating')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0011_ridetrajectory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='current_ride',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='delivery_api.Ride'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', '-created'], name='ride_driver_created'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['customer', '-created'], name='ride_customer_created'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
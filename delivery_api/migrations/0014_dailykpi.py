@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 20:05
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0013_user_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyKPI',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('customer_signups', models.IntegerField(default=0)),
+                ('rider_signups', models.IntegerField(default=0)),
+                ('rides_finalized', models.IntegerField(default=0)),
+                ('revenue_cash', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('revenue_mpesa', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('revenue_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('customers_paying', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('riders_active', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('riders_available', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('refreshed', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ('-date',),
+                'verbose_name': 'daily KPI',
+            },
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='updated',
+            field=django_extensions.db.fields.ModificationDateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
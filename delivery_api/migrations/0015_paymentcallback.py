@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 20:40
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0014_dailykpi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('processed', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('result', models.CharField(blank=True, max_length=20)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='delivery_api.Payment')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='mpesa_code',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='remote_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+    ]
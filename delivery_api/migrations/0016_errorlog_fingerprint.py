@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 21:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0015_paymentcallback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='errorlog',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='first seen'),
+        ),
+        migrations.AddField(
+            model_name='errorlog',
+            name='last_seen',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='errorlog',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=40, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='errorlog',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        # The existing reports stay one row each, without a fingerprint
+        migrations.RunSQL(
+            'UPDATE delivery_api_errorlog SET last_seen = created',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 22:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0017_paymentcallback_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ridemessage',
+            name='attempts',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ridemessage',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridemessage',
+            name='failed',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-17 22:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_api', '0018_ridemessage_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ridetrajectory',
+            name='meters',
+            field=models.FloatField(editable=False, null=True),
+        ),
+    ]
@@ -1,19 +1,53 @@
 import datetime
+from calendar import timegm
 from datetime import datetime
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.measure import Distance
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db.models import Avg
-from django.utils.timezone import now
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils.timezone import localtime, now
 from djmoney.models.fields import MoneyField
 from django_extensions.db.fields import (ModificationDateTimeField,
                                          CreationDateTimeField)
 from moneyed.classes import Money
 from django_fsm import FSMField, transition
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import ArrayField, JSONField
 from location_field.models.spatial import LocationField
+from rest_framework_jwt.settings import api_settings
 
 from django.contrib.gis.geos import Point
+from pytz import timezone
+
+from delivery_api import events, polyline, trajectory
+from delivery_api.distance import calculate_distance, haversine
+from delivery_api.fares import TariffEngine
+from delivery_api.live import driver_state_changed
+
+
+def route_length(points):
+    """
+    Planar length of a list of points, in degrees.
+    """
+    prev = None
+    dist = 0
+    for loc in points:
+        if not loc:
+            continue
+        if prev:
+            dist += prev.distance(loc)
+        prev = loc
+    return dist
+
+
+def ride_version(updated):
+    """
+    Version of a ride last changed at `updated`: microseconds since the epoch.
+    """
+    return timegm(updated.utctimetuple()) * 1000000 + updated.microsecond
+
 
 class User(AbstractUser):
 
@@ -32,6 +66,8 @@ class User(AbstractUser):
     state = models.CharField(max_length=20, choices=STATE_CHOICES, default='available')
     gcm_token = models.CharField(max_length=160, null=True, blank=True)
     last_ping = models.DateTimeField(null=True, blank=True)
+    # Version of the account and ride responses, also stamped by the targeted updates
+    updated = ModificationDateTimeField()
 
     customer_flow = models.BooleanField(null=False, default=False, blank=True, help_text='If rider has Android phone and can sign in the app: let rider go through customer flow', verbose_name='Customer flow')
     rider_flow = models.BooleanField(null=False, default=False, blank=True, help_text='Change to IS DRIVER under EXTRA INFO and let rider go through rider flow', verbose_name='Rider flow')
@@ -56,20 +92,56 @@ class User(AbstractUser):
     is_active       = models.BooleanField(default=True, null=False)
     is_staff        = models.BooleanField(default=False, null=False)
     
+    # Ratings received as driver (customer_rating) or as customer (driver_rating),
+    # depending on is_driver. Maintained by Ride.save(), see rebuild_ratings.
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    # Active ride of the user as customer or driver, maintained by Ride.save and transition_ride
+    current_ride = models.ForeignKey('delivery_api.Ride', null=True, blank=True, editable=False,
+                                     on_delete=models.SET_NULL, related_name='+')
+
     objects = UserManager()
     geo_objects = models.GeoManager()    
 
+    # Columns only changed through targeted updates, never written back by save()
+    managed_fields = ('rating_sum', 'rating_count', 'current_ride')
 
     @property
     def rating(self):
-        if self.is_driver:
-            rate = self.driver_ride.filter(customer_rating__gt=0).aggregate(rate=Avg('customer_rating'))['rate']
-        else:
-            rate = self.customer_ride.filter(driver_rating__gt=0).aggregate(rate=Avg('driver_rating'))['rate']
-        if rate:
-            return round(rate, 1)
+        if self.rating_count:
+            return round(float(self.rating_sum) / self.rating_count, 1)
         return None
 
+    @classmethod
+    def nearest_drivers(cls, point, k, radii):
+        """
+        Up to `k` available drivers nearest to `point`, each with a `distance`.
+        Searches within each of `radii` (meters) until `k` drivers are found,
+        ordered by KNN on the partial geography index of migration 0010.
+        """
+        drivers = []
+        for radius in radii:
+            drivers = list(cls.objects.filter(is_driver=True, state='available').extra(
+                select={'knn': 'position::geography <-> ST_GeogFromText(%s)'},
+                select_params=[point.wkt],
+                where=['ST_DWithin(position::geography, ST_GeogFromText(%s), %s)'],
+                params=[point.wkt, radius],
+                order_by=['knn'])[:k])
+            if len(drivers) >= k:
+                break
+        for driver in drivers:
+            driver.distance = Distance(m=driver.knn)
+        return drivers
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('update_fields'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.managed_fields]
+        super(User, self).save(*args, **kwargs)
+        # Only the state: the stored position may be old, pings feed the live store
+        if self.is_driver:
+            driver_state_changed(self.pk, self.state)
+
 
     def name(self):
         return "{0} {1}".format(self.first_name, self.last_name)
@@ -90,13 +162,78 @@ class LocationLog(models.Model):
 
     class Meta:
         ordering = ('-created', )
+        indexes = [models.Index(fields=['user', 'created'], name='locationlog_user_created')]
+
+    @classmethod
+    def bulk_insert(cls, user, points):
+        """
+        Insert (Point, created) pairs in one multi-row INSERT. bulk_create()
+        would replace the client timestamps, `created` being auto_now_add.
+        """
+        if not points:
+            return
+        params = []
+        for location, created in points:
+            params += [user.pk, created, location.ewkt]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO delivery_api_locationlog (user_id, created, location) VALUES ' +
+                ', '.join(['(%s, %s, ST_GeomFromEWKT(%s))'] * len(points)), params)
+
+
+# Geodesic length in meters of the ride's packed trajectory or, for rides
+# without one, of the driver's LocationLog trail inside the ride window
+# (which retention may have dropped already); the window mirrors
+# Ride.start/Ride.end so it can run as a correlated subquery.
+ROUTE_METERS_SQL = """
+    SELECT COALESCE((
+        SELECT traj.meters FROM delivery_api_ridetrajectory traj
+        WHERE traj.ride_id = delivery_api_ride.id
+    ), (
+        SELECT ST_Length(ST_MakeLine(log.location ORDER BY log.created)::geography)
+        FROM delivery_api_locationlog log
+        WHERE log.user_id = delivery_api_ride.driver_id
+          AND log.location IS NOT NULL
+          AND log.created >= COALESCE(delivery_api_ride.driving_at, CASE
+              WHEN delivery_api_ride.state IN ('accepted', 'requested') THEN now()
+              ELSE delivery_api_ride.created END)
+          AND log.created <= COALESCE(delivery_api_ride.dropoff_at, CASE
+              WHEN delivery_api_ride.state IN ('accepted', 'driving', 'dropoff') THEN now()
+              ELSE delivery_api_ride.updated END)
+    ), 0)
+"""
+
+
+class RideQuerySet(models.QuerySet):
+
+    def with_route_meters(self):
+        """
+        Annotate ``route_meters``, computed by PostGIS in the same query.
+        """
+        return self.annotate(route_meters=RawSQL(ROUTE_METERS_SQL, (), output_field=models.FloatField()))
+
+    def route_meters(self):
+        """
+        Map ride id to route meters for every ride in the queryset.
+        """
+        return dict(self.with_route_meters().order_by().values_list('pk', 'route_meters'))
 
 
 class Ride(models.Model):
 
+    # States that get a ``<state>_at`` timestamp the first time a ride enters them
+    timestamped_states = ('requested', 'accepted', 'driving', 'dropoff', 'payment',
+                          'rating', 'declined', 'canceled', 'finalized')
+
+    # States in which the ride is the User.current_ride of its customer and driver
+    active_states = ('requested', 'accepted', 'driving', 'dropoff', 'payment', 'rating')
+
     def __init__(self, *args, **kwargs):
         super(Ride, self).__init__(*args, **kwargs)
-        self.previous_state = self.state
+        # Through __dict__, so deferred fields (.only()) are not loaded one by one
+        self.previous_state = self.__dict__.get('state')
+        self.previous_driver_id = self.__dict__.get('driver_id')
+        self.previous_ratings = (self.__dict__.get('customer_rating'), self.__dict__.get('driver_rating'))
 
     state_choices = (
         ('new', 'New'),
@@ -131,31 +268,31 @@ class Ride(models.Model):
     ride_start_location = models.PointField(null=True)
     ride_end_location = models.PointField(null=True)
 
+    objects = RideQuerySet.as_manager()
+
     # payout = models.ForeignKey('payouts.Payout', null=True,
     #                            related_name='payout_rides',
     #                            on_delete=models.SET_NULL)
 
     @property
     def start(self):
-        if self.ridelog_set.filter(state='driving').count():
-            return self.ridelog_set.order_by('created').filter(state='driving')[0].created
+        if self.driving_at:
+            return self.driving_at
         if self.state in ['accepted', 'requested']:
             return now()
         return self.created
 
     @property
     def end(self):
-        if self.ridelog_set.filter(state='dropoff').count():
-            return self.ridelog_set.order_by('created').filter(state='dropoff')[0].created
+        if self.dropoff_at:
+            return self.dropoff_at
         if self.state in ['accepted', 'driving', 'dropoff']:
             return now()
         return self.updated
 
     @property
     def mpesa_payment(self):
-        if self.payment_set.count():
-            return self.payment_set.order_by('-created').all()[0]
-        return None
+        return self.payment_set.order_by('-created').first()
 
     state = FSMField(default='new', choices=state_choices)
     payment_method = models.CharField(max_length=30, choices=payment_choices, blank=True, null=True, verbose_name='method')
@@ -164,7 +301,17 @@ class Ride(models.Model):
     driver_rating = models.IntegerField(null=True, blank=True, verbose_name='rating rd')
 
     created = CreationDateTimeField()
-    updated = ModificationDateTimeField()
+    updated = ModificationDateTimeField(db_index=True)
+
+    requested_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    accepted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    driving_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    dropoff_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    payment_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    rating_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    declined_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    canceled_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    finalized_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     fare = MoneyField(decimal_places=2, max_digits=20,
                       default_currency='KES', null=True)
@@ -176,13 +323,139 @@ class Ride(models.Model):
     distance = JSONField(null=True)
     live_distance = JSONField(null=True)
 
+    # Running totals of the driver's pings while driving, see record_waypoints
+    waypoints_length = models.FloatField(default=0)
+    waypoints_count = models.IntegerField(default=0)
+    last_waypoint = models.PointField(null=True, blank=True)
+
+    @property
+    def version(self):
+        return ride_version(self.updated) if self.updated else None
+
     @property
     def route(self):
-        logs = self.route_points
-        return [{'lat': log.coords[1], 'lng': log.coords[0]} for log in logs]
+        return [{'lat': lat, 'lng': lng} for lat, lng in self.route_coords]
+
+    def stored_trajectory(self):
+        try:
+            return self.trajectory
+        except RideTrajectory.DoesNotExist:
+            return None
+
+    @property
+    def route_coords(self):
+        """
+        (lat, lng) pairs of the route, decoded from the packed trajectory if any.
+        """
+        stored = self.stored_trajectory()
+        if stored is not None:
+            lngs, lats, seconds = stored.arrays()
+            return list(zip(lats.tolist(), lngs.tolist()))
+        return [(point.coords[1], point.coords[0]) for point in self.route_points if point]
+
+    def compact_trajectory(self):
+        """
+        Pack the driver's LocationLog points of the ride into a RideTrajectory.
+        """
+        if not self.driver_id:
+            return None
+        until = self.end if self.end else now()
+        rows = [(location, created) for location, created in
+                LocationLog.objects.filter(user_id=self.driver_id, created__gte=self.start, created__lte=until)
+                .order_by('created').values_list('location', 'created') if location]
+        if not rows:
+            return None
+        started = rows[0][1]
+        data = trajectory.pack([location.x for location, created in rows],
+                               [location.y for location, created in rows],
+                               [(created - started).total_seconds() for location, created in rows])
+        meters = sum(haversine(a, b) for (a, _), (b, _) in zip(rows, rows[1:]))
+        stored, created = RideTrajectory.objects.update_or_create(
+            ride=self, defaults={'started': started, 'points': len(rows), 'meters': meters, 'data': data})
+        self.trajectory = stored
+        return stored
+
+    def store_route(self):
+        """
+        Keep the route of a ride: its packed trajectory (when
+        COMPACT_TRAJECTORIES is on) and, once finalized, the polyline cache.
+        """
+        if settings.COMPACT_TRAJECTORIES and self.stored_trajectory() is None:
+            self.compact_trajectory()
+        if self.state != 'finalized':
+            return None
+        return self.build_route_cache()
+
+    def build_route_cache(self, coords=None):
+        """
+        Store simplified, encoded polylines of the route for each cached zoom level.
+        """
+        if coords is None:
+            coords = self.route_coords
+        polylines = {}
+        for zoom in settings.ROUTE_CACHE_ZOOMS:
+            polylines[str(zoom)] = polyline.encode(polyline.simplify(coords, polyline.tolerance_for_zoom(zoom)))
+        cache, created = RideRoute.objects.update_or_create(
+            ride=self, defaults={'points': len(coords), 'polylines': polylines})
+        self.route_cache = cache
+        return cache
+
+    def encoded_route(self, zoom, coords=None):
+        """
+        Encoded polyline of the route, simplified for `zoom`. Finalized rides
+        are served from (and fill) the route cache. `coords` is the route when
+        already loaded, see load_routes().
+        """
+        cache = self.cached_route()
+        if cache is None and self.state == 'finalized':
+            cache = self.build_route_cache(coords)
+        if cache is not None:
+            return cache.polyline(zoom)
+        if coords is None:
+            coords = self.route_coords
+        return polyline.encode(polyline.simplify(coords, polyline.tolerance_for_zoom(zoom)))
+
+    def cached_route(self):
+        try:
+            return self.route_cache
+        except RideRoute.DoesNotExist:
+            return None
+
+    @classmethod
+    def load_routes(cls, rides):
+        """
+        Routes of many rides as {ride pk: [(lat, lng), ...]}, in two queries:
+        the packed trajectories, then one windowed query over LocationLog for
+        the rides without one (on the (user, created) index).
+        """
+        rides = [ride for ride in rides if ride.driver_id]
+        routes = {}
+        for stored in RideTrajectory.objects.filter(ride__in=rides):
+            lngs, lats, seconds = stored.arrays()
+            routes[stored.ride_id] = list(zip(lats.tolist(), lngs.tolist()))
+        rides = [ride for ride in rides if ride.pk not in routes]
+        if not rides:
+            return routes
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT ride.id, ST_Y(log.location), ST_X(log.location)
+                FROM unnest(%s::integer[], %s::integer[], %s::timestamptz[], %s::timestamptz[])
+                     AS ride (id, driver_id, start, until)
+                JOIN delivery_api_locationlog log
+                  ON log.user_id = ride.driver_id AND log.created BETWEEN ride.start AND ride.until
+                WHERE log.location IS NOT NULL
+                ORDER BY ride.id, log.created
+            """, [[ride.pk for ride in rides], [ride.driver_id for ride in rides],
+                  [ride.start for ride in rides], [ride.end or now() for ride in rides]])
+            for ride_id, lat, lng in cursor.fetchall():
+                routes.setdefault(ride_id, []).append((lat, lng))
+        return routes
 
     @property
     def route_points(self):
+        stored = self.stored_trajectory()
+        if stored is not None:
+            return stored.route_points()
         points = []
         try:
             until = self.end if self.end else now()
@@ -195,14 +468,40 @@ class Ride(models.Model):
 
     @property
     def waypoints_distance(self):
-        prev = None
-        dist = 0
-        for loc in self.route_points:
-            if prev:
-                dist += prev.distance(loc)
-            prev = loc
+        if self.waypoints_count:
+            dist = self.waypoints_length
+        else:
+            # Rides from before the accumulator, or that never went through 'driving'
+            stored = self.stored_trajectory()
+            dist = stored.length() if stored is not None else route_length(self.route_points)
         return "%.1f" % (dist * 100)
 
+    @classmethod
+    def record_waypoints(cls, driver, points):
+        """
+        Add location pings, (point, created) pairs in time order, to the
+        running distance of the driver's active ride. Pings from before the
+        ride started driving (e.g. uploaded late from a buffer) are left out.
+        """
+        points = [(point, created) for point, created in points if point]
+        if not points:
+            return None
+        with transaction.atomic():
+            ride = cls.objects.select_for_update().only('pk', 'last_waypoint', 'driving_at').filter(
+                driver=driver, state='driving').order_by('-created').first()
+            if not ride:
+                return None
+            points = [point for point, created in points if not ride.driving_at or created >= ride.driving_at]
+            if not points:
+                return ride
+            length = route_length([ride.last_waypoint] + points)
+            cls.objects.filter(pk=ride.pk).update(
+                waypoints_length=F('waypoints_length') + length,
+                waypoints_count=F('waypoints_count') + len(points),
+                last_waypoint=points[-1],
+                updated=now())
+        return ride
+
     def update_route(self):
         if self.driver and self.state in ['driving', 'dropoff']:
             self.destination = self.driver.position
@@ -220,7 +519,7 @@ class Ride(models.Model):
             self.destination = self.origin
 
         if self.live_distance:
-            self.live_fare = Money(calculate_fare(self.live_distance['meters']), 'KES')
+            self.live_fare = Money(calculate_fare(self.live_distance['meters'], self.created), 'KES')
 
         if self.driver and self.driver.position and self.customer.position and self.state in ['accepted']:
             self.driver_distance = calculate_distance(self.driver.position, self.customer.position)
@@ -232,47 +531,62 @@ class Ride(models.Model):
                 'duration': '-',
                 'distance_meters': 1000 * float(self.waypoints_distance)
             }
-            self.fare = Money(calculate_fare(int(1000 * float(self.waypoints_distance))), 'KES')
+            self.fare = Money(calculate_fare(int(1000 * float(self.waypoints_distance)), self.created), 'KES')
+
+    # Driver state after each transition
+    driver_states = {
+        'request': 'requested',
+        'accept': 'driving',
+        'decline': 'available',
+        'cancel': 'not-responding',
+        'dropoff': 'driving',
+        'payment': 'driving',
+        'rate': 'driving',
+        'finalize': 'available',
+    }
+
+    def set_driver_state(self, state):
+        """
+        Update only the driver's state column instead of saving the whole user.
+        """
+        if not self.driver_id:
+            return
+        User.objects.filter(pk=self.driver_id).update(state=state, updated=now())
+        driver_state_changed(self.driver_id, state)
+        if Ride.driver.is_cached(self):
+            self.driver.state = state
 
     @transition(field=state, source='new', target='requested')
     def request(self):
-        self.driver.state = 'requested'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['request'])
 
     @transition(field=state, source='requested', target='accepted')
     def accept(self):
-        self.driver.state = 'driving'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['accept'])
 
     @transition(field=state, source='new', target='declined')
     def decline(self):
-        self.driver.state = 'available'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['decline'])
 
     @transition(field=state, source='*', target='canceled')
     def cancel(self):
-        self.driver.state = 'not-responding'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['cancel'])
 
     @transition(field=state, source='accepted', target='dropoff')
     def dropoff(self):
-        self.driver.state = 'driving'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['dropoff'])
 
     @transition(field=state, source='*', target='payment')
     def payment(self):
-        self.driver.state = 'driving'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['payment'])
 
     @transition(field=state, source='*', target='rating')
     def rate(self):
-        self.driver.state = 'driving'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['rate'])
 
     @transition(field=state, source='*', target='finalized')
     def finalize(self):
-        self.driver.state = 'available'
-        self.driver.save()
+        self.set_driver_state(self.driver_states['finalize'])
 
     @property
     def meters(self):
@@ -289,9 +603,56 @@ class Ride(models.Model):
     def dest(self):
         return "{},{}".format(self.destination[0], self.destination[1])
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', '-created'], name='ride_driver_created'),
+            models.Index(fields=['customer', '-created'], name='ride_customer_created'),
+        ]
+
     def __unicode__(self):
         return 'Ride {0}'.format(self.id)
 
+    def update_rating_aggregates(self):
+        """
+        Apply rating changes of this ride to the rated users' running totals.
+        """
+        previous_customer_rating, previous_driver_rating = self.previous_ratings
+        # customer_rating rates the driver, driver_rating rates the customer
+        for user_id, is_driver, old, new in (
+                (self.driver_id, True, previous_customer_rating, self.customer_rating),
+                (self.customer_id, False, previous_driver_rating, self.driver_rating)):
+            old = old if (old or 0) > 0 else 0
+            new = new if (new or 0) > 0 else 0
+            if user_id and old != new:
+                User.objects.filter(pk=user_id, is_driver=is_driver).update(
+                    rating_sum=F('rating_sum') + new - old,
+                    rating_count=F('rating_count') + int(bool(new)) - int(bool(old)),
+                    updated=now())
+        self.previous_ratings = (self.customer_rating, self.driver_rating)
+
+    def update_current_ride(self):
+        """
+        Point User.current_ride of the customer and driver at this ride while it
+        is active, and clear it once it is not.
+        """
+        participants = [pk for pk in (self.customer_id, self.driver_id) if pk]
+        if self.state in self.active_states:
+            User.objects.filter(pk__in=participants).update(current_ride=self)
+            # A driver that was replaced
+            User.objects.filter(current_ride=self).exclude(pk__in=participants).update(current_ride=None)
+        else:
+            User.objects.filter(current_ride=self).update(current_ride=None)
+
+    def stamp_state(self):
+        """
+        Record when the ride first entered its current state. Covers both the
+        FSM transitions and clients writing ``state`` directly.
+        """
+        if self.state in self.timestamped_states:
+            field = '{0}_at'.format(self.state)
+            if not getattr(self, field):
+                setattr(self, field, now())
+
     def save(self, *args, **kwargs):
         self.update_route()
         if self.driver and self.state == 'new':
@@ -301,7 +662,111 @@ class Ride(models.Model):
         if self.payment_method == 'cash' and self.state == 'payment':
             self.state = 'rating'
 
-        super(Ride, self).save(*args, **kwargs)
+        self.stamp_state()
+        if self._state.adding:
+            # Ratings given on creation count as well
+            self.previous_ratings = (None, None)
+        with transaction.atomic():
+            super(Ride, self).save(*args, **kwargs)
+            self.update_rating_aggregates()
+            if self.state != self.previous_state or self.driver_id != self.previous_driver_id:
+                self.update_current_ride()
+            # Every save moves the version, wakes up the clients waiting on the ride
+            events.ride_changed(self)
+
+        if self.state == 'finalized' and self.previous_state != 'finalized':
+            self.store_route()
+        self.previous_state = self.state
+        self.previous_driver_id = self.driver_id
+
+
+class RideRoute(models.Model):
+    """
+    Route of a finalized ride as encoded polylines, keyed by zoom level.
+    """
+    ride = models.OneToOneField('delivery_api.Ride', related_name='route_cache')
+    created = CreationDateTimeField()
+    points = models.IntegerField(default=0)
+    polylines = JSONField(default=dict)
+
+    def polyline(self, zoom):
+        # Closest cached zoom that is at least as detailed as requested
+        zooms = sorted(int(level) for level in self.polylines)
+        if not zooms:
+            return ''
+        zoom = next((level for level in zooms if level >= int(zoom)), zooms[-1])
+        return self.polylines[str(zoom)]
+
+
+class RideTrajectory(models.Model):
+    """
+    GPS points of a finished ride packed into one row, see delivery_api.trajectory.
+    """
+    ride = models.OneToOneField('delivery_api.Ride', related_name='trajectory')
+    created = CreationDateTimeField()
+    started = models.DateTimeField()
+    points = models.IntegerField(default=0)
+    # Geodesic length, read by ROUTE_METERS_SQL; empty for rows packed before it
+    meters = models.FloatField(null=True, editable=False)
+    data = models.BinaryField()
+
+    def arrays(self):
+        """
+        (lngs, lats, seconds after `started`) NumPy arrays.
+        """
+        if not hasattr(self, '_arrays'):
+            self._arrays = trajectory.unpack(self.data)
+        return self._arrays
+
+    def route_points(self):
+        lngs, lats, seconds = self.arrays()
+        return [Point(lng, lat, srid=4326) for lng, lat in zip(lngs.tolist(), lats.tolist())]
+
+    def length(self):
+        lngs, lats, seconds = self.arrays()
+        return trajectory.length(lngs, lats)
+
+
+class Tariff(models.Model):
+    name = models.CharField(max_length=100)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    created = CreationDateTimeField()
+    active_from = models.DateTimeField(null=True, blank=True, db_index=True,
+                                       help_text='Rides from this moment are priced with this tariff. Leave empty for a candidate tariff.')
+    base_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    minimum_fare = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    bands = JSONField(default=list, help_text='Per km prices: [[up_to_km, price_per_km], ..., [null, price_per_km]]')
+    multipliers = JSONField(default=list, blank=True,
+                            help_text='Time of day multipliers: [[from_hour, to_hour, multiplier], ...]')
+
+    class Meta:
+        unique_together = ('name', 'version')
+
+    def __unicode__(self):
+        return '{0} v{1}'.format(self.name, self.version)
+
+    def save(self, *args, **kwargs):
+        if not self.pk:
+            latest = Tariff.objects.filter(name=self.name).order_by('-version').first()
+            self.version = latest.version + 1 if latest else 1
+        super(Tariff, self).save(*args, **kwargs)
+
+    def engine(self):
+        return TariffEngine(base_fee=self.base_fee, minimum_fare=self.minimum_fare,
+                            bands=self.bands, multipliers=self.multipliers)
+
+    @classmethod
+    def engine_at(cls, when):
+        tariff = cls.objects.filter(active_from__lte=when).order_by('-active_from').first()
+        if tariff:
+            return tariff.engine()
+        return TariffEngine(**settings.DEFAULT_TARIFF)
+
+
+def calculate_fare(meters, when=None):
+    when = when or now()
+    hour = localtime(when, timezone(settings.FARE_TIME_ZONE)).hour
+    return float(Tariff.engine_at(when).price([meters], [hour])[0])
 
 
 class RideMessage(models.Model):
@@ -311,7 +776,11 @@ class RideMessage(models.Model):
     message = models.CharField(max_length=100, blank=True, default='')
     receiver = models.ForeignKey('delivery_api.User')
     created = CreationDateTimeField()
-    sent = models.DateTimeField(null=True)
+    sent = models.DateTimeField(null=True, db_index=True)
+    # Delivery attempts of the push worker, see delivery_api/push.py
+    attempts = models.IntegerField(default=0, editable=False)
+    next_attempt = models.DateTimeField(null=True, blank=True, editable=False)
+    failed = models.DateTimeField(null=True, blank=True, editable=False)
     updated = ModificationDateTimeField()
     sound = models.CharField(max_length=200, default='default', blank=True)
     notify_helpdesk = models.BooleanField(default=False)
@@ -326,17 +795,8 @@ class RideMessage(models.Model):
     def send(self):
         # Send the message if not yet sent
         if not self.sent:
-            data = {
-                'title': self.title,
-                'sound': self.sound,
-                'message': self.message,
-                'ride': self.ride.id
-            }
-            gcm.json_request(registration_ids=[self.receiver.gcm_token],
-                             data=data,
-                             priority='high')
-            self.sent = now()
-            self.save()
+            from delivery_api.push import PushDispatcher
+            PushDispatcher().send_messages([self])
 
 
 class SystemMessage(models.Model):
@@ -379,10 +839,15 @@ class Payment(models.Model):
     amount = MoneyField(decimal_places=2, max_digits=20,
                         default_currency='KES', null=True)
     phone = models.CharField(max_length=20,  null=False, blank=True)
-    remote_id = models.CharField(max_length=50,  null=False, blank=True)
+    remote_id = models.CharField(max_length=50,  null=False, blank=True, db_index=True)
     transaction_id = models.CharField(max_length=50,  null=False, blank=True)
     status = models.CharField(max_length=20,  null=False, blank=True, default='New')
-    mpesa_code = models.CharField(max_length=50, null=False, blank=True)
+    mpesa_code = models.CharField(max_length=50, null=False, blank=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        super(Payment, self).save(*args, **kwargs)
+        # The payment is part of the ride response, see RideSerializer
+        Ride.objects.filter(pk=self.ride_id).update(updated=self.updated)
 
     def _get_payment_service(self):
         return PaymentService(
@@ -489,10 +954,28 @@ class PaymentResponseLog(models.Model):
     request = models.TextField(blank=True)
 
 
+class PaymentCallback(models.Model):
+    """
+    Callback of the payment provider as received, queued until
+    payment_callback_worker applies it, see delivery_api/callbacks.py.
+    """
+    created = CreationDateTimeField()
+    # The parsed JSON or form body, if any, and the body as received
+    payload = JSONField(null=True, blank=True)
+    body = models.TextField(blank=True, default='')
+    processed = models.DateTimeField(null=True, blank=True, db_index=True)
+    result = models.CharField(max_length=20, blank=True)
+    payment = models.ForeignKey('delivery_api.Payment', null=True, blank=True, on_delete=models.SET_NULL)
+
+
 class ErrorLog(models.Model):
     ride = models.ForeignKey('delivery_api.Ride', null=True)
     user = models.ForeignKey('delivery_api.User', null=True)
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, verbose_name='first seen')
+    last_seen = models.DateTimeField(null=True, db_index=True)
+    # Identical reports share a row, see delivery_api/errorlog.py
+    fingerprint = models.CharField(max_length=40, null=True, unique=True, editable=False)
+    count = models.PositiveIntegerField(default=1)
     token = models.CharField(max_length=1000)
     level = models.CharField(max_length=100)
     message = models.TextField(blank=True)
@@ -508,3 +991,25 @@ class KPI(User):
     class Meta:
         proxy = True
 
+
+class DailyKPI(models.Model):
+    """
+    KPIs of one day in KPI_TIME_ZONE, maintained by refresh_kpis, see delivery_api/kpis.py.
+    """
+    date = models.DateField(unique=True)
+    customer_signups = models.IntegerField(default=0)
+    rider_signups = models.IntegerField(default=0)
+    rides_finalized = models.IntegerField(default=0)
+    revenue_cash = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    revenue_mpesa = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    revenue_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    # User ids, to count them distinct over longer periods
+    customers_paying = ArrayField(models.IntegerField(), default=list)
+    riders_active = ArrayField(models.IntegerField(), default=list)
+    riders_available = ArrayField(models.IntegerField(), default=list)
+    refreshed = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-date', )
+        verbose_name = 'daily KPI'
+
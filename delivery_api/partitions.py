@@ -0,0 +1,107 @@
+"""
+Range partitions of the LocationLog table by `created`, see migration 0009.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now, utc
+
+PARENT = 'delivery_api_locationlog'
+DEFAULT = PARENT + '_default'
+
+INTERVALS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+# lower/upper are None for MINVALUE/MAXVALUE
+Partition = namedtuple('Partition', 'name lower upper')
+
+
+def parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [PARENT])
+        return cursor.fetchone() is not None
+
+
+def partitions():
+    """
+    Attached range partitions ordered by lower bound, without the default one.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        ''', [PARENT])
+        rows = cursor.fetchall()
+    result = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        if match:
+            result.append(Partition(name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    return sorted(result, key=lambda partition: partition.lower or datetime.min.replace(tzinfo=utc))
+
+
+def period_start(when, interval):
+    day = when.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'week':
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+def create_partition(lower, upper):
+    """
+    Create and attach the partition [lower, upper), moving over the rows the
+    default partition received for that range in the meantime.
+    """
+    name = '{0}_p{1}'.format(PARENT, lower.strftime('%Y%m%d'))
+    bounds = [lower, upper]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)'.format(name, PARENT))
+        cursor.execute('INSERT INTO {0} SELECT * FROM {1} WHERE created >= %s AND created < %s'.format(
+            name, DEFAULT), bounds)
+        cursor.execute('DELETE FROM {0} WHERE created >= %s AND created < %s'.format(DEFAULT), bounds)
+        cursor.execute("ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM ('{2}') TO ('{3}')".format(
+            PARENT, name, lower.isoformat(), upper.isoformat()))
+    return Partition(name, lower, upper)
+
+
+def create_partitions(interval, ahead):
+    """
+    Create contiguous partitions from the last existing one up to `ahead`
+    intervals after the current one.
+    """
+    step = INTERVALS[interval]
+    existing = [partition.upper for partition in partitions() if partition.upper]
+    horizon = max(existing) if existing else period_start(now(), interval)
+    target = period_start(now(), interval) + step * (ahead + 1)
+    created = []
+    while horizon < target:
+        upper = period_start(horizon, interval) + step
+        created.append(create_partition(horizon, upper))
+        horizon = upper
+    return created
+
+
+def expired_partitions(retain_days):
+    cutoff = now() - timedelta(days=retain_days)
+    return [partition for partition in partitions() if partition.upper and partition.upper <= cutoff]
+
+
+def detach_partition(partition, drop=False):
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(PARENT, partition.name))
+        if drop:
+            cursor.execute('DROP TABLE {0}'.format(partition.name))
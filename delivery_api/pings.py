@@ -0,0 +1,166 @@
+"""
+Filter for incoming location pings, in front of the LocationLog writes.
+
+A ping is compared with the last stored point of the same user:
+
+- further than MAX_SPEED away (in m/s) from it is an impossible jump and
+  rejected altogether;
+- within MIN_DISTANCE meters of it is redundant and suppressed, unless
+  HEARTBEAT seconds have passed, so a parked driver still leaves a point
+  every HEARTBEAT seconds;
+- anything else is stored and becomes the new reference point.
+
+A bad reference point (e.g. a cached fix far from the real position) would
+reject every real ping; once REANCHOR_AFTER rejected pings in a row are
+plausible among themselves, the last one is accepted and becomes the
+reference instead.
+
+Configured in settings:
+
+    PING_FILTER = {
+        # or 'delivery_api.pings.LocMemState' for a single process
+        'STATE': 'delivery_api.pings.SharedCacheState',
+        'MIN_DISTANCE': 10,
+        'MAX_SPEED': 60,
+        'HEARTBEAT': 60,
+        'REANCHOR_AFTER': 3,
+        'REPORT_EVERY': 10000,  # pings between two counter log lines
+    }
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from delivery_api.distance import haversine
+
+ACCEPTED = 'accepted'
+SUPPRESSED = 'suppressed'
+REJECTED = 'rejected'
+
+logger = logging.getLogger(__name__)
+
+
+class LocMemState(object):
+    """
+    Last stored point per user in this process, least recently used dropped
+    first. Only for a single worker: with several, each compares a user's
+    pings with a different point.
+    """
+
+    def __init__(self, max_entries=100000, **kwargs):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            return self.entries.get(user_id)
+
+    def set(self, user_id, value):
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SharedCacheState(object):
+    """
+    Last stored point per user in CACHES, the same for all the workers.
+    """
+
+    def __init__(self, cache_alias='default', timeout=24 * 60 * 60, **kwargs):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+
+    def get(self, user_id):
+        return self.cache.get('ping:{0}'.format(user_id))
+
+    def set(self, user_id, value):
+        self.cache.set('ping:{0}'.format(user_id), value, self.timeout)
+
+
+class PingFilter(object):
+
+    def __init__(self, state=None, min_distance=10, max_speed=60, heartbeat=60, reanchor_after=3,
+                 report_every=10000, **kwargs):
+        self.state = state if state is not None else LocMemState()
+        self.min_distance = min_distance
+        self.max_speed = max_speed
+        self.heartbeat = heartbeat
+        self.reanchor_after = reanchor_after
+        self.report_every = report_every
+        self.counts = {ACCEPTED: 0, SUPPRESSED: 0, REJECTED: 0}
+
+    def check(self, user_id, point, when):
+        """
+        ACCEPTED, SUPPRESSED or REJECTED for a ping of `user_id` at `point`
+        taken at `when`; only accepted pings should be stored.
+        """
+        last = self.state.get(user_id)
+        verdict = self.verdict(last, point, when)
+        if verdict == REJECTED and self.reanchor_after and last is not None and \
+                point and point.coords != (0, 0) and when >= last[1]:
+            # (point, when, count) of the rejected pings in a row that agree with each other
+            streak = last[2] if len(last) > 2 else None
+            count = streak[2] + 1 if streak and self.plausible(streak[0], streak[1], point, when) else 1
+            if count >= self.reanchor_after:
+                verdict = ACCEPTED
+            else:
+                self.state.set(user_id, (last[0], last[1], (point, when, count)))
+        if verdict == ACCEPTED:
+            self.state.set(user_id, (point, when, None))
+        self.counts[verdict] += 1
+        if self.report_every and sum(self.counts.values()) % self.report_every == 0:
+            logger.info('Ping filter: %(accepted)d stored, %(suppressed)d suppressed, '
+                        '%(rejected)d rejected, skipped rate %(skipped_rate).2f', self.stats())
+        return verdict
+
+    def verdict(self, last, point, when):
+        if not point or point.coords == (0, 0):
+            # No fix, PointSerializer gives (0, 0) for an empty location
+            return REJECTED
+        if last is None:
+            return ACCEPTED
+        last_point, last_when = last[0], last[1]
+        if not self.plausible(last_point, last_when, point, when):
+            # Older than the stored point, or an impossible jump
+            return REJECTED
+        if haversine(last_point, point) < self.min_distance and (when - last_when).total_seconds() < self.heartbeat:
+            return SUPPRESSED
+        return ACCEPTED
+
+    def plausible(self, from_point, from_when, point, when):
+        seconds = (when - from_when).total_seconds()
+        return seconds >= 0 and haversine(from_point, point) <= self.max_speed * max(seconds, 1)
+
+    def stats(self):
+        total = sum(self.counts.values())
+        stats = dict(self.counts)
+        stats['skipped_rate'] = float(self.counts[SUPPRESSED] + self.counts[REJECTED]) / total if total else 0.0
+        return stats
+
+
+_ping_filter = None
+
+
+def get_ping_filter():
+    global _ping_filter
+    if _ping_filter is None:
+        options = dict((key.lower(), value) for key, value in settings.PING_FILTER.items())
+        state = import_string(options.pop('state'))()
+        _ping_filter = PingFilter(state=state, **options)
+    return _ping_filter
+
+
+@receiver(setting_changed)
+def reset_ping_filter(**kwargs):
+    global _ping_filter
+    if kwargs['setting'] in ('PING_FILTER', 'CACHES'):
+        _ping_filter = None
@@ -0,0 +1,102 @@
+"""
+Route simplification and Google encoded polylines.
+
+See https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+"""
+
+
+def tolerance_for_zoom(zoom):
+    """
+    Simplification tolerance in degrees: half a 256px map tile pixel at `zoom`.
+    """
+    return 360.0 / (256 * 2 ** int(zoom)) / 2
+
+
+def _segment_distance(point, start, end):
+    """
+    Planar distance from `point` to the segment `start`-`end`.
+    """
+    x, y = point
+    x1, y1 = start
+    x2, y2 = end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    t = max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / float(dx * dx + dy * dy)))
+    px, py = x1 + t * dx, y1 + t * dy
+    return ((x - px) ** 2 + (y - py) ** 2) ** 0.5
+
+
+def simplify(coords, tolerance):
+    """
+    Douglas-Peucker simplification of a list of (x, y) tuples.
+    """
+    if len(coords) < 3:
+        return list(coords)
+
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    # Iterative to stay clear of the recursion limit on long rides
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, max_dist = None, tolerance
+        for i in range(first + 1, last):
+            dist = _segment_distance(coords[i], coords[first], coords[last])
+            if dist > max_dist:
+                index, max_dist = i, dist
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [coord for coord, kept in zip(coords, keep) if kept]
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode(coords, precision=5):
+    """
+    Encode a list of (lat, lng) tuples as a Google polyline string.
+    """
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coords:
+        lat, lng = int(round(lat * factor)), int(round(lng * factor))
+        output.append(_encode_value(lat - prev_lat))
+        output.append(_encode_value(lng - prev_lng))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(output)
+
+
+def decode(value, precision=5):
+    """
+    Decode a Google polyline string into a list of (lat, lng) tuples.
+    """
+    factor = float(10 ** precision)
+    coords = []
+    index = lat = lng = 0
+    while index < len(value):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(value[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append((lat / factor, lng / factor))
+    return coords
@@ -0,0 +1,181 @@
+"""
+Outbox dispatcher for RideMessage push notifications.
+
+Unsent RideMessages are the outbox. PushDispatcher.dispatch() claims the
+due ones, counting the attempt and scheduling the next one with exponential
+backoff, in a short transaction; then it groups identical payloads into
+multicast requests of up to `transport.batch_size` registration ids, retries
+failed requests, marks delivered messages sent in bulk and clears or
+replaces the tokens the provider reports back. Messages still undelivered
+after PUSH_MAX_ATTEMPTS are marked failed and left alone. The push_worker
+command runs it in a loop.
+"""
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from gcm import GCM
+
+from delivery_api.models import RideMessage, User
+
+logger = logging.getLogger(__name__)
+
+# Provider errors meaning the token will never work again
+INVALID_TOKEN_ERRORS = ('InvalidRegistration', 'NotRegistered', 'MismatchSenderId')
+
+
+class GCMTransport(object):
+    batch_size = 1000
+
+    def __init__(self):
+        self.gcm = GCM(settings.GCM_API_KEY)
+
+    def send(self, registration_ids, data):
+        return self.gcm.json_request(registration_ids=registration_ids, data=data, priority='high')
+
+
+class StubTransport(object):
+    """
+    Offline transport for tests and benchmarks. Tokens in `invalid` are
+    reported as NotRegistered, tokens in `unavailable` as Unavailable, and
+    the tokens in `canonical` with their new token.
+    """
+    batch_size = 1000
+
+    def __init__(self, latency=0.0, invalid=(), unavailable=(), canonical=None, batch_size=None):
+        self.latency = latency
+        self.invalid = set(invalid)
+        self.unavailable = set(unavailable)
+        self.canonical = canonical or {}
+        if batch_size:
+            self.batch_size = batch_size
+        self.requests = 0
+        self.delivered = 0
+
+    def send(self, registration_ids, data):
+        time.sleep(self.latency)
+        self.requests += 1
+        errors = {}
+        for error, tokens in (('NotRegistered', self.invalid), ('Unavailable', self.unavailable)):
+            failed = [token for token in registration_ids if token in tokens]
+            if failed:
+                errors[error] = failed
+        self.delivered += len(registration_ids) - sum(len(failed) for failed in errors.values())
+        result = {}
+        if errors:
+            result['errors'] = errors
+        canonical = dict((token, self.canonical[token]) for token in registration_ids if token in self.canonical)
+        if canonical:
+            result['canonical'] = canonical
+        return result
+
+
+class PushDispatcher(object):
+
+    def __init__(self, transport=None):
+        self.transport = transport or import_string(settings.PUSH_TRANSPORT)()
+        self.max_retries = settings.PUSH_MAX_RETRIES
+        self.backoff = settings.PUSH_RETRY_BACKOFF
+        self.max_attempts = settings.PUSH_MAX_ATTEMPTS
+        self.attempt_delay = settings.PUSH_ATTEMPT_DELAY
+
+    def payload(self, message):
+        return {
+            'title': message.title,
+            'sound': message.sound,
+            'message': message.message,
+            'ride': message.ride_id
+        }
+
+    def send_with_retry(self, tokens, data):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.transport.send(tokens, data)
+            except Exception:
+                logger.warning('Push request for %d tokens failed (attempt %d)', len(tokens), attempt + 1,
+                               exc_info=True)
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return None
+
+    def send_messages(self, messages):
+        """
+        Send `messages` and return the number marked as sent.
+        """
+        tokens = dict(User.objects.filter(pk__in=set(m.receiver_id for m in messages))
+                      .exclude(gcm_token='').exclude(gcm_token__isnull=True)
+                      .values_list('pk', 'gcm_token'))
+
+        groups = OrderedDict()
+        for message in messages:
+            if message.receiver_id in tokens:
+                data = self.payload(message)
+                groups.setdefault(tuple(sorted(data.items())), (data, []))[1].append(message)
+
+        sent, invalid, canonical = [], set(), {}
+        for data, group in groups.values():
+            for offset in range(0, len(group), self.transport.batch_size):
+                chunk = group[offset:offset + self.transport.batch_size]
+                result = self.send_with_retry([tokens[m.receiver_id] for m in chunk], data)
+                if result is None:
+                    # Stays in the outbox for the next run
+                    continue
+                failed = set()
+                for error, ids in (result.get('errors') or {}).items():
+                    if error in INVALID_TOKEN_ERRORS:
+                        invalid.update(ids)
+                    else:
+                        failed.update(ids)
+                canonical.update(result.get('canonical') or {})
+                sent += [m for m in chunk if tokens[m.receiver_id] not in failed]
+
+        stamp = now()
+        with transaction.atomic():
+            RideMessage.objects.filter(pk__in=[m.pk for m in sent]).update(sent=stamp)
+            if invalid:
+                User.objects.filter(gcm_token__in=invalid).update(gcm_token=None)
+            for old, new in canonical.items():
+                User.objects.filter(gcm_token=old).update(gcm_token=new)
+        for message in sent:
+            message.sent = stamp
+        return len(sent)
+
+    def dispatch(self, limit=1000):
+        """
+        Send up to `limit` due messages from the outbox, oldest first.
+        """
+        # Messages to users without a token can't be delivered, leave them out.
+        # A subquery rather than a join so FOR UPDATE doesn't lock the users.
+        reachable = User.objects.exclude(gcm_token='').exclude(gcm_token__isnull=True).values('pk')
+        stamp = now()
+        with transaction.atomic():
+            # Several workers can run side by side, each claims its own rows:
+            # until next_attempt the others leave them alone
+            messages = list(RideMessage.objects.select_for_update(skip_locked=True)
+                            .filter(sent__isnull=True, failed__isnull=True, receiver__in=reachable)
+                            .filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=stamp))
+                            .order_by('created')[:limit])
+            claims = {}
+            for message in messages:
+                message.attempts += 1
+                message.next_attempt = stamp + timedelta(seconds=self.attempt_delay * 2 ** (message.attempts - 1))
+                claims.setdefault((message.attempts, message.next_attempt), []).append(message.pk)
+            for (attempts, next_attempt), pks in claims.items():
+                RideMessage.objects.filter(pk__in=pks).update(attempts=attempts, next_attempt=next_attempt)
+        if not messages:
+            return 0, 0
+
+        # The provider requests (and their retries) hold no locks
+        sent = self.send_messages(messages)
+        given_up = [message.pk for message in messages
+                    if message.sent is None and message.attempts >= self.max_attempts]
+        if given_up:
+            logger.warning('Giving up on %d push messages after %d attempts', len(given_up), self.max_attempts)
+            RideMessage.objects.filter(pk__in=given_up).update(failed=now())
+        return len(messages), sent
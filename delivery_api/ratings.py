@@ -0,0 +1,31 @@
+"""
+Recomputation of the User.rating_sum / rating_count running totals.
+"""
+from django.db.models import Count, Sum
+
+from delivery_api.models import Ride, User
+
+
+def expected_ratings():
+    """
+    Map user id to (rating_sum, rating_count) as computed from the rides.
+    """
+    expected = {}
+    driver_rows = (Ride.objects.filter(customer_rating__gt=0, driver__is_driver=True)
+                   .values_list('driver').annotate(total=Sum('customer_rating'), count=Count('pk')))
+    customer_rows = (Ride.objects.filter(driver_rating__gt=0, customer__is_driver=False)
+                     .values_list('customer').annotate(total=Sum('driver_rating'), count=Count('pk')))
+    for user_id, total, count in list(driver_rows) + list(customer_rows):
+        expected[user_id] = (total, count)
+    return expected
+
+
+def rating_drift():
+    """
+    Yield (user id, current, expected) for users whose running totals are off.
+    """
+    expected = expected_ratings()
+    for user_id, total, count in User.objects.values_list('pk', 'rating_sum', 'rating_count').iterator():
+        values = expected.get(user_id, (0, 0))
+        if (total, count) != values:
+            yield user_id, (total, count), values
@@ -0,0 +1,220 @@
+"""
+Offline routing on a road network loaded from an OpenStreetMap XML extract.
+
+The graph is kept as compressed sparse row arrays (`offsets` into `targets`,
+`lengths` and `speeds`), nodes are snapped through a grid index and routes
+are found with A* on travel time. RoadGraphProvider plugs into
+DISTANCE_PROVIDER and returns the same dict as the other providers.
+
+Build the graph once with `manage.py build_road_graph extract.osm graph.bin`
+and point ROAD_GRAPH_FILE at the output.
+"""
+import heapq
+import pickle
+from array import array
+from math import cos, radians
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from django.conf import settings
+
+from delivery_api.distance import format_distance, format_duration, haversine
+
+# Default speeds in km/h for routable highway types
+HIGHWAY_SPEEDS = {
+    'motorway': 90, 'motorway_link': 50,
+    'trunk': 70, 'trunk_link': 40,
+    'primary': 50, 'primary_link': 35,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 25,
+    'living_street': 10, 'service': 15, 'track': 15,
+}
+
+GRID_SIZE = 0.01  # degrees, roughly 1.1 km
+
+
+# Meters per second per unit of maxspeed, km/h unless tagged otherwise
+SPEED_UNITS = {'': 1 / 3.6, 'km/h': 1 / 3.6, 'kmh': 1 / 3.6, 'mph': 1.609344 / 3.6, 'knots': 1.852 / 3.6}
+
+
+def _speed(tags):
+    """
+    Speed in m/s from the maxspeed tag, or the highway type default.
+    """
+    value, _, unit = tags.get('maxspeed', '').strip().partition(' ')
+    if value.endswith('mph'):
+        value, unit = value[:-3], 'mph'
+    try:
+        speed = float(value) * SPEED_UNITS[unit.strip().lower()]
+    except (KeyError, ValueError):
+        speed = 0
+    # 'none', 'signals' and 0 fall back to the default as well
+    if speed > 0:
+        return speed
+    return HIGHWAY_SPEEDS[tags['highway']] / 3.6
+
+
+class RoadGraph(object):
+
+    def __init__(self, lngs, lats, offsets, targets, lengths, speeds):
+        self.lngs = lngs
+        self.lats = lats
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+        self.speeds = speeds
+        self.max_speed = max(speeds) if speeds else 1.0
+        self.grid = {}
+        for node in range(len(lngs)):
+            self.grid.setdefault(self._cell(lngs[node], lats[node]), []).append(node)
+
+    @classmethod
+    def from_osm(cls, path):
+        nodes = {}
+        ways = []
+        for event, elem in ElementTree.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                nodes[elem.get('id')] = (float(elem.get('lon')), float(elem.get('lat')))
+                elem.clear()
+            elif elem.tag == 'way':
+                tags = dict((tag.get('k'), tag.get('v')) for tag in elem.iter('tag'))
+                if tags.get('highway') in HIGHWAY_SPEEDS:
+                    refs = [nd.get('ref') for nd in elem.iter('nd')]
+                    ways.append((refs, _speed(tags), tags.get('oneway') in ('yes', '1', 'true'),
+                                 tags.get('oneway') == '-1'))
+                elem.clear()
+
+        # Number only the nodes that are on a routable way
+        index = {}
+        lngs, lats = array('d'), array('d')
+        edges = []
+        for refs, speed, oneway, reverse in ways:
+            refs = [ref for ref in refs if ref in nodes]
+            for ref in refs:
+                if ref not in index:
+                    index[ref] = len(lngs)
+                    lngs.append(nodes[ref][0])
+                    lats.append(nodes[ref][1])
+            for a, b in zip(refs, refs[1:]):
+                source, target = index[a], index[b]
+                length = haversine((lngs[source], lats[source]), (lngs[target], lats[target]))
+                if not reverse:
+                    edges.append((source, target, length, speed))
+                if reverse or not oneway:
+                    edges.append((target, source, length, speed))
+
+        edges.sort()
+        offsets = array('l', [0] * (len(lngs) + 1))
+        targets, lengths, speeds = array('l'), array('f'), array('f')
+        for source, target, length, speed in edges:
+            offsets[source + 1] += 1
+            targets.append(target)
+            lengths.append(length)
+            speeds.append(speed)
+        for node in range(len(lngs)):
+            offsets[node + 1] += offsets[node]
+        return cls(lngs, lats, offsets, targets, lengths, speeds)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(*pickle.load(f))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((self.lngs, self.lats, self.offsets, self.targets, self.lengths, self.speeds),
+                        f, protocol=2)
+
+    def _cell(self, lng, lat):
+        return int(lng // GRID_SIZE), int(lat // GRID_SIZE)
+
+    def nearest_node(self, lng, lat, max_rings=3):
+        """
+        Closest node to a coordinate and its distance in meters, or (None, None).
+        """
+        cx, cy = self._cell(lng, lat)
+        best, best_dist = None, None
+        for ring in range(max_rings + 1):
+            for x in range(cx - ring, cx + ring + 1):
+                for y in range(cy - ring, cy + ring + 1):
+                    if max(abs(x - cx), abs(y - cy)) != ring:
+                        continue
+                    for node in self.grid.get((x, y), ()):
+                        dist = haversine((lng, lat), (self.lngs[node], self.lats[node]))
+                        if best_dist is None or dist < best_dist:
+                            best, best_dist = node, dist
+            # Nodes in the next ring are at least `ring` cells away
+            if best is not None and best_dist < ring * GRID_SIZE * 111000 * cos(radians(lat)):
+                break
+        return best, best_dist
+
+    def route(self, source, target):
+        """
+        Fastest path between two nodes as (meters, seconds), or None.
+        """
+        lngs, lats = self.lngs, self.lats
+        tlng, tlat = lngs[target], lats[target]
+        max_speed = self.max_speed
+
+        best = {source: 0.0}
+        meters = {source: 0.0}
+        queue = [(0.0, 0.0, source)]
+        while queue:
+            estimate, seconds, node = heapq.heappop(queue)
+            if node == target:
+                return meters[node], seconds
+            if seconds > best.get(node, seconds):
+                continue
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                neighbour = self.targets[edge]
+                cost = seconds + self.lengths[edge] / self.speeds[edge]
+                if cost < best.get(neighbour, float('inf')):
+                    best[neighbour] = cost
+                    meters[neighbour] = meters[node] + self.lengths[edge]
+                    remaining = haversine((lngs[neighbour], lats[neighbour]), (tlng, tlat)) / max_speed
+                    heapq.heappush(queue, (cost + remaining, cost, neighbour))
+        return None
+
+
+_graph = None
+
+
+def get_road_graph():
+    global _graph
+    if _graph is None:
+        _graph = RoadGraph.load(settings.ROAD_GRAPH_FILE)
+    return _graph
+
+
+class RoadGraphProvider(object):
+    """
+    Distance provider answering from the local road graph.
+    """
+    # Speed for the stretch between a point and its snapped road node
+    snap_speed = 10 / 3.6
+
+    def __init__(self, graph=None):
+        self.graph = graph or get_road_graph()
+
+    def __call__(self, origin, destination):
+        source, source_snap = self.graph.nearest_node(origin.coords[0], origin.coords[1])
+        target, target_snap = self.graph.nearest_node(destination.coords[0], destination.coords[1])
+        if source is None or target is None:
+            return None
+        if max(source_snap, target_snap) > settings.ROAD_GRAPH_MAX_SNAP:
+            return None
+
+        result = self.graph.route(source, target)
+        if result is None:
+            return None
+        meters, seconds = result
+        meters += source_snap + target_snap
+        seconds += (source_snap + target_snap) / self.snap_speed
+        return {
+            'distance': format_distance(meters),
+            'duration': format_duration(seconds),
+            'meters': int(meters),
+        }
@@ -1,13 +1,14 @@
 import json
 
 from django import forms
+from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.utils.timezone import now
 
 from drf_extra_fields.fields import Base64ImageField
-from oauth2_provider.models import AccessToken
 from rest_framework import serializers
 
-from delivery_api.models import Ride, User, LocationLog, ErrorLog, Payment
+from delivery_api.models import Ride, User, LocationLog, Payment
 from sorl.thumbnail import get_thumbnail
 
 
@@ -172,6 +173,37 @@ class LocationLogSerializer(serializers.ModelSerializer):
         )
 
 
+class LocationPointSerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    created = serializers.DateTimeField(required=False)
+
+    def validate_created(self, created):
+        # Client clocks, and points buffered for too long, are not trusted
+        age = (now() - created).total_seconds()
+        if age < -settings.LOCATION_CLOCK_SKEW:
+            raise serializers.ValidationError('Points can not be in the future')
+        if age > settings.LOCATION_MAX_AGE:
+            raise serializers.ValidationError(
+                'Points can be at most {0} seconds old'.format(settings.LOCATION_MAX_AGE))
+        return created
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    points = LocationPointSerializer(many=True)
+
+    def validate_points(self, points):
+        if not points:
+            raise serializers.ValidationError('At least one point is required')
+        if len(points) > settings.LOCATION_BATCH_SIZE:
+            raise serializers.ValidationError(
+                'At most {0} points per request'.format(settings.LOCATION_BATCH_SIZE))
+        stamp = now()
+        for point in points:
+            point.setdefault('created', stamp)
+        return sorted(points, key=lambda point: point['created'])
+
+
 class AccountCreateSerializer(serializers.ModelSerializer):
     position = PointSerializer(required=False)
     email = serializers.EmailField(required=True)
@@ -303,6 +335,7 @@ class RideSerializer(serializers.ModelSerializer):
             'ride_fare',
             'start',
             'state',
+            'version',
         )
 
 
@@ -317,24 +350,25 @@ class RatingSerializer(serializers.ModelSerializer):
         )
 
 
-class ErrorLogSerializer(serializers.ModelSerializer):
-
-    ride = serializers.PrimaryKeyRelatedField(queryset=Ride.objects, required=False)
-
-    def to_internal_value(self, data):
-        ret = super(ErrorLogSerializer, self).to_internal_value(data)
-        try:
-            ret['user'] = AccessToken.objects.get(token=data['token']).user
-        except (AccessToken.DoesNotExist, KeyError):
-            pass
-        return ret
-
-    class Meta:
-        model = ErrorLog
-        fields = (
-            'data',
-            'level',
-            'message',
-            'ride',
-            'token',
-        )
+class ErrorLogSerializer(serializers.Serializer):
+    """
+    An error report; stored by delivery_api.errorlog.record.
+    """
+    level = serializers.CharField(max_length=100)
+    message = serializers.CharField(required=False, allow_blank=True, default='')
+    data = serializers.CharField(required=False, allow_blank=True, default='')
+    token = serializers.CharField(required=False, allow_blank=True, max_length=1000, default='')
+    # Reports of unknown rides are kept without their ride
+    ride = serializers.IntegerField(required=False, allow_null=True)
+
+
+class ErrorLogBatchSerializer(serializers.Serializer):
+    errors = ErrorLogSerializer(many=True)
+
+    def validate_errors(self, errors):
+        if not errors:
+            raise serializers.ValidationError('At least one error is required')
+        if len(errors) > settings.ERROR_LOG['BATCH_SIZE']:
+            raise serializers.ValidationError(
+                'At most {0} errors per request'.format(settings.ERROR_LOG['BATCH_SIZE']))
+        return errors
@@ -0,0 +1,68 @@
+/*
+ * Live ride updates in the Ride admin, instead of reloading the page on a
+ * timer. Listens to the staff event stream served by delivery/asgi.py.
+ */
+(function () {
+    'use strict';
+
+    var EVENTS_URL = '/events/fleet/';
+
+    // Ride id on a change form (/admin/delivery_api/ride/<id>/change/)
+    function currentRide() {
+        var match = window.location.pathname.match(/\/ride\/(\d+)\/change\/$/);
+        return match ? parseInt(match[1], 10) : null;
+    }
+
+    function notice(text) {
+        var list = document.getElementById('ride-live-notice');
+        if (!list) {
+            var content = document.getElementById('content');
+            list = document.createElement('ul');
+            list.id = 'ride-live-notice';
+            list.className = 'messagelist';
+            content.parentNode.insertBefore(list, content);
+        }
+        list.innerHTML = '';
+        var item = document.createElement('li');
+        item.className = 'info';
+        item.textContent = text;
+        list.appendChild(item);
+    }
+
+    // Update the state column of the ride's row, false if it is not listed
+    function updateRow(event) {
+        var checkbox = document.querySelector('#result_list input.action-select[value="' + event.id + '"]');
+        if (!checkbox) {
+            return false;
+        }
+        var row = checkbox.parentNode.parentNode;
+        var cell = row.querySelector('td.field-state');
+        if (cell) {
+            cell.textContent = event.state_display;
+        }
+        row.className += ' ride-live-updated';
+        return true;
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        if (!window.EventSource) {
+            return;
+        }
+        var ride = currentRide();
+        var list = document.getElementById('result_list');
+        var unlisted = 0;
+        var source = new EventSource(EVENTS_URL);
+
+        source.addEventListener('ride', function (message) {
+            var event = JSON.parse(message.data);
+            if (ride !== null) {
+                if (event.id === ride) {
+                    notice('This ride is now ' + event.state_display + ', reload to see all changes.');
+                }
+            } else if (list && !updateRow(event)) {
+                unlisted += 1;
+                notice(unlisted + ' ride(s) not on this page changed, reload to see them.');
+            }
+        });
+    });
+}());
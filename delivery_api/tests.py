@@ -1,3 +1,880 @@
-from django.test import TestCase
+import base64
+import json
+from datetime import datetime, timedelta
+from io import BytesIO
+from math import cos, radians, sin
+from unittest import skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now, utc
+from django_fsm import TransitionNotAllowed
+from moneyed.classes import Money
+from rest_framework.test import APIClient
+
+from delivery_api import callbacks, errorlog, events, kpis, partitions, trajectory
+from delivery_api.distance import DistanceCache, FakeDistanceProvider, LocMemBackend, geohash, haversine
+from delivery_api.fares import TariffEngine
+from delivery_api.live import get_driver_store
+from delivery_api.models import (
+    ErrorLog, LocationLog, Payment, PaymentCallback, Ride, RideLog, RideMessage, RideRoute, RideTrajectory, Tariff,
+    User, calculate_fare, route_length)
+from delivery_api.pings import ACCEPTED, REJECTED, SUPPRESSED, LocMemState, PingFilter
+from delivery_api.push import PushDispatcher, StubTransport
+from delivery_api.routing import RoadGraph, RoadGraphProvider
+from delivery_api.transitions import transition_ride
+
+try:
+    import asyncio
+    from delivery import asgi
+except (ImportError, SyntaxError):
+    # Python 2
+    asgi = None
+
+# Tests of cached state use an in-process cache instead of Redis
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+LOCMEM_DRIVERS = dict(settings.LIVE_DRIVERS, BACKEND='delivery_api.live.LocMemDriverStore')
+
+
+class RideTransitionTest(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer')
+        self.driver = User.objects.create(username='driver', is_driver=True)
+        # Saving a new ride with a driver moves it to 'requested'
+        self.ride = Ride.objects.create(customer=self.customer, driver=self.driver)
+
+    def test_transition_is_one_statement(self):
+        with self.assertNumQueries(1):
+            transition_ride(self.ride, 'accept', user=self.driver)
+
+        ride = Ride.objects.get(pk=self.ride.pk)
+        self.assertEqual(ride.state, 'accepted')
+        self.assertIsNotNone(ride.accepted_at)
+        self.assertEqual(User.objects.get(pk=self.driver.pk).state, 'driving')
+        self.assertEqual(list(RideLog.objects.filter(ride=ride).values_list('state', 'user')),
+                         [('accepted', self.driver.pk)])
+
+    def test_fare_transitions(self):
+        Ride.objects.filter(pk=self.ride.pk).update(state='accepted', waypoints_count=2, waypoints_length=0.05)
+        self.ride.state, self.ride.waypoints_count, self.ride.waypoints_length = 'accepted', 2, 0.05
+
+        # The locked waypoint totals, the tariff, then the transition
+        with self.assertNumQueries(3):
+            transition_ride(self.ride, 'dropoff', user=self.driver)
+        self.assertEqual(self.ride.distance['distance'], '5.0 km')
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).fare, self.ride.fare)
+
+        # The route is stored after the commit
+        with self.assertNumQueries(3):
+            transition_ride(self.ride, 'finalize')
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).state, 'finalized')
+
+    def test_fare_from_the_locked_row(self):
+        Ride.objects.filter(pk=self.ride.pk).update(state='accepted', waypoints_count=2, waypoints_length=0.05)
+        # A stale instance, points were recorded since it was read
+        self.ride.state, self.ride.waypoints_count, self.ride.waypoints_length = 'accepted', 2, 0.01
+
+        transition_ride(self.ride, 'dropoff', user=self.driver)
+        self.assertEqual(self.ride.distance['distance'], '5.0 km')
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).distance['distance'], '5.0 km')
+
+    def test_transition_from_wrong_state(self):
+        with self.assertNumQueries(1):
+            with self.assertRaises(TransitionNotAllowed):
+                transition_ride(self.ride, 'dropoff')
+
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).state, 'requested')
+        self.assertEqual(User.objects.get(pk=self.driver.pk).state, 'available')
+        self.assertFalse(RideLog.objects.filter(ride=self.ride).exists())
+
+
+class CurrentRideTest(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer')
+        self.driver = User.objects.create(username='driver', is_driver=True)
+        self.ride = Ride.objects.create(customer=self.customer, driver=self.driver)
+        # Distance from the running totals, not from the LocationLog
+        Ride.objects.filter(pk=self.ride.pk).update(waypoints_count=1)
+        self.client = APIClient()
+
+    def test_pointer_follows_transitions(self):
+        self.assertEqual(User.objects.get(pk=self.customer.pk).current_ride_id, self.ride.pk)
+        self.assertEqual(User.objects.get(pk=self.driver.pk).current_ride_id, self.ride.pk)
+
+        transition_ride(self.ride, 'cancel', user=self.customer)
+        self.assertIsNone(User.objects.get(pk=self.customer.pk).current_ride_id)
+        self.assertIsNone(User.objects.get(pk=self.driver.pk).current_ride_id)
+
+    def test_ride_list_queries(self):
+        for user in (self.customer, self.driver):
+            self.client.force_authenticate(user=User.objects.get(pk=user.pk))
+            # The version of the ride, the ride with its customer and driver, and its latest payment
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/rides/')
+            self.assertEqual([ride['id'] for ride in response.data], [self.ride.pk])
+
+    def test_ride_list_without_active_ride(self):
+        transition_ride(self.ride, 'cancel', user=self.customer)
+        self.client.force_authenticate(user=User.objects.get(pk=self.customer.pk))
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/rides/')
+        self.assertEqual(response.data, [])
+
+
+@override_settings(LIVE_DRIVERS=LOCMEM_DRIVERS)
+class DriverListTest(TestCase):
+
+    def test_database_only_without_live_drivers(self):
+        near = User.objects.create(username='near', is_driver=True, position=Point(36.8172, -1.2864))
+        far = User.objects.create(username='far', is_driver=True, position=Point(36.8272, -1.2864))
+        store = get_driver_store()
+        store.clear()
+        params = {'latitude': -1.2864, 'longitude': 36.8172, 'limit': 2}
+
+        response = APIClient().get('/api/drivers/', params)
+        self.assertEqual([driver['id'] for driver in response.data], [near.pk, far.pk])
+
+        # The near driver stopped pinging
+        store.update(far.pk, far.position, True)
+        response = APIClient().get('/api/drivers/', params)
+        self.assertEqual([driver['id'] for driver in response.data], [far.pk])
+
+    def test_saving_a_driver_only_changes_its_state(self):
+        store = get_driver_store()
+        store.clear()
+        point = Point(36.8172, -1.2864)
+        driver = User.objects.create(username='driver', is_driver=True, position=point)
+        # The stored position is not a ping
+        self.assertEqual(store.nearest(point, 5, 1000), [])
+
+        store.update(driver.pk, point, True)
+        driver.state = 'unavailable'
+        driver.save()
+        self.assertEqual(store.nearest(point, 5, 1000), [])
+
+
+@override_settings(LIVE_DRIVERS=LOCMEM_DRIVERS)
+class NearestDriversTest(TestCase):
+    origin = Point(36.8172, -1.2864, srid=4326)
+
+    def setUp(self):
+        self.near = self.user('near', 500)
+        self.middle = self.user('middle', 2000)
+        self.far = self.user('far', 5000)
+        self.user('busy', 100, state='driving')
+        self.user('customer', 100, is_driver=False)
+
+    def user(self, name, meters, is_driver=True, **kwargs):
+        # East of the origin, about 111.3 km per degree there
+        position = Point(self.origin.x + meters / 111300.0, self.origin.y, srid=4326)
+        return User.objects.create(username=name, is_driver=is_driver, position=position, **kwargs)
+
+    def test_radius_grows_until_k_drivers(self):
+        radii = [1000, 3000, 10000]
+        with self.assertNumQueries(1):
+            self.assertEqual(User.nearest_drivers(self.origin, 1, radii), [self.near])
+        with self.assertNumQueries(2):
+            drivers = User.nearest_drivers(self.origin, 2, radii)
+        self.assertEqual(drivers, [self.near, self.middle])
+        self.assertAlmostEqual(drivers[0].distance.m, 500, delta=5)
+        self.assertAlmostEqual(drivers[1].distance.m, 2000, delta=20)
+
+    def test_fewer_than_k_within_the_largest_radius(self):
+        with self.assertNumQueries(3):
+            drivers = User.nearest_drivers(self.origin, 5, [1000, 3000, 10000])
+        self.assertEqual(drivers, [self.near, self.middle, self.far])
+        self.assertEqual(User.nearest_drivers(self.origin, 5, [300]), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIVE_DRIVERS=LOCMEM_DRIVERS)
+class LocationBatchTest(TestCase):
+
+    def setUp(self):
+        self.driver = User.objects.create(username='driver', is_driver=True)
+        self.ride = Ride.objects.create(customer=User.objects.create(username='customer'), driver=self.driver)
+        self.started = now() - timedelta(minutes=5)
+        Ride.objects.filter(pk=self.ride.pk).update(state='driving', driving_at=self.started)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.driver)
+
+    def upload(self, *points):
+        return self.client.post('/api/location/batch/', [
+            {'latitude': -1.2864, 'longitude': 36.8172 + 0.005 * n, 'created': created.isoformat()}
+            for n, created in enumerate(points)], format='json')
+
+    def test_points_before_the_ride_are_not_counted(self):
+        response = self.upload(self.started - timedelta(hours=2), now() - timedelta(minutes=2), now())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['stored'], 3)
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).waypoints_count, 2)
+
+    def test_single_ping_verdicts(self):
+        location = {'location': {'latitude': -1.2864, 'longitude': 36.8172}}
+        response = self.client.post('/api/location/', location, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['user']['id'], self.driver.pk)
+        response = self.client.post('/api/location/', location, format='json')
+        self.assertEqual((response.status_code, response.data), (200, {'status': 'suppressed'}))
+
+    def test_points_out_of_range_are_rejected(self):
+        self.assertEqual(self.upload(now() + timedelta(hours=1)).status_code, 400)
+        self.assertEqual(self.upload(now() - timedelta(days=30)).status_code, 400)
+        self.assertFalse(LocationLog.objects.filter(user=self.driver).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DriverEventTest(TestCase):
+
+    def test_positions_are_throttled(self):
+        driver = User.objects.create(username='driver', is_driver=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(events.driver_moved(driver, Point(36.8172, -1.2864)))
+        with self.assertNumQueries(0):
+            self.assertFalse(events.driver_moved(driver, Point(36.8173, -1.2864)))
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer')
+        self.driver = User.objects.create(username='driver', is_driver=True)
+        self.ride = Ride.objects.create(customer=self.customer, driver=self.driver)
+        Ride.objects.filter(pk=self.ride.pk).update(waypoints_count=1)
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(pk=self.customer.pk))
+
+    def revalidate(self, url, queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(queries):
+            return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_ride_not_modified(self):
+        for url in ('/api/rides/', '/api/rides/{0}/'.format(self.ride.pk)):
+            response = self.revalidate(url, 1)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_ride_modified(self):
+        url = '/api/rides/{0}/'.format(self.ride.pk)
+        etag = self.client.get(url)['ETag']
+        transition_ride(self.ride, 'accept', user=self.driver)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['state'], 'accepted')
+
+    def test_wait_without_change(self):
+        url = '/api/rides/{0}/wait/'.format(self.ride.pk)
+        version = self.client.get(url).data['version']
+        self.assertEqual(self.client.get(url, {'since': version}).status_code, 304)
+        transition_ride(self.ride, 'cancel', user=self.customer)
+        response = self.client.get(url, {'since': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['version'], version)
+
+    def test_account_not_modified(self):
+        # last_login was just written by the first request
+        response = self.revalidate('/api/accounts/mine', 0)
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_login_keeps_the_etag(self):
+        User.objects.filter(pk=self.customer.pk).update(last_login=None)
+        response = self.client.get('/api/accounts/mine')
+        updated = User.objects.get(pk=self.customer.pk).updated
+        User.objects.filter(pk=self.customer.pk).update(last_login=now() - timedelta(days=1))
+        self.client.force_authenticate(user=User.objects.get(pk=self.customer.pk))
+
+        response = self.client.get('/api/accounts/mine', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        user = User.objects.get(pk=self.customer.pk)
+        self.assertEqual(user.updated, updated)
+        self.assertGreater(user.last_login, now() - timedelta(minutes=1))
+
+
+@skipIf(asgi is None, 'The ASGI application needs Python 3')
+class RideWaitAsgiTest(TransactionTestCase):
+    """
+    The long poll as served by delivery/asgi.py; its threads use their own
+    connections, so the data is committed.
+    """
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer')
+        self.customer.set_password('secret')
+        self.customer.save()
+        self.ride = Ride.objects.get(pk=Ride.objects.create(customer=self.customer).pk)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        if asgi.hub.connection is not None:
+            asgi.hub.connection.close()
+            asgi.hub.connection = None
+        self.loop.close()
+
+    def wait(self, since, authorization):
+        messages = []
+
+        def send(message):
+            messages.append(message)
+            sent = self.loop.create_future()
+            sent.set_result(None)
+            return sent
+
+        scope = {'type': 'http', 'path': '/api/rides/{0}/wait/'.format(self.ride.pk),
+                 'query_string': 'since={0}'.format(since).encode('latin1'),
+                 'headers': [(b'authorization', authorization)]}
+        # The client never disconnects
+        self.loop.run_until_complete(asgi.application(scope, self.loop.create_future, send))
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def basic(self, password):
+        return b'Basic ' + base64.b64encode('customer:{0}'.format(password).encode('utf-8'))
+
+    def test_basic_auth_as_on_the_api(self):
+        status, body = self.wait(0, self.basic('secret'))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode('utf-8'))['version'], self.ride.version)
+        self.assertEqual(self.wait(0, self.basic('wrong'))[0], 401)
+
+    def test_jwt_auth(self):
+        status, body = self.wait(0, 'JWT {0}'.format(self.customer.get_jwt_token()).encode('latin1'))
+        self.assertEqual(status, 200)
+
+    @override_settings(RIDE_WAIT_TIMEOUT=0.2)
+    def test_not_modified(self):
+        self.assertEqual(self.wait(self.ride.version, self.basic('secret'))[0], 304)
+
+
+class LoadRoutesTest(TestCase):
+
+    def test_routes_in_one_query(self):
+        customer = User.objects.create(username='customer')
+        start = datetime(2026, 10, 1, 8, tzinfo=utc)
+        rides = []
+        for number in range(3):
+            driver = User.objects.create(username='driver{0}'.format(number), is_driver=True)
+            ride = Ride.objects.create(customer=customer, driver=driver)
+            Ride.objects.filter(pk=ride.pk).update(
+                state='finalized', driving_at=start, dropoff_at=start + timedelta(minutes=10))
+            # Points before, inside and after the ride
+            LocationLog.bulk_insert(driver, [
+                (Point(36.8 + number, -1.3 + minute / 1000.0, srid=4326), start + timedelta(minutes=minute))
+                for minute in (-5, 0, 5, 10, 15)])
+            rides.append(ride)
+        rides = list(Ride.objects.filter(pk__in=[ride.pk for ride in rides]))
+
+        with self.assertNumQueries(2):
+            routes = Ride.load_routes(rides)
+        for number, ride in enumerate(sorted(rides, key=lambda ride: ride.driver_id)):
+            self.assertEqual([lng for lat, lng in routes[ride.pk]], [36.8 + number] * 3)
+            self.assertEqual([lat for lat, lng in routes[ride.pk]],
+                             [-1.3 + minute / 1000.0 for minute in (0, 5, 10)])
+
+
+class RideRouteTest(TestCase):
+
+    def test_zoom_parameter(self):
+        customer = User.objects.create(username='customer')
+        ride = Ride.objects.create(customer=customer)
+        client = APIClient()
+        client.force_authenticate(user=customer)
+        url = '/api/rides/{0}/route/'.format(ride.pk)
+        self.assertEqual(client.get(url, {'zoom': 'abc'}).status_code, 400)
+        self.assertEqual(client.get(url, {'zoom': 99}).data['zoom'], settings.ROUTE_MAX_ZOOM)
+        self.assertEqual(client.get(url).data['zoom'], settings.ROUTE_DEFAULT_ZOOM)
+
+    def test_route_meters_after_retention(self):
+        driver = User.objects.create(username='driver', is_driver=True)
+        ride = Ride.objects.create(customer=User.objects.create(username='customer'), driver=driver)
+        start = datetime(2026, 10, 1, 8, tzinfo=utc)
+        Ride.objects.filter(pk=ride.pk).update(
+            state='finalized', driving_at=start, dropoff_at=start + timedelta(minutes=10))
+        LocationLog.bulk_insert(driver, [
+            (Point(36.8, -1.3 + minute / 1000.0, srid=4326), start + timedelta(minutes=minute))
+            for minute in (0, 5, 10)])
+        logged = Ride.objects.filter(pk=ride.pk).route_meters()[ride.pk]
+        self.assertGreater(logged, 0)
+
+        Ride.objects.get(pk=ride.pk).compact_trajectory()
+        LocationLog.objects.filter(user=driver).delete()
+        self.assertAlmostEqual(Ride.objects.filter(pk=ride.pk).route_meters()[ride.pk], logged, delta=logged / 100)
+
+
+@override_settings(LOCATION_TILES=dict(settings.LOCATION_TILES, TIMEOUT=0))
+class LocationTileTest(TestCase):
+
+    def test_points_are_merged_by_zoom(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        driver = User.objects.create(username='driver', is_driver=True)
+        start = datetime(2026, 10, 1, 8, tzinfo=utc)
+        # About 10 m apart
+        LocationLog.bulk_insert(driver, [(Point(36.8, -1.3, srid=4326), start),
+                                         (Point(36.8001, -1.3, srid=4326), start + timedelta(minutes=1))])
+        self.client.force_login(staff)
+
+        # At zoom 5 a tile pixel is about 2.4 km
+        response = self.client.get('/tiles/5/19/16.geojson')
+        self.assertEqual(response.status_code, 200)
+        features = json.loads(response.content.decode('utf-8'))['features']
+        self.assertEqual([feature['properties'] for feature in features], [{'layer': 'locations', 'pings': 2}])
+
+        response = self.client.get('/tiles/16/39467/33004.geojson')
+        self.assertEqual([feature['properties']['pings'] for feature in json.loads(response.content.decode('utf-8'))['features']], [1, 1])
+
+
+class DailyKPITest(TestCase):
+
+    def test_report_from_rollup(self):
+        customer = User.objects.create(username='customer', date_joined=datetime(2026, 9, 1, 9, tzinfo=utc))
+        driver = User.objects.create(username='driver', is_driver=True, date_joined=datetime(2026, 9, 1, 9, tzinfo=utc))
+        for day, method in ((1, 'cash'), (2, 'mpesa'), (20, 'cash')):
+            ride = Ride.objects.create(customer=customer, driver=driver)
+            Ride.objects.filter(pk=ride.pk).update(
+                state='finalized', payment_method=method, fare=Money(100, 'KES'),
+                created=datetime(2026, 9, day, 9, tzinfo=utc))
+        kpis.refresh(kpis.all_days())
+
+        with self.assertNumQueries(1):
+            rows = kpis.report(period='month')
+        september, total = [row for row in rows if row['rides_finalized']], rows[-1]
+        self.assertEqual(len(september), 1)
+        self.assertEqual(september[0]['customer_signups'], 1)
+        self.assertEqual(september[0]['rider_signups'], 1)
+        self.assertEqual(september[0]['rides_finalized'], 3)
+        # Counted once over the month, not once per day
+        self.assertEqual(september[0]['customers_paying'], 1)
+        self.assertEqual(september[0]['riders_active'], 1)
+        self.assertEqual((september[0]['revenue_cash'], september[0]['revenue_mpesa']), (200, 100))
+        self.assertIsNone(total['period'])
+        self.assertEqual(total['rides_finalized'], 3)
+
+        rows = kpis.report(period='week')
+        self.assertEqual([row['rides_finalized'] for row in rows if row['rides_finalized']], [2, 1, 3])
+
+
+class PaymentCallbackTest(TestCase):
+
+    def setUp(self):
+        customer = User.objects.create(username='customer')
+        driver = User.objects.create(username='driver', is_driver=True)
+        self.ride = Ride.objects.create(customer=customer, driver=driver, payment_method='mpesa')
+        Ride.objects.filter(pk=self.ride.pk).update(state='payment')
+        self.payment = Payment.objects.create(ride=self.ride, remote_id='ws_CO_1', status='Started')
+
+    def callback(self, checkout_id='ws_CO_1', result_code=0, receipt='NLJ7RT61SV'):
+        body = {'Body': {'stkCallback': {
+            'MerchantRequestID': '1', 'CheckoutRequestID': checkout_id, 'ResultCode': result_code,
+            'ResultDesc': 'The service request is processed successfully.',
+            'CallbackMetadata': {'Item': [{'Name': 'Amount', 'Value': 100},
+                                          {'Name': 'MpesaReceiptNumber', 'Value': receipt}]}}}}
+        response = self.client.post('/payment/status', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_callbacks_are_queued_and_applied_once(self):
+        self.callback()
+        self.callback()
+        self.callback(checkout_id='ws_CO_unknown')
+        self.client.post('/payment/status', 'not json', content_type='text/plain')
+        self.client.post('/payment/status', 'null', content_type='application/json')
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'Started')
+        self.assertEqual(PaymentCallback.objects.get(body='not json').payload, None)
+
+        results = callbacks.apply()
+        self.assertEqual(results, {'applied': 1, 'duplicate': 1, 'unmatched': 1, 'invalid': 2})
+        payment = Payment.objects.get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.mpesa_code), ('Completed', 'NLJ7RT61SV'))
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).state, 'rating')
+        self.assertFalse(PaymentCallback.objects.filter(processed__isnull=True).exists())
+        self.assertEqual(callbacks.apply(), {})
+
+
+@override_settings(PUSH_MAX_RETRIES=0, PUSH_MAX_ATTEMPTS=2, PUSH_ATTEMPT_DELAY=60)
+class RatingAggregateTest(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer')
+        self.driver = User.objects.create(username='driver', is_driver=True)
+        self.ride = Ride.objects.create(customer=self.customer, driver=self.driver)
+
+    def totals(self, user):
+        return User.objects.filter(pk=user.pk).values_list('rating_sum', 'rating_count').get()
+
+    def test_deltas_of_set_and_changed_ratings(self):
+        self.ride.customer_rating = 4
+        self.ride.save()
+        self.assertEqual(self.totals(self.driver), (4, 1))
+
+        self.ride.customer_rating, self.ride.driver_rating = 2, 5
+        self.ride.save()
+        self.assertEqual((self.totals(self.driver), self.totals(self.customer)), ((2, 1), (5, 1)))
+
+        Ride.objects.create(customer=self.customer, driver=self.driver, customer_rating=5)
+        self.assertEqual(self.totals(self.driver), (7, 2))
+
+        # A removed rating is no longer counted
+        self.ride.customer_rating = None
+        self.ride.save()
+        self.assertEqual(self.totals(self.driver), (5, 1))
+        self.assertEqual(User.objects.get(pk=self.driver.pk).rating, 5.0)
+
+    def test_drift_and_rebuild(self):
+        self.ride.customer_rating = 4
+        self.ride.save()
+        call_command('check_rating_drift', stdout=StringIO())
+
+        User.objects.filter(pk=self.driver.pk).update(rating_sum=9, rating_count=3)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_rating_drift', stdout=out)
+        self.assertIn('User {0}: 9/3, expected 4/1'.format(self.driver.pk), out.getvalue())
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertEqual(self.totals(self.driver), (4, 1))
+        call_command('check_rating_drift', stdout=StringIO())
+
+
+class TariffTest(TestCase):
+
+    def test_bands_and_minimum_fare(self):
+        engine = TariffEngine(base_fee=100, minimum_fare=200, bands=[[2, 50], [None, 30]])
+        # 100 + 2 km at 50 + 3 km at 30
+        self.assertEqual(engine.price([0, 1000, 5000, 12000]).tolist(), [200, 200, 290, 500])
+
+    def test_multipliers_wrap_around_midnight(self):
+        engine = TariffEngine(base_fee=100, bands=[[None, 10]], multipliers=[[22, 5, 1.5], [7, 9, 2]])
+        self.assertEqual(engine.price([10000] * 5, [23, 4, 5, 8, 12]).tolist(), [300, 300, 200, 400, 200])
+
+    def test_versions_by_activation(self):
+        first = datetime(2026, 10, 1, tzinfo=utc)
+        second = datetime(2026, 10, 10, tzinfo=utc)
+        old = Tariff.objects.create(name='standard', active_from=first, base_fee=100, bands=[[None, 10]])
+        new = Tariff.objects.create(name='standard', active_from=second, base_fee=150, bands=[[None, 10]])
+        # A candidate is never used
+        Tariff.objects.create(name='standard', base_fee=999)
+        self.assertEqual((old.version, new.version), (1, 2))
+
+        default = TariffEngine(**settings.DEFAULT_TARIFF).price([5000])[0]
+        self.assertEqual(Tariff.engine_at(first - timedelta(days=1)).price([5000])[0], default)
+        self.assertEqual(Tariff.engine_at(first + timedelta(days=1)).price([5000])[0], 150)
+        self.assertEqual(Tariff.engine_at(second + timedelta(days=1)).price([5000])[0], 200)
+        # The tariff of the ride's start, not the current one
+        self.assertEqual(calculate_fare(5000, second - timedelta(hours=1)), 150)
+
+
+class LocationPartitionTest(TestCase):
+
+    def setUp(self):
+        if not partitions.is_partitioned():
+            self.skipTest('LocationLog is not partitioned (PostgreSQL < 11)')
+        self.driver = User.objects.create(username='driver', is_driver=True)
+
+    def manage(self, **options):
+        out = StringIO()
+        call_command('manage_location_partitions', stdout=out, **options)
+        return out.getvalue()
+
+    def test_partitions_are_created_ahead(self):
+        today = partitions.period_start(now(), 'day')
+        # Received by the default partition until its range exists
+        LocationLog.bulk_insert(self.driver, [
+            (Point(36.8172, -1.2864, srid=4326), today + timedelta(days=2, hours=1))])
+        # Fire the deferred foreign key checks, pending ones block ALTER TABLE
+        connection.check_constraints()
+
+        self.manage(interval='day', ahead=2)
+        ranges = partitions.partitions()
+        self.assertEqual(ranges[-1].upper, today + timedelta(days=3))
+        for previous, partition in zip(ranges, ranges[1:]):
+            self.assertEqual(previous.upper, partition.lower)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM delivery_api_locationlog WHERE user_id = %s',
+                           [self.driver.pk])
+            self.assertEqual(cursor.fetchone()[0],
+                             '{0}_p{1}'.format(partitions.PARENT, ranges[-1].lower.strftime('%Y%m%d')))
+
+        self.assertNotIn('Created', self.manage(interval='day', ahead=2))
+
+    def test_routes_are_rolled_up_before_detaching(self):
+        customer = User.objects.create(username='customer')
+        start = now() - timedelta(hours=1)
+        rides = []
+        for state in ('finalized', 'rating'):
+            ride = Ride.objects.create(customer=customer, driver=self.driver)
+            Ride.objects.filter(pk=ride.pk).update(
+                state=state, driving_at=start, dropoff_at=start + timedelta(minutes=10))
+            rides.append(ride)
+        LocationLog.bulk_insert(self.driver, [
+            (Point(36.8, -1.3 + minute / 1000.0, srid=4326), start + timedelta(minutes=minute))
+            for minute in (0, 5, 10)])
+        connection.check_constraints()
+
+        # Every partition up to tomorrow has expired
+        output = self.manage(interval='day', ahead=0, retain=-1)
+        self.assertIn('Rolled up 2 rides', output)
+        self.assertFalse(LocationLog.objects.filter(user=self.driver).exists())
+        trajectories = RideTrajectory.objects.filter(ride__in=rides).order_by('ride')
+        self.assertEqual(list(trajectories.values_list('points', flat=True)), [3, 3])
+        # Only the finished route is cached
+        self.assertEqual(list(RideRoute.objects.values_list('ride', flat=True)), [rides[0].pk])
+
+
+class TrajectoryTest(TestCase):
+
+    def test_pack_round_trip(self):
+        lngs = [36.817201, 36.817255, 36.816990, 36.9]
+        lats = [-1.286401, -1.286350, -1.286502, -1.2]
+        seconds = [0, 5, 12, 3600]
+        unpacked = trajectory.unpack(trajectory.pack(lngs, lats, seconds))
+        self.assertEqual([values.tolist() for values in unpacked], [lngs, lats, seconds])
+        empty = trajectory.unpack(trajectory.pack([], [], []))
+        self.assertEqual([values.tolist() for values in empty], [[], [], []])
+
+    def test_route_read_from_the_trajectory(self):
+        driver = User.objects.create(username='driver', is_driver=True)
+        ride = Ride.objects.create(customer=User.objects.create(username='customer'), driver=driver)
+        start = datetime(2026, 10, 1, 8, tzinfo=utc)
+        Ride.objects.filter(pk=ride.pk).update(
+            state='finalized', driving_at=start, dropoff_at=start + timedelta(minutes=10))
+        LocationLog.bulk_insert(driver, [
+            (Point(lng, -1.3, srid=4326), start + timedelta(minutes=minute))
+            for lng, minute in ((36.8, 0), (36.805, 5), (36.81, 10))])
+        ride = Ride.objects.get(pk=ride.pk)
+        logged = ride.route
+        self.assertEqual(logged, [{'lat': -1.3, 'lng': lng} for lng in (36.8, 36.805, 36.81)])
+
+        ride.compact_trajectory()
+        LocationLog.objects.filter(user=driver).delete()
+        ride = Ride.objects.get(pk=ride.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(ride.route, logged)
+        self.assertAlmostEqual(ride.trajectory.length(), 0.01)
+        self.assertEqual(ride.waypoints_distance, '1.0')
+
+
+class PushDispatcherTest(TestCase):
+
+    def setUp(self):
+        self.receivers = [User.objects.create(username='receiver{0}'.format(n), gcm_token='token-{0}'.format(n))
+                          for n in range(5)]
+        ride = Ride.objects.create(customer=self.receivers[0])
+        self.messages = [RideMessage.objects.create(ride=ride, ride_state='accepted', title='Ride accepted',
+                                                    receiver=receiver) for receiver in self.receivers]
+
+    def test_batches_and_tokens(self):
+        transport = StubTransport(batch_size=2, invalid=['token-1'], canonical={'token-2': 'token-2b'})
+        self.assertEqual(PushDispatcher(transport=transport).dispatch(), (5, 5))
+        # One payload for five receivers, two per request
+        self.assertEqual(transport.requests, 3)
+        self.assertEqual(RideMessage.objects.filter(sent__isnull=True).count(), 0)
+        tokens = dict(User.objects.filter(pk__in=[user.pk for user in self.receivers]).values_list('pk', 'gcm_token'))
+        self.assertIsNone(tokens[self.receivers[1].pk])
+        self.assertEqual(tokens[self.receivers[2].pk], 'token-2b')
+
+    def test_failures_are_retried_later_then_given_up(self):
+        dispatcher = PushDispatcher(transport=StubTransport(unavailable=['token-0']))
+        self.assertEqual(dispatcher.dispatch(), (5, 4))
+        # Not due yet, whatever the limit
+        self.assertEqual(dispatcher.dispatch(limit=1), (0, 0))
+
+        RideMessage.objects.update(next_attempt=now())
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+        message = RideMessage.objects.get(pk=self.messages[0].pk)
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNotNone(message.failed)
+        RideMessage.objects.update(next_attempt=now())
+        self.assertEqual(dispatcher.dispatch(), (0, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ErrorLogTest(TestCase):
+
+    def test_identical_errors_are_counted(self):
+        ride = Ride.objects.create(customer=User.objects.create(username='customer'))
+        reports = [{'level': 'error', 'message': 'Timeout after {0} ms'.format(ms), 'token': 'unknown',
+                    'ride': ride.pk} for ms in (300, 450, 600)]
+        reports.append({'level': 'warning', 'message': 'Low battery', 'ride': ride.pk + 1})
+        response = self.client.post('/api/errors/', json.dumps({'errors': reports}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'received': 4, 'stored': 2})
+
+        timeout = ErrorLog.objects.get(level='error')
+        self.assertEqual((timeout.count, timeout.message, timeout.ride_id), (3, 'Timeout after 600 ms', ride.pk))
+        self.assertIsNone(ErrorLog.objects.get(level='warning').ride_id)
+
+        # The token is cached, and a single report needs no list
+        with self.assertNumQueries(1):
+            errorlog.record([dict(reports[0], ride=None)])
+        response = self.client.post('/api/errors/', json.dumps({'level': 'warning', 'message': 'Low battery'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(ErrorLog.objects.values_list('count', flat=True)), [2, 4])
+
+    @override_settings(ERROR_LOG=dict(settings.ERROR_LOG, SAMPLE_ABOVE=2, SAMPLE_RATE=0.5))
+    def test_sampling_above_the_rate(self):
+        sampler = errorlog.get_error_sampler()
+        self.assertEqual([sampler.weight('a', 1, when=0) for _ in range(2)], [1, 1])
+        weights = [sampler.weight('a', 1, when=1) for _ in range(200)]
+        self.assertEqual(set(weights), {0, 2})
+        self.assertEqual(sampler.weight('a', 1, when=61), 1)
+
+
+class DistanceCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.provider = FakeDistanceProvider()
+        self.cache = DistanceCache(self.provider, LocMemBackend(max_entries=2), precision=7, ttl=60)
+
+    def test_geohash(self):
+        self.assertEqual(geohash(Point(10.40744, 57.64911), 11), 'u4pruydqqvj')
+
+    def test_lookups_are_keyed_on_cells(self):
+        origin, destination = Point(36.8172, -1.2864), Point(36.8000, -1.3000)
+        first = self.cache.lookup(origin, destination)
+        # About 15 m away, in the same cells
+        self.assertEqual(self.cache.lookup(Point(36.8173, -1.2865), destination), first)
+        self.assertEqual(self.provider.calls, 1)
+        # Another destination cell
+        self.cache.lookup(origin, Point(36.8272, -1.2864))
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3.0})
+
+    def test_least_recently_used_is_evicted(self):
+        backend = LocMemBackend(max_entries=2)
+        backend.set('a', 1, 60)
+        backend.set('b', 2, 60)
+        self.assertEqual(backend.get('a'), 1)
+        backend.set('c', 3, 60)
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (1, None, 3))
+
+    def test_entries_expire(self):
+        backend = LocMemBackend()
+        backend.set('a', 1, -1)
+        self.assertIsNone(backend.get('a'))
+        cache = DistanceCache(self.provider, backend, ttl=-1)
+        origin, destination = Point(36.8172, -1.2864), Point(36.8000, -1.3000)
+        cache.lookup(origin, destination)
+        cache.lookup(origin, destination)
+        self.assertEqual((cache.hits, cache.misses, self.provider.calls), (0, 2, 2))
+
+
+ROAD_NETWORK = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lon="36.80" lat="-1.28"/>
+  <node id="2" lon="36.81" lat="-1.28"/>
+  <node id="3" lon="36.81" lat="-1.29"/>
+  <node id="4" lon="36.85" lat="-1.28"/>
+  <node id="5" lon="36.851" lat="-1.28"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="11"><nd ref="1"/><nd ref="3"/><tag k="highway" v="primary"/><tag k="maxspeed" v="30 mph"/></way>
+  <way id="12"><nd ref="4"/><nd ref="5"/><tag k="highway" v="service"/><tag k="maxspeed" v="0"/></way>
+</osm>
+"""
+
+
+class RoadGraphTest(SimpleTestCase):
+
+    def setUp(self):
+        self.graph = RoadGraph.from_osm(BytesIO(ROAD_NETWORK))
+
+    def test_speeds(self):
+        self.assertEqual(len(self.graph.lngs), 5)
+        speeds = sorted(set(round(speed, 2) for speed in self.graph.speeds))
+        # service default for maxspeed=0, residential default, 30 mph
+        self.assertEqual(speeds, [round(15 / 3.6, 2), round(25 / 3.6, 2), round(30 * 1.609344 / 3.6, 2)])
+
+    def test_snapping(self):
+        node, meters = self.graph.nearest_node(36.8101, -1.2801)
+        self.assertEqual((self.graph.lngs[node], self.graph.lats[node]), (36.81, -1.28))
+        self.assertAlmostEqual(meters, haversine((36.8101, -1.2801), (36.81, -1.28)), places=3)
+        self.assertEqual(self.graph.nearest_node(37.5, -1.28), (None, None))
+
+    def test_shortest_path(self):
+        first, _ = self.graph.nearest_node(36.80, -1.28)
+        third, _ = self.graph.nearest_node(36.81, -1.29)
+        # The primary road rather than the residential detour
+        meters, seconds = self.graph.route(first, third)
+        direct = haversine((36.80, -1.28), (36.81, -1.29))
+        self.assertAlmostEqual(meters, direct, delta=1)
+        self.assertAlmostEqual(seconds, direct / (30 * 1.609344 / 3.6), delta=1)
+
+    def test_unreachable_node(self):
+        first, _ = self.graph.nearest_node(36.80, -1.28)
+        island, _ = self.graph.nearest_node(36.85, -1.28)
+        self.assertIsNone(self.graph.route(first, island))
+        with self.settings(ROAD_GRAPH_MAX_SNAP=100):
+            provider = RoadGraphProvider(self.graph)
+            self.assertIsNone(provider(Point(36.80, -1.28), Point(36.85, -1.28)))
+            self.assertEqual(provider(Point(36.80, -1.28), Point(36.81, -1.29))['distance'], '1.6 km')
+
+
+class PingFilterTest(SimpleTestCase):
+    # About 1 m in degrees around Nairobi
+    meter = 1 / 111320.0
+
+    def track(self):
+        """
+        Pings every 5 seconds: parked for 10 minutes, a drive with a slow curve
+        through traffic, parked again for 10 minutes.
+        """
+        lng, lat = 36.8219, -1.2921
+        when = datetime(2026, 10, 17, 8, 0, tzinfo=utc)
+        pings = []
+
+        def ping():
+            pings.append((Point(lng, lat, srid=4326), when))
+
+        for i in range(120):
+            ping()
+            when += timedelta(seconds=5)
+        for i in range(300):
+            # 12 m/s, slowing down to 1 m/s in the curve
+            speed = 1 if 100 <= i < 200 else 12
+            heading = radians(min(max(i - 100, 0), 100) * 0.9)
+            lng += speed * 5 * cos(heading) * self.meter
+            lat += speed * 5 * sin(heading) * self.meter
+            when += timedelta(seconds=5)
+            ping()
+        for i in range(120):
+            when += timedelta(seconds=5)
+            ping()
+        return pings
+
+    def test_distance_with_and_without_filter(self):
+        pings = self.track()
+        ping_filter = PingFilter(state=LocMemState(), min_distance=10, max_speed=60, heartbeat=60)
+        stored = [point for point, when in pings if ping_filter.check(1, point, when) == ACCEPTED]
+
+        unfiltered = route_length([point for point, when in pings])
+        filtered = route_length(stored)
+        self.assertLess(abs(filtered - unfiltered) / unfiltered, 0.01)
+        self.assertLess(len(stored), len(pings) * 0.6)
+        self.assertEqual(ping_filter.stats()[SUPPRESSED], len(pings) - len(stored))
+
+    def test_heartbeat_and_jumps(self):
+        ping_filter = PingFilter(state=LocMemState(), min_distance=10, max_speed=60, heartbeat=60)
+        start = datetime(2026, 10, 17, 8, 0, tzinfo=utc)
+        point = Point(36.8219, -1.2921, srid=4326)
+        self.assertEqual(ping_filter.check(1, point, start), ACCEPTED)
+        self.assertEqual(ping_filter.check(1, point, start + timedelta(seconds=30)), SUPPRESSED)
+        self.assertEqual(ping_filter.check(1, point, start + timedelta(seconds=60)), ACCEPTED)
+        # 10 km in 10 seconds
+        far = Point(36.8219 + 10000 * self.meter, -1.2921, srid=4326)
+        self.assertEqual(ping_filter.check(1, far, start + timedelta(seconds=70)), REJECTED)
+        self.assertEqual(ping_filter.check(1, Point(0, 0), start + timedelta(seconds=80)), REJECTED)
+
+    def test_recovers_from_a_bad_first_fix(self):
+        ping_filter = PingFilter(state=LocMemState(), min_distance=10, max_speed=60, heartbeat=60, reanchor_after=3)
+        start = datetime(2026, 10, 17, 8, 0, tzinfo=utc)
+        # A cached fix 100 km away, then the real position, driving at 10 m/s
+        self.assertEqual(ping_filter.check(1, Point(37.7219, -1.2921), start), ACCEPTED)
+        verdicts = [ping_filter.check(1, Point(36.8219 + 50 * n * self.meter, -1.2921),
+                                      start + timedelta(seconds=5 * (n + 1))) for n in range(5)]
+        self.assertEqual(verdicts, [REJECTED, REJECTED, ACCEPTED, ACCEPTED, ACCEPTED])
@@ -0,0 +1,116 @@
+"""
+Map tiles of the location history, rendered by PostGIS.
+
+A tile (z, x, y in the usual web mercator scheme) holds two layers:
+
+- ``locations``: the LocationLog points in the tile, snapped to a grid of
+  LOCATION_TILES['PIXELS'] tile pixels and counted, so a tile has at most a
+  few thousand features whatever the zoom level or the period shown;
+- ``rides``: the driver's trail of each finished ride crossing the tile,
+  simplified to the same grid.
+
+Tiles are Mapbox vector tiles (ST_AsMVT, PostGIS 2.4+) or GeoJSON in WGS84
+with the same features.
+"""
+import json
+
+from django.db import connection
+
+EXTENT = 4096
+# Half the width of the web mercator world, in meters
+WORLD = 20037508.342789244
+
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857) AS tile,
+               ST_Transform(ST_MakeEnvelope(%(xmin)s - %(margin)s, %(ymin)s - %(margin)s,
+                                            %(xmax)s + %(margin)s, %(ymax)s + %(margin)s, 3857), 4326) AS area
+    ), locations AS (
+        SELECT snapped AS geom, count(*) AS pings
+        FROM (
+            SELECT ST_SnapToGrid(ST_Transform(log.location, 3857), %(grid)s) AS snapped
+            FROM delivery_api_locationlog log, bounds
+            WHERE log.location && bounds.area {location_filter}
+        ) points
+        GROUP BY snapped
+    ), rides AS (
+        SELECT ST_Simplify(ST_Transform(ST_MakeLine(log.location ORDER BY log.created), 3857), %(grid)s) AS geom,
+               ride.id, ride.driver_id AS driver
+        FROM delivery_api_ride ride
+        JOIN delivery_api_locationlog log
+          ON log.user_id = ride.driver_id AND log.created BETWEEN ride.driving_at AND ride.dropoff_at, bounds
+        WHERE log.location && bounds.area AND ride.dropoff_at IS NOT NULL {ride_filter}
+        GROUP BY ride.id
+        HAVING count(*) > 1
+    )
+"""
+
+MVT_SQL = TILE_SQL + """
+    SELECT
+        COALESCE((SELECT ST_AsMVT(features, 'locations', %(extent)s, 'geom') FROM (
+            SELECT ST_AsMVTGeom(geom, bounds.tile, %(extent)s) AS geom, pings FROM locations, bounds
+        ) features WHERE geom IS NOT NULL), ''::bytea) ||
+        COALESCE((SELECT ST_AsMVT(features, 'rides', %(extent)s, 'geom') FROM (
+            SELECT ST_AsMVTGeom(geom, bounds.tile, %(extent)s) AS geom, id, driver FROM rides, bounds
+        ) features WHERE geom IS NOT NULL), ''::bytea)
+"""
+
+GEOJSON_SQL = TILE_SQL + """
+    SELECT ST_AsGeoJSON(ST_Transform(geom, 4326), 6), 'locations', pings, NULL, NULL FROM locations
+    UNION ALL
+    SELECT ST_AsGeoJSON(ST_Transform(geom, 4326), 6), 'rides', NULL, id, driver FROM rides WHERE geom IS NOT NULL
+"""
+
+
+def tile_bounds(z, x, y):
+    """
+    (xmin, ymin, xmax, ymax) of a tile in web mercator meters.
+    """
+    size = 2 * WORLD / 2 ** z
+    return -WORLD + x * size, WORLD - (y + 1) * size, -WORLD + (x + 1) * size, WORLD - y * size
+
+
+def tile_params(z, x, y, pixels, user=None, since=None, until=None):
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    pixel = (xmax - xmin) / EXTENT
+    params = {
+        'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax,
+        # Points just outside the tile, for the ride lines crossing its border
+        'margin': pixel * 64,
+        'grid': pixel * pixels,
+        'extent': EXTENT,
+        'user': user, 'since': since, 'until': until,
+    }
+    location_filter, ride_filter = [], []
+    if user is not None:
+        location_filter.append('AND log.user_id = %(user)s')
+        ride_filter.append('AND (ride.driver_id = %(user)s OR ride.customer_id = %(user)s)')
+    if since is not None:
+        location_filter.append('AND log.created >= %(since)s')
+        ride_filter.append('AND ride.dropoff_at >= %(since)s')
+    if until is not None:
+        location_filter.append('AND log.created < %(until)s')
+        ride_filter.append('AND ride.driving_at < %(until)s')
+    return params, {'location_filter': ' '.join(location_filter), 'ride_filter': ' '.join(ride_filter)}
+
+
+def vector_tile(z, x, y, pixels, **filters):
+    params, filters = tile_params(z, x, y, pixels, **filters)
+    with connection.cursor() as cursor:
+        cursor.execute(MVT_SQL.format(**filters), params)
+        return bytes(cursor.fetchone()[0])
+
+
+def geojson_tile(z, x, y, pixels, **filters):
+    params, filters = tile_params(z, x, y, pixels, **filters)
+    features = []
+    with connection.cursor() as cursor:
+        cursor.execute(GEOJSON_SQL.format(**filters), params)
+        for geometry, layer, pings, ride, driver in cursor.fetchall():
+            properties = {'layer': layer}
+            if layer == 'locations':
+                properties['pings'] = pings
+            else:
+                properties.update(ride=ride, driver=driver)
+            features.append({'type': 'Feature', 'geometry': json.loads(geometry), 'properties': properties})
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,47 @@
+"""
+Compact storage of a ride's GPS points, see RideTrajectory.
+
+The points are kept as three delta encoded int32 arrays, compressed with zlib:
+
+    [latitude deltas][longitude deltas][time deltas]
+
+Coordinates are in 1e-6 degrees (about 0.1 m) and times in whole seconds
+after RideTrajectory.started, so consecutive pings give small deltas that
+compress well. Decoding is a single cumulative sum over the buffer.
+"""
+import zlib
+
+import numpy as np
+
+SCALE = 1e6
+
+
+def pack(lngs, lats, seconds):
+    """
+    Encode equally long sequences of longitudes, latitudes and seconds.
+    """
+    values = np.vstack([
+        np.round(np.asarray(lats, dtype=np.float64) * SCALE),
+        np.round(np.asarray(lngs, dtype=np.float64) * SCALE),
+        np.asarray(seconds, dtype=np.float64),
+    ]).astype(np.int64)
+    deltas = np.hstack([values[:, :1], np.diff(values, axis=1)])
+    return zlib.compress(deltas.astype('<i4').tobytes())
+
+
+def unpack(data):
+    """
+    Decode a packed buffer into (lngs, lats, seconds) arrays.
+    """
+    deltas = np.frombuffer(zlib.decompress(bytes(data)), dtype='<i4').reshape(3, -1)
+    values = np.cumsum(deltas, axis=1, dtype=np.int64)
+    return values[1] / SCALE, values[0] / SCALE, values[2]
+
+
+def length(lngs, lats):
+    """
+    Planar length in degrees, as models.route_length() computes it.
+    """
+    if len(lngs) < 2:
+        return 0.0
+    return float(np.hypot(np.diff(lngs), np.diff(lats)).sum())
@@ -0,0 +1,136 @@
+"""
+Ride state transitions as a single SQL statement.
+
+transition_ride() applies one of the Ride FSM transitions without
+Ride.save() or User.save(): the ride row is updated (and thereby locked)
+only if it is still in one of the transition's source states, the driver's
+state and the participants' current_ride pointers are updated, the RideLog
+row is written and the ride event is published, all in one round trip.
+
+The targets with a fare (dropoff, payment, finalized) first lock the ride row
+and read its waypoint totals, then the active Tariff, so take three queries;
+rides without running waypoint totals also read their trajectory or
+LocationLog points for the distance. A ride not in a source state is then
+rejected after the locking read alone. Finalizing stores
+the route (trajectory and polyline cache) once the transaction commits,
+with its own queries, so the ride row is not held locked meanwhile.
+"""
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+from django_fsm import TransitionNotAllowed
+from moneyed.classes import Money
+
+from delivery_api import events
+from delivery_api.live import driver_state_changed
+from delivery_api.models import Ride, calculate_fare, ride_version
+
+TRANSITION_SQL = """
+    WITH ride AS (
+        UPDATE delivery_api_ride
+        SET {assignments}
+        WHERE id = %(ride)s {source_filter}
+        RETURNING id, driver_id, customer_id
+    ), participants AS (
+        UPDATE delivery_api_user AS u
+        SET state = CASE WHEN u.id = ride.driver_id THEN %(driver_state)s ELSE u.state END,
+            current_ride_id = CASE
+                WHEN %(active)s THEN ride.id
+                WHEN u.current_ride_id = ride.id THEN NULL
+                ELSE u.current_ride_id END,
+            updated = %(now)s
+        FROM ride
+        WHERE u.id IN (ride.driver_id, ride.customer_id)
+    )
+    INSERT INTO delivery_api_ridelog (ride_id, created, state, location, user_id)
+    SELECT id, %(now)s, %(target)s, ST_GeomFromEWKT(%(location)s), %(user)s FROM ride
+    RETURNING ride_id, pg_notify(%(channel)s, %(event)s)
+"""
+
+
+def transition_ride(ride, name, user=None, location=None):
+    """
+    Apply transition `name` (e.g. 'accept') to `ride` and update the instance.
+    Raises TransitionNotAllowed when the ride is no longer in a source state.
+    """
+    if name not in Ride.driver_states:
+        raise TransitionNotAllowed('Unknown transition {0}'.format(name))
+    transitions = getattr(Ride, name)._django_fsm.transitions
+    sources = [source for source in transitions if source not in ('*', '+')]
+    target = list(transitions.values())[0].target
+
+    # Same rule as Ride.save(): cash rides skip the payment step
+    if target == 'payment' and ride.payment_method == 'cash':
+        target = 'rating'
+
+    stamp = now()
+    stamp_field = '{0}_at'.format(target)
+    params = {
+        'ride': ride.pk,
+        'target': target,
+        'now': stamp,
+        'driver_state': Ride.driver_states[name],
+        'active': target in Ride.active_states,
+        'location': location.ewkt if location else None,
+        'user': user.pk if user else None,
+        'sources': tuple(sources),
+    }
+    # Published by the statement itself, see delivery_api.events
+    event = dict(events.ride_event(ride), state=target, state_display=dict(Ride.state_choices)[target],
+                 updated=stamp.isoformat(), version=ride_version(stamp))
+    params.update(channel=settings.EVENTS_CHANNEL, event=json.dumps(event))
+
+    assignments = ['state = %(target)s', 'updated = %(now)s']
+    if target in Ride.timestamped_states:
+        assignments.append('{0} = COALESCE({0}, %(now)s)'.format(stamp_field))
+
+    source_filter = '*' not in transitions and '+' not in transitions
+    with_fare = target in ['dropoff', 'payment', 'finalized']
+    if with_fare:
+        assignments += ['distance = %(distance)s::jsonb', 'fare = %(fare)s', "fare_currency = 'KES'"]
+    sql = TRANSITION_SQL.format(
+        assignments=', '.join(assignments),
+        source_filter='AND state IN %(sources)s' if source_filter else '')
+
+    row = None
+    # Without a savepoint, so TransitionNotAllowed is raised after the block
+    with transaction.atomic(savepoint=False):
+        allowed = True
+        if with_fare:
+            # Fare on basis of the waypoints distance, as in Ride.update_route, of
+            # the locked row: record_waypoints() takes the same lock to add points
+            locked = Ride.objects.select_for_update().filter(pk=ride.pk).values_list(
+                'state', 'waypoints_length', 'waypoints_count').first()
+            allowed = locked is not None and (not source_filter or locked[0] in sources)
+            if allowed:
+                ride.waypoints_length, ride.waypoints_count = locked[1], locked[2]
+                meters = 1000 * float(ride.waypoints_distance)
+                distance = {
+                    'distance': '%s km' % ride.waypoints_distance,
+                    'duration': '-',
+                    'distance_meters': meters,
+                }
+                params.update(distance=json.dumps(distance), fare=calculate_fare(int(meters), ride.created))
+        if allowed:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+    if row is None:
+        raise TransitionNotAllowed("Can't {0} ride {1} from state '{2}'".format(name, ride.pk, ride.state))
+
+    ride.state = ride.previous_state = target
+    ride.updated = stamp
+    if target in Ride.timestamped_states and not getattr(ride, stamp_field):
+        setattr(ride, stamp_field, stamp)
+    if 'fare' in params:
+        ride.distance = distance
+        ride.fare = Money(params['fare'], 'KES')
+    driver_state_changed(ride.driver_id, params['driver_state'])
+    if ride.driver_id and Ride.driver.is_cached(ride):
+        ride.driver.state = params['driver_state']
+
+    if target == 'finalized':
+        transaction.on_commit(ride.store_route)
+    return ride
@@ -1,26 +1,57 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 import datetime
 import json
+import logging
 
 from django.conf import settings
-from django.contrib.auth.models import update_last_login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import Distance
-from django.db.models import Sum
+from django.core.cache import caches
 from django.http import Http404
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
+from django.utils.timezone import make_aware, now
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView, View
 
-from rest_framework import viewsets, generics, permissions, filters, exceptions
+from django_fsm import TransitionNotAllowed
+from rest_framework import viewsets, generics, permissions, filters, exceptions, status
+from rest_framework.response import Response
 
-from delivery_api.models import Ride, User, Rating, LocationLog, ErrorLog, PaymentResponseLog
+from delivery_api import errorlog, events, kpis, tiles
+from delivery_api.conditional import ConditionalGetMixin, version_of
+from delivery_api.live import get_driver_store, track_driver
+from delivery_api.models import Ride, User, Rating, LocationLog, PaymentCallback
 from delivery_api.permissions import IsCurrentUser
+from delivery_api.pings import ACCEPTED, REJECTED, get_ping_filter
+from delivery_api.transitions import transition_ride
 from delivery_api.serializers import (
     RideSerializer, UserSerializer, AccountSerializer, AccountCreateSerializer,
     RatingSerializer,
-    DriverSerializer, LocationLogSerializer, ErrorLogSerializer)
+    DriverSerializer, LocationLogSerializer, ErrorLogBatchSerializer, PointSerializer,
+    LocationBatchSerializer)
+
+logger = logging.getLogger(__name__)
+
+
+def route_zoom(params, strict=False):
+    """
+    The ``zoom`` parameter of a route, within the map's zoom levels;
+    ROUTE_DEFAULT_ZOOM when missing or, unless `strict`, invalid.
+    """
+    zoom = params.get('zoom')
+    if zoom in (None, ''):
+        return settings.ROUTE_DEFAULT_ZOOM
+    try:
+        return max(0, min(int(zoom), settings.ROUTE_MAX_ZOOM))
+    except ValueError:
+        if strict:
+            raise exceptions.ParseError('zoom must be a number')
+        return settings.ROUTE_DEFAULT_ZOOM
 
 
 
@@ -35,15 +66,25 @@ class MapView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(MapView, self).get_context_data(**kwargs)
+        zoom = route_zoom(self.request.GET)
+        try:
+            limit = int(self.request.GET.get('limit', settings.MAP_RIDES))
+        except ValueError:
+            limit = settings.MAP_RIDES
+        limit = max(1, min(limit, settings.MAP_MAX_RIDES))
+        objs = [obj for obj in Ride.objects.order_by('-created').filter(state__in=['finalized'])
+                .select_related('driver', 'route_cache')[0:limit]
+                if obj.origin and obj.destination and obj.driver]
+        # Routes of the rides that are not in the route cache yet, all at once
+        routes = Ride.load_routes([obj for obj in objs if obj.cached_route() is None])
         rides = []
-        for obj in Ride.objects.order_by('-created').filter(state__in=['finalized']).all()[0:10]:
-            if obj.origin and obj.destination and obj.driver:
-                rides += [{
-                    'name': "{0} {1}".format(obj.driver.first_name, obj.created.strftime('%d-%m-%Y %H:%M')),
-                    'route': obj.route
-
-                }]
-        context['rides'] = rides
+        for obj in objs:
+            rides += [{
+                'name': "{0} {1}".format(obj.driver.first_name, obj.created.strftime('%d-%m-%Y %H:%M')),
+                'polyline': obj.encoded_route(zoom, routes.get(obj.pk, []))
+
+            }]
+        context['rides'] = json.dumps(rides)
         return context
 
 
@@ -52,138 +93,128 @@ class RideMapView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(RideMapView, self).get_context_data(**kwargs)
+        zoom = route_zoom(self.request.GET)
         rides = []
         pk = kwargs.get('pk', 4)
-        obj = Ride.objects.get(pk=pk)
+        obj = Ride.objects.select_related('driver', 'route_cache').get(pk=pk)
         rides = []
         if obj.origin and obj.destination and obj.driver:
             rides += [{
                 'name': "{0} {1}".format(obj.driver.first_name, obj.created.strftime('%d-%m-%Y %H:%M')),
-                'route': obj.route
+                'polyline': obj.encoded_route(zoom)
 
             }]
-        context['rides'] = rides
+        context['rides'] = json.dumps(rides)
         return context
 
 
-class UserMapView(TemplateView):
-    template_name = 'map.html'
+@method_decorator(staff_member_required, name='dispatch')
+class FleetMapView(TemplateView):
+    """
+    Location history of the fleet, loaded tile by tile from LocationTileView.
+    ?since= and ?until= (dates) limit the period.
+    """
+    template_name = 'fleet_map.html'
+
+    def get_tile_filters(self):
+        return dict((name, self.request.GET[name]) for name in ('since', 'until') if name in self.request.GET)
 
     def get_context_data(self, **kwargs):
-        context = super(UserMapView, self).get_context_data(**kwargs)
-        dots = []
-        pk = kwargs.get('pk', 4)
-        user = User.objects.get(pk=pk)
-        for obj in user.locationlog_set.order_by('-created')[0:200]:
-            loc = obj.location
-            if loc:
-                dots += [{
-                    'name': str(user.first_name),
-                    'is_driver': int(user.is_driver),
-                    'longitude': loc.coords[0],
-                    'latitude': loc.coords[1]
-                }]
-        context['dots'] = dots
+        context = super(FleetMapView, self).get_context_data(**kwargs)
+        context['tile_filters'] = urlencode(self.get_tile_filters())
+        context['google_maps_api_key'] = settings.GOOGLE_MAPS_API_KEY
         return context
 
 
-class KpiView(View):
-
-    def get(self, request):
-        # Customer signups
-        # Signups at beginning of the month (in this case 1 January 2017)
-        customer_signups = User.objects.exclude(date_joined__gt=datetime.date(2017, 12, 31)).filter(
-            is_driver=False).count()
-
-        # New signups (organic and paid; in this case for January 2017)
-        customer_signups_new = User.objects.filter(date_joined__month=1, date_joined__year=2017,
-                                                   is_driver=False).count()
-
-        # m/m growth new signups = New signups month 2 / New signups month 1 - 1 * 100 (to be added later)
-
-
-        # Paying customers
-        # Customers paying
-        rides = Ride.objects.filter(created__month=7, created__year=2017, state='finalized')
-        customer_paying = rides.values_list('customer', flat=False).distinct().count()
-
-        # New customers paying
-        customer_paying_new = User.objects.filter(date_joined__month=8, date_joined__year=2017, is_driver=False,
-                                                  customer_ride=True).count()
-
-        # Lost customers paying: customer_paying.lastmonth 
-        # customer_lost_month=2 = customer_paying_month=1 - customer_paying_month=2 + customer_paying_new_month=2
-
-        # Rider signups
-        # Signups at beginning of the month (in this case 1 January 2017)
-        rider_signups = User.objects.exclude(date_joined__gt=datetime.date(2016, 12, 31)).filter(is_driver=True).count()
-
-        # New signups (organic and paid; in this case for January 2017)
-        rider_signups_new = User.objects.filter(date_joined__month=10, date_joined__year=2017, is_driver=True).count()
-
-        # m/m growth new signups = New signups month 2 / New signups month 1 - 1 * 100 (to be added later)        
+class UserMapView(FleetMapView):
 
+    def get_tile_filters(self):
+        user = get_object_or_404(User, pk=self.kwargs['pk'])
+        return dict(super(UserMapView, self).get_tile_filters(), user=user.pk)
 
-        # Active riders
-        # Riders available
-        rider_available = User.objects.filter(last_ping__month=7, is_driver=True).count()
 
-        # Riders active (test value with larger database since 'driver' might include customers)        
-        rider_active = rides.values_list('driver', flat=True).distinct().count()
-
-        # New riders active
-        rider_active_new = User.objects.filter(date_joined__month=8, date_joined__year=2017, is_driver=True,
-                                               driver_ride=True).count()
-
-        # Engagement stats
-        # Rides (finalized; in this case for January 2017)
-        rides_finalized = Ride.objects.filter(created__month=12, created__year=2017, state='finalized').count()
-
-        # Live stats
-        # Customers (signups)
-        customer_signups_live = User.objects.filter(is_driver=False).count()
-
-        # Riders (signups)
-        rider_signups_live = User.objects.filter(is_driver=True).count()
-
-        # Riders available
-        rider_available_live = User.objects.filter(state='available', is_driver=True).count()
-
-        # Rides finalized
-        rides_finalized_live = Ride.objects.filter(state='finalized').count()
-
-        #Revenue table (total, cash, mpesa, twende)        
-        revenue_total = Ride.objects.filter(created__month=10, created__year=2017, state='finalized').aggregate(Sum('fare')).get('fare__sum')
-
-        revenue_cash = Ride.objects.filter(created__month=10, created__year=2017, state='finalized', payment_method='cash').aggregate(Sum('fare')).get('fare__sum')
-
-        revenue_mpesa = Ride.objects.filter(created__month=10, created__year=2017, state='finalized', payment_method='mpesa').aggregate(Sum('fare')).get('fare__sum')
+@method_decorator(staff_member_required, name='dispatch')
+class LocationTileView(View):
+    """
+    GET /tiles/<z>/<x>/<y>.pbf (vector tile) or .geojson of the location
+    history, optionally for ?user=<pk> and from ?since= until ?until= (dates).
+    """
+    content_types = {
+        'pbf': 'application/vnd.mapbox-vector-tile',
+        'geojson': 'application/geo+json',
+    }
+
+    def get(self, request, z, x, y, format=None):
+        format = format or 'pbf'
+        z, x, y = int(z), int(x), int(y)
+        if z > settings.LOCATION_TILES['MAX_ZOOM'] or x >= 2 ** z or y >= 2 ** z:
+            raise Http404
+        try:
+            filters = self.get_filters(request)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+
+        options = settings.LOCATION_TILES
+        cache = caches[options['CACHE']]
+        key = 'tile:{0}:{1}/{2}/{3}:{4}'.format(format, z, x, y, urlencode(sorted(request.GET.items())))
+        content = cache.get(key)
+        if content is None:
+            if format == 'geojson':
+                content = json.dumps(tiles.geojson_tile(z, x, y, options['PIXELS'], **filters))
+            else:
+                content = tiles.vector_tile(z, x, y, options['PIXELS'], **filters)
+            cache.set(key, content, options['TIMEOUT'])
+        response = HttpResponse(content, content_type=self.content_types[format])
+        patch_cache_control(response, private=True, max_age=options['TIMEOUT'])
+        return response
+
+    def get_filters(self, request):
+        filters = {}
+        if request.GET.get('user'):
+            try:
+                filters['user'] = int(request.GET['user'])
+            except ValueError:
+                raise ValueError('Invalid user')
+        for name in ('since', 'until'):
+            if request.GET.get(name):
+                day = parse_date(request.GET[name])
+                if day is None:
+                    raise ValueError('Invalid {0}, expected YYYY-MM-DD'.format(name))
+                filters[name] = make_aware(datetime.datetime.combine(day, datetime.time.min))
+        return filters
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class KpiView(TemplateView):
+    """
+    KPIs per ?period= (day, week, month, quarter or year) from ?from= to ?to=
+    (dates), read from the DailyKPI rollup.
+    """
+    template_name = 'kpi.html'
 
-        # revenue_twende = revenue_total * 2/10
+    def get_context_data(self, **kwargs):
+        context = super(KpiView, self).get_context_data(**kwargs)
+        start, end, period = kpis.report_options(self.request.GET)
+        rows = kpis.report(start, end, period)
+        context.update(rows=rows[:-1], total=rows[-1], start=start, end=end,
+                       period=period, periods=kpis.PERIODS)
+        return context
 
-        # Table to test KPIs
-        return HttpResponse("<h1>Signups: " + str(rides_finalized) + "</h1>" "<br>"
-                                                                     "<h1>New signups: " + str(
-            rider_signups_new) + "</h1>" "<br>"
-                                 "<table>"
-                                 "<tr>" "<th></th>" "<th>January</th>" "<th>February</th>" "<th>March</th>" "</str>"
-                                 "<tr>" "<td>Rides</td>" "<td>" + str(customer_signups) + "</td>" "<td>" + str(
-            customer_paying_new) + "</td>" "<td>March</td>" "</tr>"
-                                   "</table>")
 
-    
 @method_decorator(csrf_exempt, name='dispatch')
 class MpesaStatusUpdate(View):
+    """
+    Payment provider callbacks, queued for payment_callback_worker.
+    """
 
     def post(self, request, *args, **kwargs):
+        body = request.body.decode('utf-8', 'replace')
         try:
-            body = json.dumps(eval(request.body))
-        except SyntaxError:
-            body = json.dumps(request.POST)
-        PaymentResponseLog.objects.create(
-            request=body,
-            response=json.dumps(kwargs)
-        )
+            payload = json.loads(body)
+        except ValueError:
+            # Form posts; other bodies are only kept as they came
+            payload = request.POST.dict() or None
+        PaymentCallback.objects.create(payload=payload, body=body)
         return HttpResponse('success')
 
 # API views
@@ -198,25 +229,98 @@ class AccountListView(generics.CreateAPIView):
 
 class LocationLogView(generics.CreateAPIView):
     """
-    Update geo location
+    Update geo location. Pings the filter does not store are answered with
+    200 and {"status": "suppressed"} or {"status": "rejected"}.
     """
     queryset = LocationLog.objects.all()
     serializer_class = LocationLogSerializer
 
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        verdict = self.perform_create(serializer)
+        if verdict != ACCEPTED:
+            return Response({'status': verdict}, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def perform_create(self, serializer):
+        user = self.request.user
+        location = serializer.validated_data['location']
+        verdict = get_ping_filter().check(user.pk, location, now())
+        if verdict == REJECTED:
+            return verdict
+        if user.is_driver:
+            track_driver(user, location)
+        if verdict == ACCEPTED:
+            serializer.save(user=user)
+            if user.is_driver:
+                Ride.record_waypoints(user, [(location, now())])
+                events.driver_moved(user, location)
+        return verdict
+
+
+class LocationBatchView(generics.GenericAPIView):
+    """
+    Upload buffered geo locations: [{"latitude", "longitude", "created"}, ...]
+    """
+    serializer_class = LocationBatchSerializer
+    permission_classes = (permissions.IsAuthenticated,)
 
-class AccountMeView(generics.RetrieveUpdateAPIView):
+    def post(self, request, *args, **kwargs):
+        data = {'points': request.data} if isinstance(request.data, list) else request.data
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        user = request.user
+        ping_filter = get_ping_filter()
+        received = stored = 0
+        valid = []
+        for point in serializer.validated_data['points']:
+            location = Point(point['longitude'], point['latitude'], srid=4326)
+            verdict = ping_filter.check(user.pk, location, point['created'])
+            received += 1
+            if verdict != REJECTED:
+                valid.append((location, point['created'], verdict == ACCEPTED))
+        if not valid:
+            return Response({'received': received, 'stored': 0, 'last_ping': None}, status=status.HTTP_201_CREATED)
+
+        points = [(location, created) for location, created, accepted in valid if accepted]
+        LocationLog.bulk_insert(user, points)
+        position, last_ping, accepted = valid[-1]
+        User.objects.filter(pk=user.pk).update(position=position, last_ping=last_ping, updated=now())
+        if user.is_driver:
+            track_driver(user, position)
+            Ride.record_waypoints(user, points)
+            if points:
+                events.driver_moved(user, points[-1][0])
+        return Response({'received': received, 'stored': len(points), 'last_ping': last_ping},
+                        status=status.HTTP_201_CREATED)
+
+
+class AccountMeView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     permission_classes = (IsCurrentUser,)
     queryset = User.objects.all()
     serializer_class = AccountSerializer
 
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        if user.is_authenticated():
+            # The apps poll this endpoint, record the login at most every LAST_LOGIN_INTERVAL
+            if not user.last_login or (now() - user.last_login).total_seconds() > settings.LAST_LOGIN_INTERVAL:
+                user.last_login = now()
+                # Not through User.save(): `updated`, and with it the ETag, stays as it is
+                User.objects.filter(pk=user.pk).update(last_login=user.last_login)
+        return super(AccountMeView, self).get(request, *args, **kwargs)
+
+    def get_version(self):
+        user = self.request.user
+        if user.is_authenticated():
+            return version_of(user.pk, user.updated)
+        return None
+
     def get_object(self):
         if self.request.user.is_authenticated():
-            user = self.request.user
-            update_last_login(None, user)
-            return user
+            return self.request.user
         raise Http404
 
 
@@ -226,7 +330,8 @@ class DriverListView(generics.ListAPIView):
     """
     queryset = User.geo_objects.filter(is_driver=True)
     serializer_class = DriverSerializer
-    filter_backends = (filters.OrderingFilter,)
+    # Lists of the nearest drivers, ordered by distance
+    filter_backends = ()
 
     def get_queryset(self):
         if 'latitude' in self.request.query_params and \
@@ -235,11 +340,36 @@ class DriverListView(generics.ListAPIView):
                           float(self.request.query_params['latitude']))
         else:
             raise exceptions.ParseError('Latitude and longitude are required')
-        qs = self.queryset
-        qs = qs.filter(position__distance_lt=(point, Distance(km=settings.MAXIMUM_DRIVER_DISTANCE)))
-        qs = qs.distance(point).order_by('distance')
-        qs = qs.filter(state='available')
-        return qs
+        try:
+            limit = int(self.request.query_params.get('limit', settings.NEAREST_DRIVERS))
+            limit = max(1, min(limit, settings.NEAREST_DRIVERS))
+        except ValueError:
+            raise exceptions.ParseError('limit must be a number')
+        drivers = self.nearest_live(point, limit)
+        if drivers or not settings.LIVE_DRIVERS_DB_FALLBACK:
+            return drivers or []
+        return User.nearest_drivers(point, limit, [km * 1000 for km in settings.DRIVER_SEARCH_RADII])
+
+    def nearest_live(self, point, limit):
+        """
+        Nearest available drivers from the live position store, with the
+        same `distance` attribute as the database query; None when the store
+        is down.
+        """
+        try:
+            found = get_driver_store().nearest(point, limit, settings.MAXIMUM_DRIVER_DISTANCE * 1000)
+        except Exception:
+            logger.exception('Live driver store unavailable')
+            return None
+        if not found:
+            return []
+        users = self.queryset.filter(state='available').in_bulk([pk for pk, meters in found])
+        drivers = []
+        for pk, meters in found:
+            if pk in users:
+                users[pk].distance = Distance(m=meters)
+                drivers.append(users[pk])
+        return drivers
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -287,7 +417,7 @@ class RatingViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class RideDetailView(generics.RetrieveUpdateAPIView):
+class RideDetailView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Ride.objects.all()
     serializer_class = RideSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -300,35 +430,130 @@ class RideDetailView(generics.RetrieveUpdateAPIView):
             rides = rides.filter(customer=self.request.user)
         return rides
 
+    def get_version(self):
+        stamps = self.get_queryset().filter(pk=self.kwargs['pk']).values_list(
+            'updated', 'customer__updated', 'driver__updated').first()
+        return version_of(self.kwargs['pk'], *stamps) if stamps else None
+
     def perform_update(self, serializer):
         if self.request.user.is_driver:
             return serializer.save(driver=self.request.user)
         return serializer.save()
 
 
-class RideListView(generics.ListCreateAPIView):
+class RideWaitView(RideDetailView):
     """
-    API endpoint for rides
+    GET /api/rides/1/wait/?since=<version>: the ride if its version is past
+    `since`, else 304 Not Modified. The ASGI app in delivery/asgi.py serves
+    this path by holding the request until the ride changes; this view is the
+    non-blocking fallback behind WSGI.
     """
-    queryset = Ride.objects.order_by('-created').all()
+    http_method_names = ['get', 'head', 'options']
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            raise exceptions.ParseError('Invalid since')
+        ride = self.get_object()
+        if ride.version <= since:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return Response(self.get_serializer(ride).data)
+
+
+class RideTransitionView(generics.GenericAPIView):
+    """
+    Move a ride to its next state, e.g. POST /api/rides/1/accept/
+    """
+    queryset = Ride.objects.all()
     serializer_class = RideSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    def get_queryset(self):
+        rides = self.queryset
+        if self.request.user.is_driver:
+            rides = rides.filter(driver=self.request.user)
+        else:
+            rides = rides.filter(customer=self.request.user)
+        return rides
+
+    def post(self, request, *args, **kwargs):
+        ride = self.get_object()
+        location = PointSerializer().to_internal_value(request.data['location']) \
+            if request.data.get('location') else None
+        try:
+            transition_ride(ride, kwargs['transition'], user=request.user, location=location)
+        except TransitionNotAllowed as e:
+            raise exceptions.ValidationError({'state': [str(e)]})
+        return Response(self.get_serializer(ride).data)
+
+
+class RideRouteView(generics.RetrieveAPIView):
+    """
+    Route of a ride as an encoded polyline, simplified for the requested zoom
+    """
+    queryset = Ride.objects.select_related('route_cache')
+    permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         rides = self.queryset
         if self.request.user.is_driver:
             rides = rides.filter(driver=self.request.user)
         else:
-            rides = rides.filter(customer=self.request.user)        
-        if rides.count():
-            ride = rides[0]
-            # check that the latest ride has a relevant state 
-            if ride.state in ['requested', 'accepted', 'driving', 'dropoff', 'payment', 'rating']:
-                # Return only the latest ride
-                return [rides[0]]
-        # Return empty results set
-        return []
+            rides = rides.filter(customer=self.request.user)
+        return rides
+
+    def retrieve(self, request, *args, **kwargs):
+        ride = self.get_object()
+        zoom = route_zoom(request.query_params, strict=True)
+        return Response({
+            'id': ride.id,
+            'zoom': zoom,
+            'polyline': ride.encoded_route(zoom),
+        })
+
+
+class RideListView(ConditionalGetMixin, generics.ListCreateAPIView):
+    """
+    API endpoint for rides
+    """
+    queryset = Ride.objects.order_by('-created').all()
+    serializer_class = RideSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+
+    def get_queryset(self):
+        # Only the user's active ride, through the User.current_ride pointer
+        ride_id = self.request.user.current_ride_id
+        if not ride_id:
+            return []
+        rides = self.queryset.select_related('customer', 'driver', 'trajectory')
+        ride = rides.filter(pk=ride_id, state__in=Ride.active_states).first()
+        if ride is None:
+            ride = self.latest_active_ride(rides)
+        return [ride] if ride else []
+
+    def get_version(self):
+        user = self.request.user
+        if not user.current_ride_id:
+            return version_of(None, user.updated)
+        stamps = Ride.objects.filter(pk=user.current_ride_id, state__in=Ride.active_states).values_list(
+            'updated', 'customer__updated', 'driver__updated').first()
+        # A stale pointer is repaired by get_queryset()
+        return version_of(user.current_ride_id, *stamps) if stamps else None
+
+    def latest_active_ride(self, rides):
+        """
+        Stale pointer: look for the latest ride, on the (driver|customer, -created)
+        index, and repair the pointer.
+        """
+        user = self.request.user
+        rides = rides.filter(driver=user) if user.is_driver else rides.filter(customer=user)
+        ride = rides.first()
+        if ride is None or ride.state not in Ride.active_states:
+            ride = None
+        User.objects.filter(pk=user.pk).update(current_ride=ride)
+        return ride
 
     def perform_create(self, serializer):
         return serializer.save(customer=self.request.user)
@@ -354,7 +579,20 @@ class RecentRideListView(generics.ListAPIView):
         return rides
 
 
-class ErrorLogView(generics.CreateAPIView):
+class ErrorLogView(generics.GenericAPIView):
+    """
+    Error reports of the apps: one report, a list of them or {"errors": [...]}.
+    """
+    serializer_class = ErrorLogBatchSerializer
 
-    queryset = ErrorLog.objects
-    serializer_class = ErrorLogSerializer
+    def post(self, request, *args, **kwargs):
+        data = request.data
+        if isinstance(data, list):
+            data = {'errors': data}
+        elif 'errors' not in data:
+            data = {'errors': [data]}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        reports = serializer.validated_data['errors']
+        stored = errorlog.record(reports)
+        return Response({'received': len(reports), 'stored': stored}, status=status.HTTP_201_CREATED)